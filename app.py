@@ -1,18 +1,53 @@
-from flask import Flask, request, redirect, url_for, render_template_string, flash
-import mysql.connector
-import secrets
-import smtplib
-from email.message import EmailMessage
-from werkzeug.security import generate_password_hash
-import re
+from flask import Flask, Response, g, request, redirect, url_for, render_template, flash, session
+import hmac
 import os
+import re
 import signal
+import threading
 import sys
+import math
 import time
-import socket
+import uuid
+from email.message import EmailMessage
 
-app = Flask(__name__)
-app.secret_key = 'devsecret'  # direct secret key
+# mysql.connector, smtplib and aiosmtplib are imported where they are first
+# needed (smtp_pool.py included), so worker processes and CLI tools start
+# without them. The email package is not deferred: Flask already loads it.
+import logs
+import metrics
+from credentials import generate_credentials, generate_user_id
+from db_pool import ConnectionPool
+from domain_scheduler import DomainScheduler
+from dkim_signing import DKIMSigner, SigningPool
+from email_templates import EmailTemplates
+from export import FORMATS as EXPORT_FORMATS, parse_after, stream_users
+from hashing import HashPool, HashPoolSaturated, HashPoolUnavailable
+from outbox import Outbox
+from page_cache import AssetManifest, PrecompressedBody
+from ratelimit import MemoryBucketStore, RateLimiter, RateLimitExceeded, RedisBucketStore, normalize_email_key
+from relays import CircuitBreaker, Relay, RelayRouter
+from singleflight import SingleFlight
+from smtp_pool import SMTPPool
+from storage import (DuplicateUserId, EmailAlreadyRegistered, MySQLUserStore, ShardedUserStore, SQLiteUserStore,
+                     StorageError)
+from user_cache import ABSENT, BloomFilter, UserLookupCache
+from validation import (DISPOSABLE_DOMAINS, EmailValidator, MXCache, dns_mx_resolver, load_domain_list,
+                        normalize_email, validate_email)
+
+# ---------------- Logging ----------------
+# One JSON event per line on stderr, written by a background thread so a
+# slow log sink never holds up a request (see logs.py).
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
+LOG_QUEUE_SIZE = 10000          # records awaiting the writer; beyond this they are dropped and counted
+LOG_SAMPLE_RATES = {'request': 0.1, 'email_sent': 0.1}  # share of these success events kept
+# Keys the email hash in log events, so it cannot be matched against a list of
+# addresses. Unset, each process draws a random key and hashes from different
+# workers or restarts do not match.
+LOG_EMAIL_HASH_KEY = os.environ.get('LOG_EMAIL_HASH_KEY', '')
+
+logs.configure(LOG_LEVEL, queue_size=LOG_QUEUE_SIZE, rates=LOG_SAMPLE_RATES,
+               hash_key=LOG_EMAIL_HASH_KEY.encode('utf-8'))
+log = logs.get_logger('app')
 
 # ---------------- Database Config ----------------
 DB_CONFIG = {
@@ -21,6 +56,90 @@ DB_CONFIG = {
     'password': '',        
     'database': 'userdb'   
 }
+DB_POOL_SIZE = 5                # idle connections kept open
+DB_POOL_MAX_OVERFLOW = 5        # extra connections allowed under load
+DB_POOL_RECYCLE = 1800          # seconds before a connection is replaced
+DB_POOL_PRE_PING = True         # verify connections on checkout
+DB_POOL_TIMEOUT = 10            # seconds to wait for a free connection
+
+# 'mysql' (DB_CONFIG, or DB_SHARDS when set) or 'sqlite' (SQLITE_PATH)
+DB_BACKEND = os.environ.get('DB_BACKEND', 'mysql')
+SQLITE_PATH = os.environ.get('SQLITE_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'users.db'))
+# Connection settings of each MySQL shard, e.g. [dict(DB_CONFIG, host='db1'), dict(DB_CONFIG, host='db2')].
+# Users are placed by a hash of their email, so never reorder this list, and
+# changing its length means moving existing users between shards.
+DB_SHARDS = []
+
+def make_db_pool(config):
+    return ConnectionPool(config,
+                          size=DB_POOL_SIZE,
+                          max_overflow=DB_POOL_MAX_OVERFLOW,
+                          recycle=DB_POOL_RECYCLE,
+                          pre_ping=DB_POOL_PRE_PING,
+                          timeout=DB_POOL_TIMEOUT)
+
+def make_user_store():
+    if DB_BACKEND == 'sqlite':
+        return SQLiteUserStore(SQLITE_PATH)
+    if DB_BACKEND != 'mysql':
+        raise ValueError(f'Unknown DB_BACKEND {DB_BACKEND!r}')
+    if DB_SHARDS:
+        return ShardedUserStore([MySQLUserStore(make_db_pool(config)) for config in DB_SHARDS])
+    return MySQLUserStore(make_db_pool(DB_CONFIG))
+
+user_store = make_user_store()
+
+# ---------------- User Lookup Cache ----------------
+# email -> user id (or known absent), kept current by save_user/update_password.
+USER_CACHE_SIZE = 50000
+USER_CACHE_TTL = 3600
+USER_CACHE_NEGATIVE_TTL = 30     # short: another worker may register the address
+# Bloom filter of registered emails built from the users table on first use.
+# Only enable it when this process sees every insert (a single worker, no
+# provision.py runs), otherwise newly registered addresses look absent.
+USER_BLOOM_FILTER = False
+USER_BLOOM_ERROR_RATE = 0.001
+
+user_cache = UserLookupCache(max_entries=USER_CACHE_SIZE,
+                             ttl=USER_CACHE_TTL,
+                             negative_ttl=USER_CACHE_NEGATIVE_TTL)
+user_bloom = None
+user_bloom_lock = threading.Lock()
+
+# ---------------- Rate Limiting Config ----------------
+# rule -> (burst, per seconds). Checked before any DB or hashing work.
+RATE_LIMITS = {
+    'register_ip': (10, 60),
+    'register_email': (3, 3600),
+    'forgot_ip': (10, 60),
+    'forgot_email': (3, 3600),
+}
+RATE_LIMIT_STORAGE = 'memory'   # or a redis:// URL to share limits between workers
+# The *_ip rules key on the client address. Behind a reverse proxy every request
+# comes from the proxy, so set this to the number of proxies in front of the app
+# and their X-Forwarded-For/-Proto headers are trusted (werkzeug ProxyFix). Leave
+# it at 0 when clients connect directly, or they could forge their address.
+TRUSTED_PROXIES = int(os.environ.get('TRUSTED_PROXIES', 0))
+
+if RATE_LIMIT_STORAGE == 'memory':
+    rate_limiter = RateLimiter(MemoryBucketStore(), RATE_LIMITS)
+    # SMTP relay ceilings get their own store: a flood of client IPs in the LRU
+    # above would evict the relay buckets, and an evicted bucket comes back full
+    relay_bucket_store = MemoryBucketStore(max_keys=None)
+else:
+    rate_limiter = RateLimiter(RedisBucketStore(RATE_LIMIT_STORAGE), RATE_LIMITS)
+    relay_bucket_store = rate_limiter.store
+
+# ---------------- Request Coalescing ----------------
+# Duplicate /forgot requests (double clicks, client retries) share one reset
+# instead of each hashing, writing and mailing a new password. Per worker process.
+FORGOT_COALESCE_WINDOW = 10         # seconds a finished reset is shared with repeats for the same email
+IDEMPOTENCY_KEY_TTL = 86400         # seconds an Idempotency-Key's result is replayed
+IDEMPOTENCY_MAX_KEYS = 100000
+IDEMPOTENCY_KEY_MAX_LENGTH = 255    # longer keys are ignored
+
+forgot_flights = SingleFlight(window=FORGOT_COALESCE_WINDOW)
+idempotent_requests = SingleFlight(window=IDEMPOTENCY_KEY_TTL, max_entries=IDEMPOTENCY_MAX_KEYS)
 
 # ---------------- SMTP Config ----------------
 SMTP_USER = "SMTP_USER"        # Gmail
@@ -28,757 +147,650 @@ SMTP_PASS = "SMTP_PASS"         # Gmail App Password
 SMTP_HOST = "smtp.gmail.com"
 SMTP_PORT = 587
 FROM_EMAIL = SMTP_USER
+SMTP_USE_TLS = True
+SMTP_POOL_SIZE = 4              # max concurrent SMTP sessions
+SMTP_IDLE_TIMEOUT = 60          # seconds before an idle session is dropped
+SMTP_HEALTH_CHECK_AFTER = 5     # NOOP sessions idle longer than this before reuse
+SMTP_MAX_MESSAGES_PER_SESSION = 100  # relay's per-connection message limit
+
+# 'pool' sends with blocking smtplib sessions (smtp_pool.py); 'async' uses the
+# asyncio engine in async_sender.py (requires aiosmtplib) with concurrent sessions.
+SMTP_ENGINE = 'pool'
+SMTP_ASYNC_SESSIONS = 8
+SMTP_RELAY_CONNECTION_LIMIT = None  # relay's cap on concurrent connections, if any
+
+# Mail is spread over these relays by weight. A relay that keeps failing is
+# skipped for SMTP_RELAY_COOLDOWN seconds and its mail fails over to the others.
+# rate_limit is the provider's sending ceiling as (messages, per seconds) for the
+# whole host. With RATE_LIMIT_STORAGE = 'memory' every worker process has its own
+# buckets, so each enforces an equal share (messages // SERVER_WORKERS); use Redis
+# to let busy workers borrow what idle ones leave unused.
+SMTP_RELAYS = [
+    {'name': 'gmail', 'host': SMTP_HOST, 'port': SMTP_PORT, 'user': SMTP_USER, 'password': SMTP_PASS,
+     'weight': 1, 'rate_limit': (2000, 86400)},
+    # {'name': 'backup', 'host': 'smtp.example.com', 'port': 587, 'user': '...', 'password': '...',
+    #  'weight': 1, 'rate_limit': None},
+]
+SMTP_RELAY_FAILURE_THRESHOLD = 5    # consecutive failures before a relay is taken out
+SMTP_RELAY_COOLDOWN = 60
+SERVER_WORKERS = int(os.environ.get('WEB_CONCURRENCY', 1))  # worker processes, set by gunicorn.conf.py
+
+def relay_rate_limit(relay):
+    """The relay's ceiling as this process enforces it: its share unless the buckets are shared"""
+    limit = relay.get('rate_limit')
+    if limit is None or RATE_LIMIT_STORAGE != 'memory':
+        return limit
+    messages, per_seconds = limit
+    return max(1, messages // SERVER_WORKERS), per_seconds
+
+def make_smtp_sender(relay):
+    if SMTP_ENGINE == 'async':
+        from async_sender import AsyncSMTPSender
+        return AsyncSMTPSender(relay['host'], relay['port'], relay.get('user'), relay.get('password'),
+                               sessions=SMTP_ASYNC_SESSIONS,
+                               relay_limit=SMTP_RELAY_CONNECTION_LIMIT,
+                               use_tls=relay.get('use_tls', SMTP_USE_TLS),
+                               idle_timeout=SMTP_IDLE_TIMEOUT)
+    return SMTPPool(relay['host'], relay['port'], relay.get('user'), relay.get('password'),
+                    size=SMTP_POOL_SIZE,
+                    idle_timeout=SMTP_IDLE_TIMEOUT,
+                    health_check_after=SMTP_HEALTH_CHECK_AFTER,
+                    use_tls=relay.get('use_tls', SMTP_USE_TLS),
+                    max_messages_per_session=SMTP_MAX_MESSAGES_PER_SESSION)
+
+smtp_sender = RelayRouter(
+    [Relay(relay['name'], make_smtp_sender(relay),
+           weight=relay.get('weight', 1),
+           rate_limit=relay_rate_limit(relay),
+           breaker=CircuitBreaker(SMTP_RELAY_FAILURE_THRESHOLD, SMTP_RELAY_COOLDOWN))
+     for relay in SMTP_RELAYS],
+    relay_bucket_store,
+    reply_code=lambda error: smtp_reply_code(error))
+
+# ---------------- DKIM Signing ----------------
+# Outgoing mail is signed when DKIM_KEY_FILE points at a PEM private key (RSA
+# or Ed25519, requires cryptography). Publish the public key in a TXT record
+# at <DKIM_SELECTOR>._domainkey.<DKIM_DOMAIN>.
+DKIM_KEY_FILE = os.environ.get('DKIM_KEY_FILE')
+DKIM_SELECTOR = 'mail'
+DKIM_DOMAIN = FROM_EMAIL.rpartition('@')[2]
+DKIM_SIGNING_WORKERS = 2        # threads signing ahead of the SMTP session in batch sends
 
-# ---------------- Helper Functions for Port Management ----------------
-def is_port_in_use(port):
-    """Check if a port is in use"""
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-        return s.connect_ex(('localhost', port)) == 0
+dkim_signer = DKIMSigner(DKIM_DOMAIN, DKIM_SELECTOR, DKIM_KEY_FILE) if DKIM_KEY_FILE else None
+dkim_pool = SigningPool(dkim_signer, workers=DKIM_SIGNING_WORKERS) if dkim_signer else None
 
-def find_free_port():
-    """Find a free port"""
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-        s.bind(('', 0))
-        s.listen(1)
-        port = s.getsockname()[1]
-    return port
+# ---------------- Password Hashing Config ----------------
+HASH_METHOD = 'scrypt:32768:8:1'   # werkzeug method string, tune per deployment
+HASH_SALT_LENGTH = 16
+HASH_WORKERS = int(os.environ.get('HASH_WORKERS', 0)) or os.cpu_count()  # worker processes
+HASH_MAX_PENDING = None             # queued hashes before rejecting; default 4 per worker
+HASH_TIMEOUT = 30                   # seconds a request waits for its hash before answering 503
+
+hash_pool = HashPool(workers=HASH_WORKERS,
+                     max_pending=HASH_MAX_PENDING,
+                     method=HASH_METHOD,
+                     salt_length=HASH_SALT_LENGTH,
+                     timeout=HASH_TIMEOUT)
 
 # ---------------- Database Functions ----------------
-def get_conn():
-    try:
-        conn = mysql.connector.connect(**DB_CONFIG)
-        return conn
-    except mysql.connector.Error as err:
-        print(f"Database Error: {err}")
-        flash('Database connection error. Please try again later.', 'error')
-        return None
+SAVE_USER_ID_ATTEMPTS = 3
 
 def save_user(email, password_hash, user_id):
-    conn = get_conn()
-    if not conn:
-        return False
+    """Insert a user in a single statement and return the id it was stored under.
+
+    The UNIQUE key on email makes the INSERT itself the existence check: a
+    duplicate email raises EmailAlreadyRegistered, and a (rare) clash on the
+    random id is retried with a fresh one. Returns None on database errors.
+    """
     try:
-        cur = conn.cursor()
-        cur.execute("INSERT INTO users (id,email,password_hash) VALUES (%s,%s,%s)", (user_id,email,password_hash))
-        conn.commit()
-        return True
-    except mysql.connector.Error as err:
-        print(f"Error saving user: {err}")
-        return False
-    finally:
-        cur.close()
-        conn.close()
+        for _ in range(SAVE_USER_ID_ATTEMPTS):
+            try:
+                user_store.save_user(user_id, email, password_hash)
+            except DuplicateUserId:
+                user_id = generate_user_id()
+                continue
+            user_cache.put(email, user_id)
+            if user_bloom is not None:
+                user_bloom.add(email)
+            return user_id
+        log.error('save_user_failed', error=f'no free id after {SAVE_USER_ID_ATTEMPTS} attempts')
+        return None
+    except StorageError as err:
+        log.error('save_user_failed', error=str(err))
+        return None
 
 def update_password(email, new_hash):
-    conn = get_conn()
-    if not conn:
-        return False
+    """Returns True if a user was updated, False if the email is unknown, None on error"""
     try:
-        cur = conn.cursor()
-        cur.execute("UPDATE users SET password_hash=%s WHERE email=%s", (new_hash,email))
-        conn.commit()
-        updated = cur.rowcount > 0
-        return updated
-    except mysql.connector.Error as err:
-        print(f"Error updating password: {err}")
-        return False
-    finally:
-        cur.close()
-        conn.close()
+        updated = user_store.update_password(email, new_hash)
+    except StorageError as err:
+        log.error('update_password_failed', error=str(err))
+        return None
+    if updated:
+        user_cache.invalidate(email)
+    else:
+        user_cache.put(email, ABSENT)
+    return updated
 
-def user_exists(email):
-    conn = get_conn()
-    if not conn:
+def load_user_bloom():
+    """Build the Bloom filter of registered emails from the users table"""
+    try:
+        bloom = BloomFilter(max(2 * user_store.count(), 10000), USER_BLOOM_ERROR_RATE)
+        for email in user_store.iter_emails():
+            bloom.add(email)
+        return bloom
+    except StorageError as err:
+        log.error('user_bloom_load_failed', error=str(err))
         return None
+
+def cached_user_lookup(email):
+    """Return the cached user id, ABSENT, or None if the database must be asked"""
+    global user_bloom
+    cached = user_cache.get(email)
+    if cached is not None:
+        return cached
+    if USER_BLOOM_FILTER:
+        if user_bloom is None:
+            with user_bloom_lock:
+                if user_bloom is None:
+                    user_bloom = load_user_bloom()
+        if user_bloom is not None and email not in user_bloom:
+            metrics.user_bloom_negatives.inc()
+            return ABSENT
+    return None
+
+def user_exists(email):
+    cached = cached_user_lookup(email)
+    if cached is not None:
+        return None if cached is ABSENT else cached
     try:
-        cur = conn.cursor()
-        cur.execute("SELECT id FROM users WHERE email=%s", (email,))
-        row = cur.fetchone()
-        return row[0] if row else None
-    except mysql.connector.Error as err:
-        print(f"Error checking user existence: {err}")
+        user_id = user_store.find_user_id(email)
+    except StorageError as err:
+        log.error('user_lookup_failed', error=str(err))
         return None
-    finally:
-        cur.close()
-        conn.close()
+    user_cache.put(email, ABSENT if user_id is None else user_id)
+    return user_id
 
 # ---------------- Helper Functions ----------------
-def generate_credentials():
-    user_id = secrets.token_hex(4)        # 8-char ID
-    password = secrets.token_urlsafe(8)   # Random password
-    return user_id, password
+def generate_password_hash(password):
+    with metrics.timed('hash'):
+        return hash_pool.hash(password)
+
+def server_busy():
+    flash('The server is busy right now. Please try again in a moment.', 'error')
+    return render_template('index.html'), 503, {'Retry-After': '5'}
+
+def too_many_requests(retry_after):
+    flash('Too many requests. Please wait a while and try again.', 'error')
+    return render_template('index.html'), 429, {'Retry-After': str(max(1, math.ceil(retry_after)))}
+
+def check_rate_limit(rule, key):
+    """Raise RateLimitExceeded if ``key`` is over its RATE_LIMITS ``rule``"""
+    allowed, retry_after = rate_limiter.hit(rule, key)
+    if not allowed:
+        metrics.rate_limited.inc(rule)
+        raise RateLimitExceeded(rule, retry_after)
+
+def rate_limited(rule, key):
+    """Return a 429 response if ``key`` is over its RATE_LIMITS ``rule``, else None"""
+    try:
+        check_rate_limit(rule, key)
+    except RateLimitExceeded as e:
+        return too_many_requests(e.retry_after)
+    return None
 
-def send_email(to_email, subject, body, is_html=False):
+def build_message(to_email, subject, body, is_html=False, text_body=None):
+    msg = EmailMessage()
+    msg['Subject'] = subject
+    msg['From'] = FROM_EMAIL
+    msg['To'] = to_email
+    if is_html:
+        if text_body:
+            msg.set_content(text_body)
+        msg.add_alternative(body, subtype='html')
+    else:
+        msg.set_content(body)
+    return msg
+
+def deliver_email(to_email, subject, body, is_html=False, text_body=None):
+    """Build, sign and send a message, raising on any SMTP error"""
+    msg = build_message(to_email, subject, body, is_html, text_body)
+    if dkim_signer is not None:
+        dkim_signer.sign(msg)
+    try:
+        smtp_sender.send_message(msg)
+    except Exception as e:
+        metrics.smtp_sends.inc('failure', smtp_reply_code(e) or 'none')
+        raise
+    metrics.smtp_sends.inc('success', 250)
+
+def smtp_reply_code(error):
+    """SMTP reply code carried by an smtplib/aiosmtplib exception, or None"""
+    import smtplib
+    recipients = getattr(error, 'recipients', None)
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return next((code for code, _ in recipients.values()), None)
+    if isinstance(recipients, list) and recipients:     # aiosmtplib.SMTPRecipientsRefused
+        return getattr(recipients[0], 'code', None)
+    code = getattr(error, 'smtp_code', None) or getattr(error, 'code', None)
+    return code if isinstance(code, int) else None
+
+def send_email(to_email, subject, body, is_html=False, text_body=None):
     try:
-        msg = EmailMessage()
-        msg['Subject'] = subject
-        msg['From'] = FROM_EMAIL
-        msg['To'] = to_email
-        if is_html:
-            msg.add_alternative(body, subtype='html')
+        deliver_email(to_email, subject, body, is_html, text_body)
+        return True
+    except Exception as e:
+        log.error('email_send_failed', smtp_code=smtp_reply_code(e), error=str(e))
+        return False
+
+def send_batch(items, is_html=True):
+    """Send many messages, reusing one SMTP session per relay for consecutive messages.
+
+    ``items`` is an iterable of ``(to_email, subject, body)`` or
+    ``(to_email, subject, html_body, text_body)`` tuples and is consumed
+    lazily. Returns ``{to_email: True | exception}``.
+    """
+    messages = (build_message(item[0], item[1], item[2], is_html, item[3] if len(item) > 3 else None)
+                for item in items)
+    if dkim_pool is not None:
+        messages = dkim_pool.sign_stream(messages)
+    results = smtp_sender.send_batch(messages)
+    for result in results.values():
+        if result is True:
+            metrics.smtp_sends.inc('success', 250)
         else:
-            msg.set_content(body)
-        with smtplib.SMTP(SMTP_HOST, SMTP_PORT) as smtp:
-            smtp.starttls()
-            smtp.login(SMTP_USER, SMTP_PASS)
-            smtp.send_message(msg)
+            metrics.smtp_sends.inc('failure', smtp_reply_code(result) or 'none')
+    return results
+
+# ---------------- Email Templates ----------------
+# Compiled once from templates/email/ and reloaded when the files change.
+EMAIL_TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates', 'email')
+
+email_templates = EmailTemplates(EMAIL_TEMPLATE_DIR)
+
+# ---------------- Email Outbox ----------------
+# Routes enqueue mail here and return immediately; background threads deliver it.
+OUTBOX_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'outbox.db')
+OUTBOX_WORKERS = 2
+OUTBOX_MAX_ATTEMPTS = 5
+OUTBOX_BACKOFF_BASE = 30        # seconds; doubled on every 4xx/transient failure, with jitter
+OUTBOX_BACKOFF_MAX = 3600
+OUTBOX_BACKOFF_JITTER = 0.5     # retry after 50-100% of the backoff so greylisted mail spreads out
+OUTBOX_LOG_RETENTION = 7 * 86400  # seconds of delivery log (and finished messages) to keep
+
+# Outbox mail is sent through per-recipient-domain queues served round-robin.
+# A domain answering 421/4xx is paused with exponential backoff and its rate
+# halved, so a throttling provider only delays its own mail.
+SMTP_DOMAIN_WORKERS = 8             # concurrent deliveries across all domains
+SMTP_DOMAIN_CONCURRENCY = 2         # per domain, unless overridden below
+SMTP_DOMAIN_LIMITS = {}             # e.g. {'gmail.com': {'concurrency': 4, 'rate': 10}}  (rate: messages/second)
+SMTP_DOMAIN_BACKOFF_BASE = 5
+SMTP_DOMAIN_BACKOFF_MAX = 120       # keep below the outbox lease (300 s)
+
+domain_scheduler = DomainScheduler(workers=SMTP_DOMAIN_WORKERS,
+                                   concurrency=SMTP_DOMAIN_CONCURRENCY,
+                                   limits=SMTP_DOMAIN_LIMITS,
+                                   backoff_base=SMTP_DOMAIN_BACKOFF_BASE,
+                                   backoff_max=SMTP_DOMAIN_BACKOFF_MAX,
+                                   reply_code=smtp_reply_code)
+
+outbox = Outbox(OUTBOX_PATH, deliver_email,
+                workers=OUTBOX_WORKERS,
+                max_attempts=OUTBOX_MAX_ATTEMPTS,
+                backoff_base=OUTBOX_BACKOFF_BASE,
+                backoff_max=OUTBOX_BACKOFF_MAX,
+                jitter=OUTBOX_BACKOFF_JITTER,
+                log_retention=OUTBOX_LOG_RETENTION,
+                reply_code=smtp_reply_code,
+                retryable=smtp_sender.is_relay_failure,
+                scheduler=domain_scheduler)
+
+def queue_email(to_email, subject, body, is_html=False, text_body=None):
+    try:
+        outbox.enqueue(to_email, subject, body, is_html, text_body)
         return True
     except Exception as e:
-        print(f"Error sending email: {e}")
+        log.error('email_queue_failed', error=str(e))
         return False
 
-def validate_email(email):
-    pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
-    return re.match(pattern, email) is not None
+# ---------------- Email Validation ----------------
+# Addresses at throwaway-inbox domains are refused at sign-up. With
+# EMAIL_CHECK_MX the domain must also have an MX (or A) record; this needs
+# dnspython and answers are cached per domain.
+DISPOSABLE_DOMAINS_FILE = None      # extra domains, one per line
+EMAIL_CHECK_MX = False
+EMAIL_MX_TIMEOUT = 2.0
+EMAIL_MX_CACHE_TTL = 3600
+EMAIL_MX_NEGATIVE_TTL = 300
+
+email_validator = EmailValidator(
+    DISPOSABLE_DOMAINS | load_domain_list(DISPOSABLE_DOMAINS_FILE) if DISPOSABLE_DOMAINS_FILE else DISPOSABLE_DOMAINS,
+    mx_cache=MXCache(dns_mx_resolver(EMAIL_MX_TIMEOUT), ttl=EMAIL_MX_CACHE_TTL,
+                     negative_ttl=EMAIL_MX_NEGATIVE_TTL) if EMAIL_CHECK_MX else None)
+
+EMAIL_REJECTIONS = {
+    'syntax': 'Please enter a valid email address',
+    'disposable': 'Disposable email addresses are not accepted',
+    'no_mx': 'That email domain cannot receive mail',
+}
+
+# ---------------- Metrics ----------------
+# Exposed in Prometheus text format on /metrics; disabling makes the timers no-ops.
+METRICS_ENABLED = True
+metrics.enabled = METRICS_ENABLED
+
+metrics.Gauge('secureauth_db_pool_connections', 'MySQL pool connections by state.',
+              lambda: {(state,): user_store.stats().get(state, 0) for state in ('in_use', 'idle')}, ['state'])
+metrics.Gauge('secureauth_smtp_pool_sessions', 'SMTP pool sessions by state.',
+              lambda: {(state,): smtp_sender.stats()[state] for state in ('in_use', 'idle')}, ['state'])
+metrics.Gauge('secureauth_smtp_relay_circuit_open', 'Whether each SMTP relay is currently skipped (1) or in use (0).',
+              lambda: {(relay.name,): int(relay.breaker.state == 'open') for relay in smtp_sender.relays}, ['relay'])
+metrics.Gauge('secureauth_hash_pool_in_flight', 'Password hashes queued or running.',
+              lambda: hash_pool.stats()['in_flight'])
+metrics.Gauge('secureauth_user_cache_lookups', 'User lookup cache results.',
+              lambda: {(kind,): user_cache.stats()[kind] for kind in ('hits', 'negative_hits', 'misses')}, ['result'])
+metrics.Gauge('secureauth_user_cache_hit_ratio', 'Share of user lookups answered by the cache.',
+              lambda: user_cache.stats()['hit_rate'])
+metrics.Gauge('secureauth_outbox_messages', 'Outbox messages by status.',
+              lambda: {(status,): n for status, n in outbox.stats().items()}, ['status'])
+metrics.Gauge('secureauth_smtp_domain_jobs', 'Deliveries held by the per-domain scheduler, by state.',
+              lambda: {(state,): domain_scheduler.stats()[state] for state in ('queued', 'in_flight')}, ['state'])
+metrics.Gauge('secureauth_smtp_domains_paused', 'Recipient domains currently paused after throttling replies.',
+              lambda: len(domain_scheduler.stats()['paused']))
+
+# ---------------- User Export ----------------
+# GET /admin/users/export streams id, email, created_at as CSV or NDJSON; it
+# requires "Authorization: Bearer <EXPORT_API_TOKEN>" and is off while unset.
+EXPORT_API_TOKEN = os.environ.get('EXPORT_API_TOKEN')
+EXPORT_CHUNK_SIZE = 1000        # rows fetched and written at a time
 
 # ---------------- Frontend (Modern UI with Tab Switching) ----------------
-INDEX_HTML = """
-<!doctype html>
-<html lang="en">
-  <head>
-    <meta charset="utf-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1">
-    <title>User Auth System</title>
-    <link href="https://cdn.jsdelivr.net/npm/bootstrap@5.3.2/dist/css/bootstrap.min.css" rel="stylesheet">
-    <link rel="stylesheet" href="https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.4.0/css/all.min.css">
-    <style>
-      :root {
-        --primary-color: #6366f1;
-        --secondary-color: #8b5cf6;
-        --success-color: #10b981;
-        --danger-color: #ef4444;
-        --warning-color: #f59e0b;
-        --dark-color: #1f2937;
-        --light-color: #f9fafb;
-      }
-      
-      body {
-        background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-        min-height: 100vh;
-        font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
-        display: flex;
-        align-items: center;
-        justify-content: center;
-        padding: 20px;
-      }
-      
-      .auth-container {
-        width: 100%;
-        max-width: 450px;
-      }
-      
-      .auth-card {
-        background: rgba(255, 255, 255, 0.95);
-        backdrop-filter: blur(10px);
-        border-radius: 20px;
-        box-shadow: 0 20px 40px rgba(0, 0, 0, 0.1);
-        overflow: hidden;
-        transition: transform 0.3s ease, box-shadow 0.3s ease;
-      }
-      
-      .auth-card:hover {
-        transform: translateY(-5px);
-        box-shadow: 0 25px 50px rgba(0, 0, 0, 0.15);
-      }
-      
-      .auth-header {
-        background: linear-gradient(135deg, var(--primary-color), var(--secondary-color));
-        color: white;
-        padding: 30px 20px;
-        text-align: center;
-      }
-      
-      .auth-header h1 {
-        font-size: 28px;
-        font-weight: 700;
-        margin-bottom: 10px;
-      }
-      
-      .auth-header p {
-        margin: 0;
-        opacity: 0.9;
-      }
-      
-      .auth-tabs {
-        display: flex;
-        background: rgba(255, 255, 255, 0.7);
-        border-bottom: 1px solid rgba(0, 0, 0, 0.1);
-      }
-      
-      .auth-tab {
-        flex: 1;
-        padding: 15px;
-        text-align: center;
-        cursor: pointer;
-        transition: all 0.3s ease;
-        font-weight: 600;
-        color: var(--dark-color);
-        border: none;
-        background: transparent;
-      }
-      
-      .auth-tab.active {
-        background: white;
-        color: var(--primary-color);
-        border-bottom: 3px solid var(--primary-color);
-      }
-      
-      .auth-tab:hover:not(.active) {
-        background: rgba(255, 255, 255, 0.5);
-      }
-      
-      .auth-body {
-        padding: 30px;
-      }
-      
-      .form-control {
-        border-radius: 10px;
-        padding: 12px 15px;
-        border: 1px solid #e5e7eb;
-        transition: all 0.3s ease;
-      }
-      
-      .form-control:focus {
-        border-color: var(--primary-color);
-        box-shadow: 0 0 0 3px rgba(99, 102, 241, 0.1);
-      }
-      
-      .btn-primary {
-        background: linear-gradient(135deg, var(--primary-color), var(--secondary-color));
-        border: none;
-        border-radius: 10px;
-        padding: 12px;
-        font-weight: 600;
-        transition: all 0.3s ease;
-      }
-      
-      .btn-primary:hover {
-        transform: translateY(-2px);
-        box-shadow: 0 10px 20px rgba(99, 102, 241, 0.2);
-      }
-      
-      .btn-warning {
-        background: linear-gradient(135deg, var(--warning-color), #f97316);
-        border: none;
-        border-radius: 10px;
-        padding: 12px;
-        font-weight: 600;
-        transition: all 0.3s ease;
-      }
-      
-      .btn-warning:hover {
-        transform: translateY(-2px);
-        box-shadow: 0 10px 20px rgba(245, 158, 11, 0.2);
-      }
-      
-      .alert {
-        border-radius: 10px;
-        border: none;
-        padding: 15px;
-        margin-bottom: 20px;
-      }
-      
-      .loading-spinner {
-        display: none;
-        width: 20px;
-        height: 20px;
-        border: 3px solid rgba(255, 255, 255, 0.3);
-        border-radius: 50%;
-        border-top-color: white;
-        animation: spin 1s ease-in-out infinite;
-        margin-right: 10px;
-      }
-      
-      @keyframes spin {
-        to { transform: rotate(360deg); }
-      }
-      
-      .form-text {
-        font-size: 0.85rem;
-        color: #6b7280;
-        margin-top: 5px;
-      }
-      
-      .email-validation {
-        display: flex;
-        align-items: center;
-        margin-top: 5px;
-        font-size: 0.85rem;
-      }
-      
-      .email-validation i {
-        margin-right: 5px;
-      }
-      
-      .valid-email {
-        color: var(--success-color);
-      }
-      
-      .invalid-email {
-        color: var(--danger-color);
-      }
-      
-      .feature-list {
-        list-style: none;
-        padding: 0;
-        margin: 20px 0;
-      }
-      
-      .feature-list li {
-        padding: 8px 0;
-        display: flex;
-        align-items: center;
-      }
-      
-      .feature-list i {
-        color: var(--primary-color);
-        margin-right: 10px;
-      }
-      
-      .auth-footer {
-        text-align: center;
-        padding: 20px;
-        color: #6b7280;
-        font-size: 0.85rem;
-      }
-    </style>
-  </head>
-  <body>
-    <div class="auth-container">
-      <div class="auth-card">
-        <div class="auth-header">
-          <h1><i class="fas fa-shield-alt me-2"></i>SecureAuth</h1>
-          <p>Your trusted authentication partner</p>
-        </div>
-        
-        <div class="auth-tabs">
-          <button class="auth-tab active" id="register-tab" onclick="switchTab('register')">
-            <i class="fas fa-user-plus me-2"></i>Register
-          </button>
-          <button class="auth-tab" id="forgot-tab" onclick="switchTab('forgot')">
-            <i class="fas fa-key me-2"></i>Reset Password
-          </button>
-        </div>
-        
-        <div class="auth-body">
-          {% with messages = get_flashed_messages(with_categories=true) %}
-            {% if messages %}
-              {% for category, msg in messages %}
-                <div class="alert alert-{{ 'danger' if category == 'error' else 'success' }} alert-dismissible fade show" role="alert">
-                  <i class="fas fa-{{ 'exclamation-circle' if category == 'error' else 'check-circle' }} me-2"></i>
-                  {{ msg }}
-                  <button type="button" class="btn-close" data-bs-dismiss="alert" aria-label="Close"></button>
-                </div>
-              {% endfor %}
-            {% endif %}
-          {% endwith %}
-          
-          <!-- Register Form -->
-          <div id="register-form">
-            <h4 class="mb-4">Create Your Account</h4>
-            <p class="text-muted mb-4">Join us today and get instant access to all features.</p>
-            
-            <ul class="feature-list">
-              <li><i class="fas fa-check-circle"></i> Secure account creation</li>
-              <li><i class="fas fa-check-circle"></i> Instant credentials delivery</li>
-              <li><i class="fas fa-check-circle"></i> Password encryption</li>
-            </ul>
-            
-            <form method="post" action="{{ url_for('register') }}" id="reg-form">
-              <div class="mb-3">
-                <label for="regEmail" class="form-label">Email address</label>
-                <input type="email" class="form-control" id="regEmail" name="email" placeholder="Enter your email" required>
-                <div class="email-validation" id="email-validation">
-                  <i class="fas fa-info-circle"></i>
-                  <span>Please enter a valid email address</span>
-                </div>
-              </div>
-              <button type="submit" class="btn btn-primary w-100">
-                <span class="loading-spinner" id="reg-loading"></span>
-                <i class="fas fa-user-plus me-2"></i>Create Account
-              </button>
-            </form>
-          </div>
-          
-          <!-- Forgot Password Form -->
-          <div id="forgot-form" style="display: none;">
-            <h4 class="mb-4">Reset Your Password</h4>
-            <p class="text-muted mb-4">Enter your email address and we'll send you new credentials.</p>
-            
-            <ul class="feature-list">
-              <li><i class="fas fa-check-circle"></i> Secure password reset</li>
-              <li><i class="fas fa-check-circle"></i> New credentials delivery</li>
-              <li><i class="fas fa-check-circle"></i> Email verification</li>
-            </ul>
-            
-            <form method="post" action="{{ url_for('forgot') }}" id="forgot-form-element">
-              <div class="mb-3">
-                <label for="forgotEmail" class="form-label">Email address</label>
-                <input type="email" class="form-control" id="forgotEmail" name="email" placeholder="Enter your registered email" required>
-                <div class="email-validation" id="forgot-email-validation">
-                  <i class="fas fa-info-circle"></i>
-                  <span>Please enter a valid email address</span>
-                </div>
-              </div>
-              <button type="submit" class="btn btn-warning w-100">
-                <span class="loading-spinner" id="forgot-loading"></span>
-                <i class="fas fa-key me-2"></i>Reset Password
-              </button>
-            </form>
-          </div>
-        </div>
-        
-        <div class="auth-footer">
-          <p>&copy; 2023 SecureAuth. All rights reserved.</p>
-        </div>
-      </div>
-    </div>
-
-    <script src="https://cdn.jsdelivr.net/npm/bootstrap@5.3.2/dist/js/bootstrap.bundle.min.js"></script>
-    <script>
-      function switchTab(tab) {
-        const registerTab = document.getElementById('register-tab');
-        const forgotTab = document.getElementById('forgot-tab');
-        const registerForm = document.getElementById('register-form');
-        const forgotForm = document.getElementById('forgot-form');
-        
-        if (tab === 'register') {
-          registerTab.classList.add('active');
-          forgotTab.classList.remove('active');
-          registerForm.style.display = 'block';
-          forgotForm.style.display = 'none';
-        } else {
-          registerTab.classList.remove('active');
-          forgotTab.classList.add('active');
-          registerForm.style.display = 'none';
-          forgotForm.style.display = 'block';
-        }
-      }
-      
-      // Email validation
-      document.getElementById('regEmail').addEventListener('input', function() {
-        validateEmail(this, 'email-validation');
-      });
-      
-      document.getElementById('forgotEmail').addEventListener('input', function() {
-        validateEmail(this, 'forgot-email-validation');
-      });
-      
-      function validateEmail(input, validationId) {
-        const validation = document.getElementById(validationId);
-        const email = input.value;
-        const emailRegex = /^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$/;
-        
-        if (email === '') {
-          validation.innerHTML = '<i class="fas fa-info-circle"></i><span>Please enter a valid email address</span>';
-          validation.className = 'email-validation';
-        } else if (emailRegex.test(email)) {
-          validation.innerHTML = '<i class="fas fa-check-circle"></i><span>Valid email address</span>';
-          validation.className = 'email-validation valid-email';
-        } else {
-          validation.innerHTML = '<i class="fas fa-exclamation-circle"></i><span>Invalid email format</span>';
-          validation.className = 'email-validation invalid-email';
-        }
-      }
-      
-      // Form submission with loading state
-      document.getElementById('reg-form').addEventListener('submit', function() {
-        document.getElementById('reg-loading').style.display = 'inline-block';
-      });
-      
-      document.getElementById('forgot-form-element').addEventListener('submit', function() {
-        document.getElementById('forgot-loading').style.display = 'inline-block';
-      });
-    </script>
-  </body>
-</html>
-"""
+# templates/index.html; its CSS/JS live in static/ and are served fingerprinted.
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+
+assets = AssetManifest(STATIC_DIR)
+index_page = None   # rendered once, served to every visitor without flash messages
+
+def inject_asset_url():
+    return {'asset_url': lambda name: url_for('asset', filename=assets.fingerprinted(name))}
 
 # ---------------- Flask Routes ----------------
-@app.route('/')
+REQUEST_ID_PATTERN = re.compile(r'[A-Za-z0-9._:-]{1,128}')
+
+def begin_request_log():
+    # A well-formed X-Request-ID from the proxy is kept so its logs and ours correlate
+    request_id = request.headers.get('X-Request-ID', '')
+    if not REQUEST_ID_PATTERN.fullmatch(request_id):
+        request_id = uuid.uuid4().hex
+    g.log_started = time.perf_counter()
+    g.log_token = logs.push(request_id, request.url_rule.rule if request.url_rule else None)
+    g.request_id = request_id
+
+def log_request(response):
+    fields = {'method': request.method, 'status': response.status_code,
+              'duration_ms': round((time.perf_counter() - g.log_started) * 1000, 3)}
+    if response.status_code >= 500:
+        log.error('request', **fields)
+    else:
+        log.info('request', **fields)
+    response.headers['X-Request-ID'] = g.request_id
+    return response
+
+def end_request_log(exc):
+    token = g.pop('log_token', None)
+    if token is None:
+        return
+    if exc is not None:
+        log.error('request_failed', method=request.method, exc_info=(type(exc), exc, exc.__traceback__))
+    logs.pop(token)
+
+def start_outbox():
+    # Resume delivery of anything left queued by a previous run
+    outbox.start()
+
 def home():
-    return render_template_string(INDEX_HTML)
+    global index_page
+    # Flash messages make the page per-visitor; otherwise serve the cached bytes
+    if session.get('_flashes'):
+        return render_template('index.html')
+    if index_page is None:
+        index_page = PrecompressedBody(render_template('index.html'), 'text/html')
+    return index_page.response('no-cache')
+
+def metrics_endpoint():
+    if not METRICS_ENABLED:
+        return 'Metrics are disabled', 404
+    return metrics.render(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+def asset(filename):
+    return assets.response(filename)
+
+def export_users():
+    if not EXPORT_API_TOKEN:
+        return 'Not Found', 404
+    scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+    if scheme.lower() != 'bearer' or not hmac.compare_digest(token.strip().encode(), EXPORT_API_TOKEN.encode()):
+        return 'Unauthorized', 401, {'WWW-Authenticate': 'Bearer'}
+    fmt = request.args.get('format', 'csv')
+    if fmt not in EXPORT_FORMATS:
+        return f"format must be one of {', '.join(sorted(EXPORT_FORMATS))}", 400
+    try:
+        after = parse_after(request.args['after']) if request.args.get('after') else None
+    except ValueError as e:
+        return f'after: {e}', 400
+    # Compressed on the fly for clients that accept it; the body is never held in memory
+    compress = request.accept_encodings['gzip'] > 0
+    headers = {'Content-Disposition': f'attachment; filename="users.{fmt}"',
+               'Cache-Control': 'no-store',
+               'Vary': 'Accept-Encoding'}
+    if compress:
+        headers['Content-Encoding'] = 'gzip'
+    return Response(stream_users(user_store, fmt, after, compress, EXPORT_CHUNK_SIZE),
+                    content_type=EXPORT_FORMATS[fmt], headers=headers)
 
-@app.route('/register', methods=['POST'])
 def register():
+    limited = rate_limited('register_ip', request.remote_addr)
+    if limited:
+        return limited
+
     email = request.form.get('email').strip().lower()
     if not email:
         flash('Email is required', 'error')
         return redirect(url_for('home'))
     
-    if not validate_email(email):
-        flash('Please enter a valid email address', 'error')
+    email, reason = email_validator.check(email)
+    logs.bind(email=email)
+    if reason:
+        flash(EMAIL_REJECTIONS[reason], 'error')
         return redirect(url_for('home'))
 
-    if user_exists(email):
+    limited = rate_limited('register_email', normalize_email_key(email))
+    if limited:
+        return limited
+
+    if cached_user_lookup(email) not in (None, ABSENT):
         flash('Email already registered', 'error')
         return redirect(url_for('home'))
 
     user_id, password = generate_credentials()
-    password_hash = generate_password_hash(password)
     try:
-        if save_user(email, password_hash, user_id):
+        password_hash = generate_password_hash(password)
+    except (HashPoolSaturated, HashPoolUnavailable):
+        return server_busy()
+    try:
+        user_id = save_user(email, password_hash, user_id)
+        if user_id:
             subject = 'Welcome to SecureAuth - Your Account Credentials'
-            
-            # Using an f-string for the email body to fix the formatting error
-            email_body_html = f"""
-<!doctype html>
-<html>
-  <head>
-    <meta name="viewport" content="width=device-width">
-    <meta http-equiv="Content-Type" content="text/html; charset=UTF-8">
-    <title>Welcome to SecureAuth</title>
-    <style>
-      img {{ border: none; -ms-interpolation-mode: bicubic; max-width: 100%; }}
-      body {{ background-color: #f4f5f6; font-family: Arial, sans-serif; -webkit-font-smoothing: antialiased; font-size: 14px; line-height: 1.4; margin: 0; padding: 0; -ms-text-size-adjust: 100%; -webkit-text-size-adjust: 100%; }}
-      table {{ border-collapse: separate; mso-table-lspace: 0pt; mso-table-rspace: 0pt; width: 100%; }}
-      table td {{ font-family: Arial, sans-serif; font-size: 14px; vertical-align: top; }}
-      .body {{ background-color: #f4f5f6; width: 100%; }}
-      .container {{ display: block; margin: 0 auto !important; max-width: 580px; padding: 10px; width: 580px; }}
-      .content {{ box-sizing: border-box; display: block; margin: 0 auto; max-width: 580px; padding: 10px; }}
-      .main {{ background: #ffffff; border-radius: 8px; width: 100%; }}
-      .header {{ background: linear-gradient(135deg, #6366f1, #8b5cf6); padding: 20px 30px; border-radius: 8px 8px 0 0; color: white; text-align: center; }}
-      .footer {{ clear: both; padding-top: 10px; text-align: center; width: 100%; }}
-      .footer td, .footer p, .footer span, .footer a {{ color: #999999; font-size: 12px; text-align: center; }}
-      h1 {{ color: #222222; font-family: Arial, sans-serif; font-size: 28px; font-weight: Bold; margin-top: 0; text-align: center; }}
-      h2 {{ color: #222222; font-family: Arial, sans-serif; font-size: 22px; font-weight: Bold; margin-top: 0; margin-bottom: 15px; }}
-      p {{ font-family: Arial, sans-serif; font-size: 14px; line-height: 1.6; margin-bottom: 15px; }}
-      .credential-box {{ background: #f8f9fa; border-left: 4px solid #6366f1; padding: 15px 20px; margin: 20px 0; }}
-      .credential-label {{ font-weight: bold; color: #555; font-size: 12px; text-transform: uppercase; }}
-      .credential-value {{ font-family: monospace; font-size: 18px; color: #000; background: #e9ecef; padding: 10px; border-radius: 4px; word-break: break-all; }}
-    </style>
-  </head>
-  <body class="">
-    <table border="0" cellpadding="0" cellspacing="0" width="100%">
-      <tr>
-        <td>&nbsp;</td>
-        <td class="container">
-          <div class="content">
-            <table class="main">
-              <tr>
-                <td class="header">
-                  <h1>SecureAuth</h1>
-                  <p>Your account is ready!</p>
-                </td>
-              </tr>
-              <tr>
-                <td class="content-wrap">
-                  <table cellpadding="0" cellspacing="0">
-                    <tr>
-                      <td class="content-block">
-                        <h2>Welcome!</h2>
-                        <p>Thank you for registering. Your account has been successfully created. Please find your login credentials below.</p>
-                      </td>
-                    </tr>
-                    <tr>
-                      <td class="content-block">
-                        <div class="credential-box">
-                          <div class="credential-label">User ID</div>
-                          <div class="credential-value">{user_id}</div>
-                        </div>
-                        <div class="credential-box">
-                          <div class="credential-label">Password</div>
-                          <div class="credential-value">{password}</div>
-                        </div>
-                      </td>
-                    </tr>
-                    <tr>
-                      <td class="content-block">
-                        <p>For your security, please change your password after your first login.</p>
-                      </td>
-                    </tr>
-                  </table>
-                </td>
-              </tr>
-            </table>
-            <div class="footer">
-              <table border="0" cellpadding="0" cellspacing="0">
-                <tr>
-                  <td class="content-block">
-                    <span class="apple-link">SecureAuth Inc.</span>
-                    <br>Don't reply to this email.
-                  </td>
-                </tr>
-              </table>
-            </div>
-          </div>
-        </td>
-        <td>&nbsp;</td>
-      </tr>
-    </table>
-  </body>
-</html>
-            """
-            if send_email(email, subject, email_body_html, is_html=True):
+            with metrics.timed('render_email'):
+                email_body_html, email_body_text = email_templates.render('welcome.html', user_id=user_id, password=password)
+            if queue_email(email, subject, email_body_html, is_html=True, text_body=email_body_text):
                 flash('Registered successfully! Check your email for credentials.', 'success')
             else:
                 flash('Error sending email. Please try again.', 'error')
         else:
             flash('Error creating account. Please try again.', 'error')
+    except EmailAlreadyRegistered:
+        flash('Email already registered', 'error')
     except Exception as e:
+        log.error('register_failed', exc_info=True)
         flash(f'Error: {e}', 'error')
     return redirect(url_for('home'))
 
-@app.route('/forgot', methods=['POST'])
+class ResetFailed(Exception):
+    """A password reset failed for a transient reason; the message is shown to the user"""
+
+def reset_password(email):
+    """Give ``email`` a new password and queue it; returns the ``(message, category)`` to flash.
+
+    Only final outcomes are returned, so they are safe to share with
+    duplicate requests; transient failures raise ResetFailed instead, as
+    RateLimitExceeded and the HashPool errors are raised.
+    """
+    check_rate_limit('forgot_email', normalize_email_key(email))
+
+    if cached_user_lookup(email) is ABSENT:
+        return 'Email not found', 'error'
+
+    new_user_id, new_password = generate_credentials()
+    new_hash = generate_password_hash(new_password)
+    try:
+        updated = update_password(email, new_hash)
+    except Exception as e:
+        log.error('reset_password_failed', exc_info=True)
+        raise ResetFailed(f'Error: {e}') from e
+    if updated is False:
+        return 'Email not found', 'error'
+    if updated is None:
+        raise ResetFailed('Error resetting password. Please try again.')
+    subject = 'SecureAuth - Your Password Has Been Reset'
+    try:
+        with metrics.timed('render_email'):
+            email_body_html, email_body_text = email_templates.render('reset.html', user_id=new_user_id, password=new_password)
+    except Exception as e:
+        log.error('reset_password_failed', exc_info=True)
+        raise ResetFailed(f'Error: {e}') from e
+    if not queue_email(email, subject, email_body_html, is_html=True, text_body=email_body_text):
+        raise ResetFailed('Error sending email. Please try again.')
+    return 'Password reset successful! Check your email for new credentials.', 'success'
+
+def shared_reset(email, idempotency_key=None):
+    """reset_password(email), coalesced with duplicate requests.
+
+    Requests for the same address share one reset while it runs and for
+    FORGOT_COALESCE_WINDOW seconds after; a repeated idempotency key gets
+    the original outcome for IDEMPOTENCY_KEY_TTL seconds. Failures raise,
+    so only requests already waiting on the failed reset see them; later
+    ones try again.
+    """
+    def run():
+        outcome, shared = forgot_flights.do(email, lambda: reset_password(email))
+        if shared:
+            metrics.coalesced_requests.inc('forgot', 'window')
+        return outcome
+
+    if idempotency_key and len(idempotency_key) <= IDEMPOTENCY_KEY_MAX_LENGTH:
+        outcome, shared = idempotent_requests.do(('forgot', idempotency_key, email), run)
+        if shared:
+            metrics.coalesced_requests.inc('forgot', 'idempotency_key')
+        return outcome
+    return run()
+
 def forgot():
+    limited = rate_limited('forgot_ip', request.remote_addr)
+    if limited:
+        return limited
+
     email = request.form.get('email').strip().lower()
     if not email:
         flash('Email is required', 'error')
         return redirect(url_for('home'))
     
-    if not validate_email(email):
-        flash('Please enter a valid email address', 'error')
-        return redirect(url_for('home'))
-
-    uid = user_exists(email)
-    if not uid:
-        flash('Email not found', 'error')
+    # Existing accounts only, so no disposable/MX policy here
+    email = normalize_email(email)
+    if email is None:
+        flash(EMAIL_REJECTIONS['syntax'], 'error')
         return redirect(url_for('home'))
+    logs.bind(email=email)
 
-    new_user_id, new_password = generate_credentials()
-    new_hash = generate_password_hash(new_password)
+    idempotency_key = request.headers.get('Idempotency-Key') or request.form.get('idempotency_key')
     try:
-        if update_password(email, new_hash):
-            subject = 'SecureAuth - Your Password Has Been Reset'
-            
-            # Using an f-string for the email body to fix the formatting error
-            email_body_html = f"""
-<!doctype html>
-<html>
-  <head>
-    <meta name="viewport" content="width=device-width">
-    <meta http-equiv="Content-Type" content="text/html; charset=UTF-8">
-    <title>Password Reset - SecureAuth</title>
-    <style>
-      img {{ border: none; -ms-interpolation-mode: bicubic; max-width: 100%; }}
-      body {{ background-color: #f4f5f6; font-family: Arial, sans-serif; -webkit-font-smoothing: antialiased; font-size: 14px; line-height: 1.4; margin: 0; padding: 0; -ms-text-size-adjust: 100%; -webkit-text-size-adjust: 100%; }}
-      table {{ border-collapse: separate; mso-table-lspace: 0pt; mso-table-rspace: 0pt; width: 100%; }}
-      table td {{ font-family: Arial, sans-serif; font-size: 14px; vertical-align: top; }}
-      .body {{ background-color: #f4f5f6; width: 100%; }}
-      .container {{ display: block; margin: 0 auto !important; max-width: 580px; padding: 10px; width: 580px; }}
-      .content {{ box-sizing: border-box; display: block; margin: 0 auto; max-width: 580px; padding: 10px; }}
-      .main {{ background: #ffffff; border-radius: 8px; width: 100%; }}
-      .header {{ background: linear-gradient(135deg, #f59e0b, #f97316); padding: 20px 30px; border-radius: 8px 8px 0 0; color: white; text-align: center; }}
-      .footer {{ clear: both; padding-top: 10px; text-align: center; width: 100%; }}
-      .footer td, .footer p, .footer span, .footer a {{ color: #999999; font-size: 12px; text-align: center; }}
-      h1 {{ color: #222222; font-family: Arial, sans-serif; font-size: 28px; font-weight: Bold; margin-top: 0; text-align: center; }}
-      h2 {{ color: #222222; font-family: Arial, sans-serif; font-size: 22px; font-weight: Bold; margin-top: 0; margin-bottom: 15px; }}
-      p {{ font-family: Arial, sans-serif; font-size: 14px; line-height: 1.6; margin-bottom: 15px; }}
-      .credential-box {{ background: #f8f9fa; border-left: 4px solid #f59e0b; padding: 15px 20px; margin: 20px 0; }}
-      .credential-label {{ font-weight: bold; color: #555; font-size: 12px; text-transform: uppercase; }}
-      .credential-value {{ font-family: monospace; font-size: 18px; color: #000; background: #e9ecef; padding: 10px; border-radius: 4px; word-break: break-all; }}
-      .alert {{ background: #fee2e2; border-left: 4px solid #ef4444; padding: 15px; margin: 20px 0; border-radius: 5px; }}
-      .alert h4 {{ margin-top: 0; color: #991b1b; }}
-    </style>
-  </head>
-  <body class="">
-    <table border="0" cellpadding="0" cellspacing="0" width="100%">
-      <tr>
-        <td>&nbsp;</td>
-        <td class="container">
-          <div class="content">
-            <table class="main">
-              <tr>
-                <td class="header">
-                  <h1>SecureAuth</h1>
-                  <p>Password Reset Request</p>
-                </td>
-              </tr>
-              <tr>
-                <td class="content-wrap">
-                  <table cellpadding="0" cellspacing="0">
-                    <tr>
-                      <td class="content-block">
-                        <h2>Password Reset</h2>
-                        <p>We received a request to reset your password. Your credentials have been successfully reset. Below are your new login details:</p>
-                      </td>
-                    </tr>
-                    <tr>
-                      <td class="content-block">
-                        <div class="alert">
-                          <h4>Important</h4>
-                          <p>If you didn't request this password reset, please contact our support team immediately.</p>
-                        </div>
-                      </td>
-                    </tr>
-                    <tr>
-                      <td class="content-block">
-                        <div class="credential-box">
-                          <div class="credential-label">New User ID</div>
-                          <div class="credential-value">{new_user_id}</div>
-                        </div>
-                        <div class="credential-box">
-                          <div class="credential-label">New Password</div>
-                          <div class="credential-value">{new_password}</div>
-                        </div>
-                      </td>
-                    </tr>
-                    <tr>
-                      <td class="content-block">
-                        <p>For your security, please change your password after your first login.</p>
-                      </td>
-                    </tr>
-                  </table>
-                </td>
-              </tr>
-            </table>
-            <div class="footer">
-              <table border="0" cellpadding="0" cellspacing="0">
-                <tr>
-                  <td class="content-block">
-                    <span class="apple-link">SecureAuth Inc.</span>
-                    <br>Don't reply to this email.
-                  </td>
-                </tr>
-              </table>
-            </div>
-          </div>
-        </td>
-        <td>&nbsp;</td>
-      </tr>
-    </table>
-  </body>
-</html>
-            """
-            if send_email(email, subject, email_body_html, is_html=True):
-                flash('Password reset successful! Check your email for new credentials.', 'success')
-            else:
-                flash('Error sending email. Please try again.', 'error')
-        else:
-            flash('Error resetting password. Please try again.', 'error')
-    except Exception as e:
-        flash(f'Error: {e}', 'error')
-
+        message, category = shared_reset(email, idempotency_key)
+    except RateLimitExceeded as e:
+        return too_many_requests(e.retry_after)
+    except (HashPoolSaturated, HashPoolUnavailable):
+        return server_busy()
+    except ResetFailed as e:
+        message, category = str(e), 'error'
+    flash(message, category)
     return redirect(url_for('home'))
 
+# ---------------- Application Factory ----------------
+def create_app():
+    """Build the Flask application and register its routes and hooks"""
+    flask_app = Flask(__name__)
+    flask_app.secret_key = 'devsecret'  # direct secret key
+    if TRUSTED_PROXIES:
+        from werkzeug.middleware.proxy_fix import ProxyFix
+        flask_app.wsgi_app = ProxyFix(flask_app.wsgi_app, x_for=TRUSTED_PROXIES, x_proto=TRUSTED_PROXIES)
+    flask_app.context_processor(inject_asset_url)
+    flask_app.before_request(begin_request_log)
+    flask_app.after_request(log_request)
+    flask_app.teardown_request(end_request_log)
+    flask_app.before_request(start_outbox)
+    flask_app.add_url_rule('/', view_func=home)
+    flask_app.add_url_rule('/metrics', view_func=metrics_endpoint)
+    flask_app.add_url_rule('/assets/<path:filename>', 'asset', view_func=asset)
+    flask_app.add_url_rule('/register', view_func=register, methods=['POST'])
+    flask_app.add_url_rule('/forgot', view_func=forgot, methods=['POST'])
+    flask_app.add_url_rule('/admin/users/export', view_func=export_users)
+    return flask_app
+
+_app_lock = threading.Lock()
+
+def __getattr__(name):
+    # ``app.app`` (gunicorn app:app, flask run) is created on first access,
+    # so importing this module for its helpers does not build the application
+    global app
+    if name != 'app':
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    with _app_lock:
+        if 'app' not in globals():
+            app = create_app()
+    return app
+
 # ---------------- Signal Handlers for Graceful Shutdown ----------------
+def shutdown(timeout=30):
+    """Finish in-flight mail, then close every pool.
+
+    Outbox senders complete the message they are on and hand the rest of
+    their batch back to the queue, which is durable and resumes on the next
+    start; the async engine delivers what it already accepted.
+    """
+    outbox.stop(timeout)
+    smtp_sender.close()
+    user_store.close()
+    if dkim_pool is not None:
+        dkim_pool.shutdown()
+    hash_pool.shutdown()
+    logs.flush()
+
 def signal_handler(sig, frame):
     print('Shutting down gracefully...')
+    shutdown()
     sys.exit(0)
 
-# Register signal handlers
-signal.signal(signal.SIGINT, signal_handler)
-signal.signal(signal.SIGTERM, signal_handler)
-
 # ---------------- Run App ----------------
+# Development server only; in production run gunicorn -c gunicorn.conf.py app:app
 if __name__ == '__main__':
-    # Default port
-    port = 5000
-    
-    # Check if default port is in use
-    if is_port_in_use(port):
-        print(f"Port {port} is already in use. Finding an available port...")
-        port = find_free_port()
-        print(f"Using port {port} instead.")
-    
-    print(f"Starting Flask app on http://127.0.0.1:{port}")
+    signal.signal(signal.SIGINT, signal_handler)
+    signal.signal(signal.SIGTERM, signal_handler)
+
+    host = os.environ.get('HOST', '127.0.0.1')
+    port = int(os.environ.get('PORT', 5000))
+    print(f"Starting Flask app on http://{host}:{port}")
     print("Press Ctrl+C to stop the server")
-    
     try:
-        app.run(host='127.0.0.1', port=port, debug=True)
-    except Exception as e:
-        print(f"Error starting server: {e}")
-        print("Trying to start with a different port...")
-        port = find_free_port()
-        print(f"Starting Flask app on http://127.0.0.1:{port}")
-        app.run(host='127.0.0.1', port=port, debug=True)
+        create_app().run(host=host, port=port, threaded=True, debug=os.environ.get('FLASK_DEBUG') == '1')
+    except OSError as e:
+        print(f"Error starting server on port {port}: {e} (set PORT to use another)")
+        sys.exit(1)
@@ -0,0 +1,205 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+
+import metrics
+
+try:
+    import aiosmtplib
+except ImportError:  # optional dependency, only needed when SMTP_ENGINE = 'async'
+    aiosmtplib = None
+
+
+class AsyncSMTPSender:
+    """asyncio SMTP engine with several sessions delivering concurrently.
+
+    An event loop runs on a background thread and keeps up to ``sessions``
+    authenticated connections open (never more than ``relay_limit``, the
+    relay's own per-client connection cap). Each session pulls the next
+    message from a shared queue, so messages are spread across whichever
+    sessions are free.
+
+    The public methods are synchronous: ``submit()`` returns a
+    ``concurrent.futures.Future`` and ``send_message()`` blocks on it, which
+    lets Flask routes and batch jobs use the engine without asyncio.
+    """
+
+    def __init__(self, host, port, user=None, password=None, sessions=4, relay_limit=None,
+                 use_tls=True, timeout=30, idle_timeout=60):
+        if aiosmtplib is None:
+            raise RuntimeError('AsyncSMTPSender requires aiosmtplib (pip install aiosmtplib)')
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+        self.sessions = min(sessions, relay_limit) if relay_limit else sessions
+        self.use_tls = use_tls
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+
+        self._loop = None
+        self._queue = None
+        self._thread = None
+        self._workers = []
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {'opened': 0, 'sent': 0, 'failed': 0, 'reconnects': 0}
+
+    # ---------------- Lifecycle ----------------
+    def start(self):
+        """Start the event loop thread and session workers (idempotent)"""
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is not None:
+                return
+            ready = threading.Event()
+            thread = threading.Thread(target=self._run_loop, args=(ready,),
+                                      name='async-smtp-sender', daemon=True)
+            thread.start()
+            ready.wait()
+            # Published only once the loop and queue exist: submit() skips the
+            # lock whenever _thread is set.
+            self._thread = thread
+
+    def _run_loop(self, ready):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        self._queue = asyncio.Queue()
+        self._workers = [self._loop.create_task(self._session_worker(i)) for i in range(self.sessions)]
+        ready.set()
+        self._loop.run_forever()
+        self._loop.close()
+
+    def stop(self, timeout=10):
+        """Finish queued messages, close every session and stop the loop.
+
+        Messages not sent within ``timeout`` are cancelled rather than raising.
+        """
+        if self._thread is None:
+            return
+        done = asyncio.run_coroutine_threadsafe(self._drain(), self._loop)
+        try:
+            done.result(timeout)
+        except FutureTimeout:
+            done.cancel()
+            asyncio.run_coroutine_threadsafe(self._abandon(), self._loop).result()
+        finally:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(timeout)
+            self._thread = None
+
+    async def _drain(self):
+        await self._queue.join()
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+
+    async def _abandon(self):
+        """Stop without draining: cancel queued messages and give sessions a second to quit"""
+        for worker in self._workers:
+            worker.cancel()
+        while not self._queue.empty():
+            msg, future = self._queue.get_nowait()
+            future.cancel()
+            self._queue.task_done()
+        await asyncio.wait(self._workers, timeout=1)
+
+    # ---------------- Sessions ----------------
+    async def _connect(self):
+        smtp = aiosmtplib.SMTP(hostname=self.host, port=self.port, timeout=self.timeout,
+                               start_tls=self.use_tls)
+        with metrics.timed('smtp_connect'):
+            await smtp.connect()
+        if self.user:
+            with metrics.timed('smtp_login'):
+                await smtp.login(self.user, self.password)
+        with self._stats_lock:
+            self._stats['opened'] += 1
+        return smtp
+
+    @staticmethod
+    async def _quietly_quit(smtp):
+        try:
+            await smtp.quit()
+        except Exception:
+            smtp.close()
+
+    async def _session_worker(self, index):
+        smtp = None
+        last_used = 0.0
+        try:
+            while True:
+                msg, future = await self._queue.get()
+                try:
+                    if future.set_running_or_notify_cancel():
+                        if smtp is not None and time.monotonic() - last_used > self.idle_timeout:
+                            await self._quietly_quit(smtp)
+                            smtp = None
+                        try:
+                            smtp = await self._deliver(smtp, msg, future)
+                        except asyncio.CancelledError:
+                            if not future.done():
+                                future.set_exception(RuntimeError('sender stopped before the message was sent'))
+                            raise
+                        last_used = time.monotonic()
+                finally:
+                    self._queue.task_done()
+        finally:
+            if smtp is not None:
+                await self._quietly_quit(smtp)
+
+    async def _deliver(self, smtp, msg, future):
+        """Send one message, reconnecting once if the session was dropped. Returns the session."""
+        for attempt in (1, 2):
+            try:
+                if smtp is None or not smtp.is_connected:
+                    smtp = await self._connect()
+                with metrics.timed('smtp_send'):
+                    result = await smtp.send_message(msg)
+            except aiosmtplib.SMTPServerDisconnected as e:
+                smtp = None
+                if attempt == 1:
+                    with self._stats_lock:
+                        self._stats['reconnects'] += 1
+                    continue
+                self._fail(future, e)
+            except Exception as e:
+                if smtp is not None:
+                    await self._quietly_quit(smtp)
+                self._fail(future, e)
+                return None
+            else:
+                with self._stats_lock:
+                    self._stats['sent'] += 1
+                future.set_result(result)
+            return smtp
+        return None
+
+    def _fail(self, future, error):
+        with self._stats_lock:
+            self._stats['failed'] += 1
+        future.set_exception(error)
+
+    # ---------------- Synchronous facade ----------------
+    def submit(self, msg):
+        """Queue ``msg`` for delivery and return a Future for the SMTP result"""
+        self.start()
+        future = Future()
+        self._loop.call_soon_threadsafe(self._queue.put_nowait, (msg, future))
+        return future
+
+    def send_message(self, msg, timeout=None):
+        """Send ``msg`` and block until the relay accepted or rejected it"""
+        return self.submit(msg).result(timeout)
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats['sessions'] = self.sessions
+        stats['queued'] = self._queue.qsize() if self._queue is not None else 0
+        return stats
+
+    def close(self):
+        self.stop()
@@ -0,0 +1,105 @@
+"""Benchmark: messages/second through the SMTP senders against a local server.
+
+Starts an aiosmtpd server on localhost that waits ``--latency`` seconds
+before accepting each message (to stand in for a real relay), then sends
+the same number of messages with:
+
+  * one smtplib connection per message (the original send_email behaviour)
+  * the pooled smtplib sessions used by send_email (smtp_pool.SMTPPool)
+  * the asyncio engine (async_sender.AsyncSMTPSender)
+
+    pip install aiosmtpd aiosmtplib
+    python benchmarks/bench_async_sender.py --messages 200 --sessions 8 --latency 0.02
+"""
+import argparse
+import asyncio
+import os
+import smtplib
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from email.message import EmailMessage
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from aiosmtpd.controller import Controller  # noqa: E402
+
+from async_sender import AsyncSMTPSender  # noqa: E402
+from smtp_pool import SMTPPool  # noqa: E402
+
+HOST = '127.0.0.1'
+
+
+class SlowHandler:
+    def __init__(self, latency):
+        self.latency = latency
+        self.received = 0
+
+    async def handle_DATA(self, server, session, envelope):
+        await asyncio.sleep(self.latency)
+        self.received += 1
+        return '250 OK'
+
+
+def make_message(i):
+    msg = EmailMessage()
+    msg['Subject'] = f'Benchmark {i}'
+    msg['From'] = 'bench@example.com'
+    msg['To'] = f'user{i}@example.com'
+    msg.set_content('x' * 2000)
+    return msg
+
+
+def report(name, count, elapsed):
+    print(f"{name:<28}{count:>6} msgs  {elapsed:7.2f}s  {count / elapsed:9.1f} msg/s")
+
+
+def bench_per_message(port, count):
+    start = time.perf_counter()
+    for i in range(count):
+        with smtplib.SMTP(HOST, port) as smtp:
+            smtp.send_message(make_message(i))
+    report('connect per message', count, time.perf_counter() - start)
+
+
+def bench_pool(port, count, sessions):
+    pool = SMTPPool(HOST, port, size=sessions, use_tls=False)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=sessions) as executor:
+        list(executor.map(lambda i: pool.send_message(make_message(i)), range(count)))
+    report(f'SMTPPool x{sessions} threads', count, time.perf_counter() - start)
+    pool.close()
+
+
+def bench_async(port, count, sessions):
+    sender = AsyncSMTPSender(HOST, port, sessions=sessions, use_tls=False)
+    sender.start()
+    start = time.perf_counter()
+    futures = [sender.submit(make_message(i)) for i in range(count)]
+    for future in futures:
+        future.result()
+    report(f'AsyncSMTPSender x{sessions}', count, time.perf_counter() - start)
+    sender.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=200)
+    parser.add_argument('--sessions', type=int, default=8)
+    parser.add_argument('--latency', type=float, default=0.02, help='server delay per message (seconds)')
+    parser.add_argument('--port', type=int, default=8025)
+    args = parser.parse_args()
+
+    handler = SlowHandler(args.latency)
+    controller = Controller(handler, hostname=HOST, port=args.port)
+    controller.start()
+    try:
+        bench_per_message(args.port, args.messages)
+        bench_pool(args.port, args.messages, args.sessions)
+        bench_async(args.port, args.messages, args.sessions)
+    finally:
+        controller.stop()
+
+
+if __name__ == '__main__':
+    main()
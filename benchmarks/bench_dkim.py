@@ -0,0 +1,99 @@
+"""Micro-benchmark: DKIM signatures per second for the welcome email.
+
+Signs ``--messages`` rendered welcome emails with a freshly generated key:
+
+  * naively: the PEM key parsed per message
+  * with one DKIMSigner (key parsed once, reused until the file changes)
+  * through a SigningPool of ``--workers`` threads
+
+    pip install cryptography
+    python benchmarks/bench_dkim.py --messages 2000 --key-type rsa
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from email.message import EmailMessage
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import dkim_signing  # noqa: E402
+from dkim_signing import DKIMSigner, SigningPool  # noqa: E402
+from email_templates import EmailTemplates  # noqa: E402
+
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'templates', 'email')
+
+
+def write_key(path, key_type, key_size):
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import ed25519, rsa
+    if key_type == 'rsa':
+        key = rsa.generate_private_key(public_exponent=65537, key_size=key_size)
+    else:
+        key = ed25519.Ed25519PrivateKey.generate()
+    with open(path, 'wb') as f:
+        f.write(key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                  serialization.NoEncryption()))
+
+
+def make_messages(count):
+    templates = EmailTemplates(TEMPLATE_DIR)
+    messages = []
+    for i in range(count):
+        html, text = templates.render('welcome.html', user_id=f'{i:08x}', password='Xy3_kP9qLw0')
+        msg = EmailMessage()
+        msg['Subject'] = 'Welcome to SecureAuth - Your Account Credentials'
+        msg['From'] = 'noreply@example.com'
+        msg['To'] = f'user{i}@example.org'
+        msg.set_content(text)
+        msg.add_alternative(html, subtype='html')
+        messages.append(msg)
+    return messages
+
+
+def run(label, sign_all, messages):
+    start = time.perf_counter()
+    sign_all(messages)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<36}{len(messages) / elapsed:10,.0f} signatures/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--key-type', choices=('rsa', 'ed25519'), default='rsa')
+    parser.add_argument('--key-size', type=int, default=2048, help='RSA modulus bits')
+    parser.add_argument('--workers', type=int, default=4)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix='secureauth-bench-') as workdir:
+        key_path = os.path.join(workdir, 'dkim.pem')
+        write_key(key_path, args.key_type, args.key_size)
+
+        def naive(messages):
+            for msg in messages:
+                dkim_signing._keys.clear()
+                DKIMSigner('example.com', 'bench', key_path).sign(msg)
+
+        signer = DKIMSigner('example.com', 'bench', key_path)
+
+        def cached(messages):
+            for msg in messages:
+                signer.sign(msg)
+
+        pool = SigningPool(signer, workers=args.workers)
+
+        def pooled(messages):
+            for _ in pool.sign_stream(messages):
+                pass
+
+        run('naive (parse key per message)', naive, make_messages(args.messages))
+        run('DKIMSigner', cached, make_messages(args.messages))
+        run(f'SigningPool x{args.workers}', pooled, make_messages(args.messages))
+        pool.shutdown()
+        print(f"signer stats: {signer.stats()}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,42 @@
+"""Micro-benchmark: per-message cost of rendering the welcome/reset emails.
+
+Compares a plain Jinja render of the template against the precompiled
+CompiledEmail path used by the app.
+
+    python benchmarks/bench_email_templates.py [--iterations 20000]
+"""
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from email_templates import EmailTemplates  # noqa: E402
+
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'templates', 'email')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=20000, help='renders timed per method')
+    iterations = parser.parse_args().iterations
+    templates = EmailTemplates(TEMPLATE_DIR)
+    values = {'user_id': 'c1b0c46f', 'password': 'Xy3_kP9qLw0'}
+
+    for name in ('welcome.html', 'reset.html'):
+        jinja_template = templates.env.get_template(name)
+        compiled = templates.compile(name)
+
+        jinja_s = timeit.timeit(lambda: jinja_template.render(values), number=iterations)
+        compiled_s = timeit.timeit(lambda: compiled.render(**values), number=iterations)
+        cached_s = timeit.timeit(lambda: templates.render(name, **values), number=iterations)
+
+        print(f"{name}:")
+        print(f"  jinja render (html only)     {jinja_s / iterations * 1e6:8.2f} us/msg")
+        print(f"  compiled render (html+text)  {compiled_s / iterations * 1e6:8.2f} us/msg")
+        print(f"  EmailTemplates.render        {cached_s / iterations * 1e6:8.2f} us/msg")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+"""Benchmark: cold import time of the app and the standalone helper modules.
+
+Each target is imported in a fresh interpreter with ``-X importtime`` and
+the cumulative time of its top-level import is taken; the median over
+``--runs`` is compared with a budget. ``app`` is measured against a bare
+``import flask`` (the floor for any worker) and its budget applies to the
+difference, so the check does not depend on how fast the machine is.
+
+    python benchmarks/bench_import.py --runs 7
+
+Exits with status 1 if any budget is exceeded.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# Milliseconds. 'app' is measured over the cost of importing flask.
+BUDGETS_MS = {
+    'credentials': 30,
+    'validation': 30,
+    'app': 50,
+}
+# Creating the Flask app (routes, hooks) on first access of ``app.app``.
+CREATE_APP_BUDGET_MS = 10
+
+_CREATE_APP = (
+    "import time, app; start = time.perf_counter(); app.app; "
+    "print((time.perf_counter() - start) * 1000)"
+)
+
+
+def import_ms(module):
+    """Cumulative -X importtime of ``module`` in a fresh interpreter, in milliseconds"""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                            cwd=ROOT, capture_output=True, text=True, check=True)
+    # Lines look like "import time:  self_us |  cumulative_us | [indent]name"
+    for line in reversed(result.stderr.splitlines()):
+        parts = line.split('|')
+        if len(parts) == 3 and parts[2].strip() == module and not parts[2][1:].startswith(' '):
+            return int(parts[1]) / 1000
+    raise RuntimeError(f'{module} not found in -X importtime output')
+
+
+def create_app_ms():
+    result = subprocess.run([sys.executable, '-c', _CREATE_APP], cwd=ROOT,
+                            capture_output=True, text=True, check=True)
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+def median_of(runs, measure, *args):
+    return statistics.median(measure(*args) for _ in range(runs))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    flask_ms = median_of(args.runs, import_ms, 'flask')
+    print(f"{'flask (baseline)':<24}{flask_ms:8.1f} ms")
+
+    over_budget = False
+    for module, budget in BUDGETS_MS.items():
+        ms = median_of(args.runs, import_ms, module)
+        cost = ms - flask_ms if module == 'app' else ms
+        label = f'{module} (over flask)' if module == 'app' else module
+        ok = cost <= budget
+        over_budget |= not ok
+        print(f"{label:<24}{cost:8.1f} ms   budget {budget} ms   {'ok' if ok else 'OVER'}")
+
+    ms = median_of(args.runs, create_app_ms)
+    ok = ms <= CREATE_APP_BUDGET_MS
+    over_budget |= not ok
+    print(f"{'create_app()':<24}{ms:8.1f} ms   budget {CREATE_APP_BUDGET_MS} ms   {'ok' if ok else 'OVER'}")
+    sys.exit(1 if over_budget else 0)
+
+
+if __name__ == '__main__':
+    main()
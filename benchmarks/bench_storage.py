@@ -0,0 +1,110 @@
+"""Micro-benchmark: per-operation latency of the user storage backends.
+
+Runs save_user, find_user_id (hit and miss), update_password and a
+500-row insert_users against each backend and prints p50/p99 per
+operation:
+
+  * SQLite in a temporary file
+  * ShardedUserStore over ``--shards`` SQLite files
+  * MySQL, when ``--mysql-user`` is given (``--mysql-database`` must exist
+    and hold the users table from users-2.sql; the rows added are removed)
+
+    python benchmarks/bench_storage.py --ops 2000
+    python benchmarks/bench_storage.py --mysql-user root --mysql-database userdb_bench
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from credentials import generate_user_id  # noqa: E402
+from storage import MySQLUserStore, ShardedUserStore, SQLiteUserStore  # noqa: E402
+
+HASH = 'scrypt:32768:8:1$' + 'x' * 16 + '$' + 'f' * 128     # realistic length, never verified
+BULK_ROWS = 500
+
+
+def percentile(sorted_values, pct):
+    index = min(len(sorted_values) - 1, max(0, round(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def timed(func, args_list):
+    latencies = []
+    for args in args_list:
+        start = time.perf_counter()
+        func(*args)
+        latencies.append(time.perf_counter() - start)
+    return sorted(latencies)
+
+
+def run(label, store, ops):
+    run_id = uuid.uuid4().hex[:8]
+    emails = [f'bench-{run_id}-{i}@example.com' for i in range(ops)]
+    users = [(generate_user_id(), email, HASH) for email in emails]
+    bulk = [(generate_user_id(), f'bulk-{run_id}-{i}-{j}@example.com', HASH)
+            for i in range(max(1, ops // 100)) for j in range(BULK_ROWS)]
+    results = {
+        'save_user': timed(store.save_user, users),
+        'find_user_id hit': timed(store.find_user_id, [(email,) for email in emails]),
+        'find_user_id miss': timed(store.find_user_id, [(f'missing-{email}',) for email in emails]),
+        'update_password': timed(store.update_password, [(email, HASH) for email in emails]),
+        f'insert_users x{BULK_ROWS}': timed(store.insert_users, [(bulk[i:i + BULK_ROWS],)
+                                                                 for i in range(0, len(bulk), BULK_ROWS)]),
+    }
+    print(label)
+    for operation, latencies in results.items():
+        print(f"  {operation:<22}p50 {percentile(latencies, 50) * 1000:8.3f} ms   "
+              f"p99 {percentile(latencies, 99) * 1000:8.3f} ms")
+    return [email for _, email, _ in users + bulk]
+
+
+def cleanup_mysql(config, emails):
+    import mysql.connector
+    conn = mysql.connector.connect(**config)
+    with conn.cursor() as cur:
+        for i in range(0, len(emails), 1000):
+            chunk = emails[i:i + 1000]
+            cur.execute(f"DELETE FROM users WHERE email IN ({','.join(['%s'] * len(chunk))})", chunk)
+    conn.commit()
+    conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--ops', type=int, default=2000, help='operations of each kind per backend')
+    parser.add_argument('--shards', type=int, default=4)
+    parser.add_argument('--mysql-host', default='localhost')
+    parser.add_argument('--mysql-user')
+    parser.add_argument('--mysql-password', default='')
+    parser.add_argument('--mysql-database', default='userdb_bench')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix='secureauth-bench-') as workdir:
+        store = SQLiteUserStore(os.path.join(workdir, 'users.db'))
+        run('sqlite', store, args.ops)
+        store.close()
+
+        store = ShardedUserStore([SQLiteUserStore(os.path.join(workdir, f'shard{i}.db'))
+                                  for i in range(args.shards)])
+        run(f'sqlite x{args.shards} shards', store, args.ops)
+        store.close()
+
+    if args.mysql_user:
+        from db_pool import ConnectionPool
+        config = {'host': args.mysql_host, 'user': args.mysql_user,
+                  'password': args.mysql_password, 'database': args.mysql_database}
+        store = MySQLUserStore(ConnectionPool(config, size=1, max_overflow=0))
+        try:
+            emails = run('mysql (prepared statements)', store, args.ops)
+        finally:
+            store.close()
+        cleanup_mysql(config, emails)
+
+
+if __name__ == '__main__':
+    main()
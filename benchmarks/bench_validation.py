@@ -0,0 +1,77 @@
+"""Micro-benchmark: bulk email validation throughput.
+
+Validates a synthetic list of addresses (a mix of valid, malformed,
+disposable and IDN ones spread over ``--domains`` domains) with:
+
+  * the original per-call ``re.match(pattern, email)``
+  * EmailValidator without MX checks
+  * EmailValidator with MX checks through a stub resolver that sleeps
+    ``--dns-latency`` seconds per lookup, to show the per-domain cache
+
+    python benchmarks/bench_validation.py --addresses 200000
+"""
+import argparse
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from validation import EmailValidator, MXCache  # noqa: E402
+
+LEGACY_PATTERN = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
+
+
+def make_addresses(count, domains):
+    rng = random.Random(42)
+    names = [f'company{i}.example' for i in range(domains)]
+    addresses = []
+    for i in range(count):
+        kind = rng.random()
+        if kind < 0.85:
+            addresses.append(f'user.{i}+tag@{rng.choice(names)}')
+        elif kind < 0.92:
+            addresses.append(f'user{i}@mailinator.com')
+        elif kind < 0.97:
+            addresses.append(f'user{i}@bücher{i % domains}.example')
+        else:
+            addresses.append(f'user{i}@@broken')
+    return addresses
+
+
+def run(label, func, addresses):
+    start = time.perf_counter()
+    accepted = sum(1 for email in addresses if func(email))
+    elapsed = time.perf_counter() - start
+    print(f"{label:<34}{len(addresses) / elapsed:12,.0f} addr/s   {accepted} accepted")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--addresses', type=int, default=200000)
+    parser.add_argument('--domains', type=int, default=500)
+    parser.add_argument('--dns-latency', type=float, default=0.005)
+    args = parser.parse_args()
+
+    addresses = make_addresses(args.addresses, args.domains)
+    run('re.match(pattern, email)', lambda email: re.match(LEGACY_PATTERN, email) is not None, addresses)
+
+    validator = EmailValidator()
+    run('EmailValidator', lambda email: validator.check(email)[1] is None, addresses)
+
+    lookups = []
+
+    def stub_resolver(domain):
+        lookups.append(domain)
+        time.sleep(args.dns_latency)
+        return True
+
+    validator = EmailValidator(mx_cache=MXCache(stub_resolver))
+    run('EmailValidator + cached MX', lambda email: validator.check(email)[1] is None, addresses)
+    print(f"  {len(lookups)} DNS lookups for {len(addresses)} addresses")
+
+
+if __name__ == '__main__':
+    main()
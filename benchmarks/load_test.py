@@ -0,0 +1,238 @@
+"""Load test for /, /register and /forgot against local stand-ins.
+
+Runs the Flask app in-process on a threaded werkzeug server, pointed at a
+local MySQL/MariaDB database and a local aiosmtpd server that adds
+``--smtp-latency`` seconds per message. Each route is then driven at
+``--concurrency`` parallel clients and the results are written as JSON so
+runs on different commits can be compared.
+
+    pip install aiosmtpd
+    python benchmarks/load_test.py --db-user root --load-schema \\
+        --requests 500 --concurrency 16 --output bench_output.json
+
+``--load-schema`` (re)creates ``--db-name`` from users-2.sql first.
+"""
+import argparse
+import asyncio
+import http.client
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+from aiosmtpd.controller import Controller  # noqa: E402
+from werkzeug.serving import make_server  # noqa: E402
+
+
+class FakeRelay:
+    """aiosmtpd handler that counts sessions and messages and simulates latency"""
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.sessions = 0
+        self.messages = 0
+
+    async def handle_EHLO(self, server, session, envelope, hostname, responses):
+        self.sessions += 1
+        session.host_name = hostname
+        return responses
+
+    async def handle_DATA(self, server, session, envelope):
+        await asyncio.sleep(self.latency)
+        self.messages += 1
+        return '250 OK'
+
+
+def load_schema(db_config, database):
+    """Create ``database`` from scratch using users-2.sql"""
+    import mysql.connector
+
+    config = {k: v for k, v in db_config.items() if k != 'database'}
+    conn = mysql.connector.connect(**config)
+    cur = conn.cursor()
+    cur.execute(f"DROP DATABASE IF EXISTS `{database}`")
+    cur.execute(f"CREATE DATABASE `{database}`")
+    cur.execute(f"USE `{database}`")
+    with open(os.path.join(ROOT, 'users-2.sql'), encoding='utf-8') as f:
+        script = f.read()
+    for statement in script.split(';\n'):
+        lines = [line for line in statement.splitlines() if not line.startswith('--')]
+        statement = '\n'.join(lines).strip()
+        if statement:
+            cur.execute(statement)
+    conn.commit()
+    cur.close()
+    conn.close()
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, round(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def drive(port, method, path, bodies, concurrency):
+    """Issue one request per body (or ``len(bodies)`` GETs) and collect latencies"""
+    local = threading.local()
+
+    def one(body):
+        conn = getattr(local, 'conn', None)
+        if conn is None:
+            conn = local.conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+        headers = {'Content-Type': 'application/x-www-form-urlencoded'} if body else {}
+        start = time.perf_counter()
+        try:
+            conn.request(method, path, body=body, headers=headers)
+            resp = conn.getresponse()
+            resp.read()
+            ok = resp.status < 500
+        except (OSError, http.client.HTTPException):
+            local.conn = None
+            ok = False
+        return time.perf_counter() - start, ok
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(one, bodies))
+    elapsed = time.perf_counter() - start
+
+    latencies = sorted(latency for latency, _ in results)
+    errors = sum(1 for _, ok in results if not ok)
+    return {
+        'requests': len(results),
+        'errors': errors,
+        'seconds': round(elapsed, 4),
+        'requests_per_second': round(len(results) / elapsed, 2),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test the SecureAuth app against local stand-ins.')
+    parser.add_argument('--requests', type=int, default=200, help='requests per route')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--routes', default='index,register,forgot', help='comma separated subset')
+    parser.add_argument('--smtp-latency', type=float, default=0.05, help='seconds per message at the fake relay')
+    parser.add_argument('--smtp-port', type=int, default=8025)
+    parser.add_argument('--db-host', default='localhost')
+    parser.add_argument('--db-user', default='root')
+    parser.add_argument('--db-password', default='')
+    parser.add_argument('--db-name', default='userdb_bench')
+    parser.add_argument('--load-schema', action='store_true', help='recreate --db-name from users-2.sql')
+    parser.add_argument('--keep-rate-limits', action='store_true',
+                        help='apply RATE_LIMITS (by default they are lifted so every request does real work)')
+    parser.add_argument('--drain-timeout', type=float, default=120, help='seconds to wait for the outbox to empty')
+    parser.add_argument('--output', help='write JSON results here (default: stdout only)')
+    args = parser.parse_args()
+
+    db_config = {'host': args.db_host, 'user': args.db_user, 'password': args.db_password, 'database': args.db_name}
+    if args.load_schema:
+        load_schema(db_config, args.db_name)
+
+    relay = FakeRelay(args.smtp_latency)
+    controller = Controller(relay, hostname='127.0.0.1', port=args.smtp_port)
+    controller.start()
+
+    import app as webapp
+    from db_pool import ConnectionPool
+    from outbox import Outbox
+    from ratelimit import MemoryBucketStore, RateLimiter
+    from relays import Relay, RelayRouter
+    from smtp_pool import SMTPPool
+    from storage import MySQLUserStore
+
+    workdir = tempfile.mkdtemp(prefix='secureauth-bench-')
+    webapp.user_store = MySQLUserStore(ConnectionPool(db_config, size=webapp.DB_POOL_SIZE,
+                                                      max_overflow=webapp.DB_POOL_MAX_OVERFLOW))
+    relay_pool = SMTPPool('127.0.0.1', args.smtp_port, size=webapp.SMTP_POOL_SIZE, use_tls=False)
+    webapp.smtp_sender = RelayRouter([Relay('bench', relay_pool)], MemoryBucketStore(max_keys=None),
+                                     reply_code=webapp.smtp_reply_code)
+    webapp.outbox = Outbox(os.path.join(workdir, 'outbox.db'), webapp.deliver_email,
+                           workers=webapp.OUTBOX_WORKERS, backoff_base=1, scheduler=webapp.domain_scheduler)
+    if not args.keep_rate_limits:
+        webapp.rate_limiter = RateLimiter(MemoryBucketStore(), {rule: (10 ** 9, 1) for rule in webapp.RATE_LIMITS})
+
+    server = make_server('127.0.0.1', 0, webapp.app, threaded=True)
+    port = server.server_port
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    run_id = uuid.uuid4().hex[:8]
+    emails = [f'bench-{run_id}-{i}@example.com' for i in range(args.requests)]
+    forms = [urllib.parse.urlencode({'email': email}) for email in emails]
+    routes = [name.strip() for name in args.routes.split(',') if name.strip()]
+
+    results = {}
+    try:
+        for name in routes:
+            if name == 'index':
+                results['/'] = drive(port, 'GET', '/', [None] * args.requests, args.concurrency)
+            elif name == 'register':
+                results['/register'] = drive(port, 'POST', '/register', forms, args.concurrency)
+            elif name == 'forgot':
+                results['/forgot'] = drive(port, 'POST', '/forgot', forms, args.concurrency)
+            else:
+                parser.error(f'unknown route {name!r}')
+            print(f"{name:<10}{json.dumps(results.get('/' if name == 'index' else '/' + name))}")
+
+        drain_start = time.perf_counter()
+        while time.perf_counter() - drain_start < args.drain_timeout:
+            counts = webapp.outbox.stats()
+            if counts['pending'] == 0 and counts['sending'] == 0:
+                break
+            time.sleep(0.1)
+        outbox_drain = time.perf_counter() - drain_start
+    finally:
+        server.shutdown()
+        webapp.outbox.stop()
+        webapp.smtp_sender.close()
+        webapp.hash_pool.shutdown()
+        controller.stop()
+
+    report = {
+        'commit': git_commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'python': platform.python_version(),
+        'cpu_count': os.cpu_count(),
+        'config': {
+            'requests_per_route': args.requests,
+            'concurrency': args.concurrency,
+            'smtp_latency': args.smtp_latency,
+        },
+        'routes': results,
+        'smtp_sessions_opened': relay.sessions,
+        'smtp_messages_delivered': relay.messages,
+        'db_connections_opened': webapp.user_store.stats()['opened'],
+        'outbox': webapp.outbox.stats(),
+        'outbox_drain_seconds': round(outbox_drain, 3),
+        'hash_pool': webapp.hash_pool.stats(),
+    }
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,16 @@
+"""User id and password generation.
+
+Standard library only, so CLI tools can import it without loading Flask or
+the database and SMTP backends.
+"""
+import secrets
+
+
+def generate_user_id():
+    return secrets.token_hex(4)           # 8-char ID
+
+
+def generate_credentials():
+    user_id = generate_user_id()
+    password = secrets.token_urlsafe(8)   # Random password
+    return user_id, password
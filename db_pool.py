@@ -0,0 +1,129 @@
+import threading
+import time
+from collections import deque
+
+import metrics
+
+
+class ConnectionPool:
+    """Thread-safe pool of MySQL connections.
+
+    Keeps up to ``size`` idle connections and allows ``max_overflow`` extra
+    ones under load, which are closed instead of pooled when released.
+    Connections older than ``recycle`` seconds are replaced, and with
+    ``pre_ping`` each checkout verifies the connection is still alive.
+    """
+
+    def __init__(self, config, size=5, max_overflow=5, recycle=1800, pre_ping=True, timeout=10):
+        self.config = dict(config)
+        self.size = size
+        self.max_overflow = max_overflow
+        self.recycle = recycle
+        self.pre_ping = pre_ping
+        self.timeout = timeout
+
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(size + max_overflow)
+        self._idle = deque()          # (conn, created_at) pairs
+        self._created = {}            # id(conn) -> created_at for checked out connections
+        self._stats = {
+            'opened': 0,
+            'reused': 0,
+            'recycled': 0,
+            'ping_failures': 0,
+            'overflow_closed': 0,
+        }
+
+    def _connect(self):
+        import mysql.connector      # slow to import; not needed until the first connection
+        with metrics.timed('db_connect'):
+            conn = mysql.connector.connect(**self.config)
+        with self._lock:
+            self._stats['opened'] += 1
+        return conn, time.monotonic()
+
+    @staticmethod
+    def _quietly_close(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _is_alive(self, conn):
+        try:
+            conn.ping(reconnect=False)
+            return True
+        except Exception:
+            return False
+
+    def acquire(self):
+        """Check out a connection, waiting up to ``timeout`` seconds for a free slot"""
+        if not self._slots.acquire(timeout=self.timeout):
+            raise TimeoutError('Timed out waiting for a free database connection')
+        try:
+            conn = None
+            while True:
+                with self._lock:
+                    if not self._idle:
+                        break
+                    conn, created_at = self._idle.pop()
+                if time.monotonic() - created_at > self.recycle:
+                    self._quietly_close(conn)
+                    with self._lock:
+                        self._stats['recycled'] += 1
+                    conn = None
+                    continue
+                if self.pre_ping and not self._is_alive(conn):
+                    self._quietly_close(conn)
+                    with self._lock:
+                        self._stats['ping_failures'] += 1
+                    conn = None
+                    continue
+                with self._lock:
+                    self._stats['reused'] += 1
+                break
+            if conn is None:
+                conn, created_at = self._connect()
+            with self._lock:
+                self._created[id(conn)] = created_at
+            return conn
+        except Exception:
+            self._slots.release()
+            raise
+
+    def release(self, conn, discard=False):
+        """Return a connection to the pool, rolling back any open transaction"""
+        with self._lock:
+            created_at = self._created.pop(id(conn), time.monotonic())
+        if not discard:
+            try:
+                if conn.in_transaction:
+                    conn.rollback()
+            except Exception:
+                discard = True
+        with self._lock:
+            keep = not discard and len(self._idle) < self.size
+            if keep:
+                self._idle.append((conn, created_at))
+            elif not discard:
+                self._stats['overflow_closed'] += 1
+        if not keep:
+            self._quietly_close(conn)
+        self._slots.release()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['idle'] = len(self._idle)
+            stats['in_use'] = len(self._created)
+            stats['size'] = self.size
+            stats['max_overflow'] = self.max_overflow
+        return stats
+
+    def close(self):
+        """Close all idle connections"""
+        with self._lock:
+            idle = [conn for conn, _ in self._idle]
+            self._idle.clear()
+        for conn in idle:
+            self._quietly_close(conn)
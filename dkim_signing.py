@@ -0,0 +1,224 @@
+"""DKIM signing (RFC 6376) for outgoing mail.
+
+Messages are signed with relaxed/relaxed canonicalization, using
+rsa-sha256 or ed25519-sha256 (RFC 8463) depending on the key. Requires
+``cryptography``.
+"""
+import base64
+import hashlib
+import os
+import re
+import threading
+import time
+from collections import deque
+
+import metrics
+
+DEFAULT_SIGNED_HEADERS = ('From', 'To', 'Subject', 'Date', 'Message-ID', 'Reply-To',
+                          'MIME-Version', 'Content-Type', 'Content-Transfer-Encoding')
+
+_WSP_RUN = re.compile(rb'[ \t]+')
+_TRAILING_WSP = re.compile(rb'[ \t]+\r\n')
+_FOLD = re.compile(rb'\r\n(?=[ \t])')
+
+_keys = {}                  # path -> (mtime, parsed key)
+_keys_lock = threading.Lock()
+
+
+def load_private_key(path):
+    """Parse the PEM private key at ``path``; cached until the file changes"""
+    mtime = os.stat(path).st_mtime_ns
+    with _keys_lock:
+        cached = _keys.get(path)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+    try:
+        from cryptography.hazmat.primitives import serialization
+    except ImportError:  # optional: only needed when DKIM signing is enabled
+        raise RuntimeError('DKIM signing requires cryptography (pip install cryptography)')
+    with open(path, 'rb') as f:
+        key = serialization.load_pem_private_key(f.read(), password=None)
+    with _keys_lock:
+        _keys[path] = (mtime, key)
+    return key
+
+
+def canonicalize_body(body):
+    """Relaxed body canonicalization of CRLF-terminated ``body`` bytes"""
+    body = _WSP_RUN.sub(b' ', _TRAILING_WSP.sub(b'\r\n', body))
+    if body.endswith(b' '):
+        body = body.rstrip(b' ')
+    body = body.rstrip(b'\r\n')
+    return body + b'\r\n' if body else b''
+
+
+def canonicalize_header(name, value):
+    """Relaxed header canonicalization; ``value`` is the raw (possibly folded) bytes after the colon"""
+    value = _WSP_RUN.sub(b' ', _FOLD.sub(b'', value)).strip(b' \r\n')
+    return name.lower().strip() + b':' + value
+
+
+def fold_signature(value, width=76):
+    """Fold a DKIM-Signature value at tag boundaries, wrapping the long b= value.
+
+    Relaxed canonicalization ignores folding whitespace, and verifiers strip
+    it from b=, so the signature stays valid.
+    """
+    lines = ['DKIM-Signature:']
+    for tag in value.split('; '):
+        if tag.startswith('b='):
+            pieces = [tag[i:i + width - 1] for i in range(0, len(tag), width - 1)]
+        else:
+            pieces = [tag + ';']
+        for piece in pieces:
+            if len(lines[-1]) + 1 + len(piece) > width:
+                lines.append('')
+            lines[-1] += ' ' + piece
+    return lines
+
+
+def split_message(raw):
+    """Split serialized ``raw`` bytes into ``[(name, value)]`` header fields and the body"""
+    head, _, body = raw.partition(b'\r\n\r\n')
+    fields = []
+    for line in head.split(b'\r\n'):
+        if line[:1] in (b' ', b'\t') and fields:
+            name, value = fields[-1]
+            fields[-1] = (name, value + b'\r\n' + line)
+        else:
+            name, _, value = line.partition(b':')
+            fields.append((name, value))
+    return fields, body
+
+
+class _FoldedHeader(str):
+    """A header value that keeps the folding it was given.
+
+    The email policy stores a value with a ``name`` attribute as is and
+    serializes it through its ``fold()``, so the signature is not refolded,
+    and its long b= token is not RFC 2047-encoded.
+    """
+
+    def __new__(cls, name, lines):
+        value = super().__new__(cls, ''.join(lines)[len(name) + 1:].strip())
+        value.name = name
+        value.lines = lines
+        return value
+
+    def fold(self, *, policy):
+        return policy.linesep.join(self.lines) + policy.linesep
+
+
+class DKIMSigner:
+    """Adds a DKIM-Signature header to ``email.message.EmailMessage`` objects.
+
+    The key is fetched through load_private_key on every signature, so it
+    is parsed once and a rotated key file is picked up without a restart.
+    """
+
+    def __init__(self, domain, selector, key_path, headers=DEFAULT_SIGNED_HEADERS):
+        self.domain = domain
+        self.selector = selector
+        self.key_path = key_path
+        self.headers = tuple(headers)
+        self._key_algorithm(load_private_key(key_path))     # fail at startup on a bad key
+        self._lock = threading.Lock()
+        self._stats = {'signed': 0}
+
+    @staticmethod
+    def _key_algorithm(key):
+        from cryptography.hazmat.primitives.asymmetric import ed25519, rsa
+        if isinstance(key, rsa.RSAPrivateKey):
+            return 'rsa-sha256'
+        if isinstance(key, ed25519.Ed25519PrivateKey):
+            return 'ed25519-sha256'
+        raise ValueError(f'Unsupported DKIM key type: {type(key).__name__}')
+
+    @staticmethod
+    def _sign_bytes(key, algorithm, data):
+        if algorithm == 'rsa-sha256':
+            from cryptography.hazmat.primitives import hashes
+            from cryptography.hazmat.primitives.asymmetric import padding
+            return key.sign(data, padding.PKCS1v15(), hashes.SHA256())
+        return key.sign(hashlib.sha256(data).digest())
+
+    def signature(self, raw):
+        """The DKIM-Signature header value for serialized (CRLF) message bytes"""
+        key = load_private_key(self.key_path)
+        algorithm = self._key_algorithm(key)
+        fields, body = split_message(raw)
+        remaining = {}
+        for name, value in fields:
+            remaining.setdefault(name.strip().lower(), []).append(value)
+        signed_names, signed = [], []
+        for header in self.headers:
+            values = remaining.get(header.lower().encode('ascii'))
+            if values:
+                # Repeated fields are signed from the bottom up (RFC 6376 5.4.2)
+                signed.append(canonicalize_header(header.encode('ascii'), values.pop()))
+                signed_names.append(header.lower())
+        body_hash = base64.b64encode(hashlib.sha256(canonicalize_body(body)).digest()).decode('ascii')
+        tags = (f'v=1; a={algorithm}; c=relaxed/relaxed; d={self.domain}; s={self.selector}; '
+                f't={int(time.time())}; h={":".join(signed_names)}; bh={body_hash}; b=')
+        data = b'\r\n'.join(signed) + b'\r\n' + canonicalize_header(b'DKIM-Signature', tags.encode('ascii'))
+        return tags + base64.b64encode(self._sign_bytes(key, algorithm, data)).decode('ascii')
+
+    def sign(self, msg):
+        """Sign ``msg`` in place and return it.
+
+        Serialized the way smtplib sends it; this also fixes the multipart
+        boundary, so the SMTP sender later produces the same body bytes.
+        """
+        with metrics.timed('dkim_sign'):
+            value = self.signature(msg.as_bytes(policy=msg.policy.clone(linesep='\r\n')))
+        # Appended, since the message API has no insert; verifiers find the field anywhere
+        msg['DKIM-Signature'] = _FoldedHeader('DKIM-Signature', fold_signature(value))
+        with self._lock:
+            self._stats['signed'] += 1
+        return msg
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+
+class SigningPool:
+    """Signs a stream of messages on worker threads, ahead of the sender.
+
+    ``sign_stream(messages)`` yields the signed messages in order while
+    keeping up to ``lookahead`` of them in flight, so signing overlaps with
+    the SMTP round trips of the messages before it and a lazily generated
+    batch is never read into memory all at once.
+    """
+
+    def __init__(self, signer, workers=2, lookahead=None):
+        self.signer = signer
+        self.workers = workers
+        self.lookahead = lookahead or workers * 4
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    from concurrent.futures import ThreadPoolExecutor
+                    self._executor = ThreadPoolExecutor(max_workers=self.workers,
+                                                        thread_name_prefix='dkim')
+        return self._executor
+
+    def sign_stream(self, messages):
+        executor = self._get_executor()
+        in_flight = deque()
+        for msg in messages:
+            in_flight.append(executor.submit(self.signer.sign, msg))
+            if len(in_flight) >= self.lookahead:
+                yield in_flight.popleft().result()
+        while in_flight:
+            yield in_flight.popleft().result()
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
@@ -0,0 +1,276 @@
+import threading
+import time
+from collections import deque
+
+import logs
+import metrics
+from relays import default_reply_code
+
+log = logs.get_logger('domain_scheduler')
+
+
+class _Domain:
+    __slots__ = ('name', 'queue', 'in_flight', 'concurrency', 'rate', 'next_send_at',
+                 'paused_until', 'strikes', 'throttled_at', 'send_seconds')
+
+    def __init__(self, name, concurrency, rate):
+        self.name = name
+        self.queue = deque()
+        self.in_flight = 0
+        self.concurrency = concurrency
+        self.rate = rate                # messages per second, None for unpaced
+        self.next_send_at = 0.0
+        self.paused_until = 0.0
+        self.strikes = 0                # consecutive throttling replies
+        self.throttled_at = None
+        self.send_seconds = 0.1         # moving average of one delivery
+
+    def ready_at(self):
+        return max(self.next_send_at, self.paused_until)
+
+
+class DomainScheduler:
+    """Delivers jobs through per-recipient-domain queues, round-robin across domains.
+
+    Each domain has its own queue, at most ``concurrency`` jobs running at
+    once (``limits`` overrides it per domain as ``{'concurrency': n,
+    'rate': per_second}``) and an adaptive send rate. A 421 or other 4xx
+    reply pauses the domain for ``backoff_base`` seconds, doubling with each
+    consecutive one up to ``backoff_max``, and halves its rate; every
+    success then raises the rate by 5% (up to the configured one), and a
+    domain not throttled for ``recovery`` seconds starts afresh. Worker
+    threads take the next ready domain in turn, so a slow or throttled
+    domain only delays its own mail.
+
+    ``job()`` performs one delivery and returns the exception it failed
+    with, or None. Jobs still queued when their domain is paused are handed
+    back through the ``defer(delay)`` callback given to submit(), so they
+    do not hold backlog slots other domains could use.
+    """
+
+    def __init__(self, workers=4, concurrency=2, limits=None, reply_code=default_reply_code,
+                 max_backlog=None, max_queued_per_domain=None, min_rate=0.1,
+                 backoff_base=5, backoff_max=120, recovery=600):
+        self.workers = workers
+        self.concurrency = concurrency
+        self.limits = dict(limits or {})
+        self.reply_code = reply_code
+        self.max_backlog = max_backlog or workers * 4
+        self.max_queued_per_domain = max_queued_per_domain or max(concurrency, self.max_backlog // 2)
+        self.min_rate = min_rate
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.recovery = recovery
+
+        self._domains = {}
+        self._ring = deque()            # domains with queued jobs, in round-robin order
+        self._queued = 0
+        self._cond = threading.Condition()
+        self._threads = []
+        self._stopping = False
+        self._stats = {'sent': 0, 'failed': 0, 'throttled': 0, 'refused': 0}
+
+    @staticmethod
+    def domain_of(email):
+        return email.rpartition('@')[2].lower()
+
+    def _domain(self, name, now):
+        domain = self._domains.get(name)
+        if domain is None:
+            limits = self.limits.get(name, {})
+            domain = self._domains[name] = _Domain(name, limits.get('concurrency', self.concurrency),
+                                                   limits.get('rate'))
+        elif domain.throttled_at is not None and now - domain.throttled_at > self.recovery:
+            domain.rate = self.limits.get(name, {}).get('rate')
+            domain.strikes = 0
+            domain.throttled_at = None
+        return domain
+
+    def room(self):
+        """How many more jobs may be submitted before the backlog is full"""
+        with self._cond:
+            return max(0, self.max_backlog - self._queued)
+
+    def submit(self, email, job, defer=None):
+        """Queue ``job`` for the domain of ``email``.
+
+        Returns None when accepted, or the number of seconds to wait before
+        offering it again when the domain is paused or its queue is full.
+        """
+        now = time.monotonic()
+        with self._cond:
+            domain = self._domain(self.domain_of(email), now)
+            if domain.paused_until > now:
+                self._stats['refused'] += 1
+                return domain.paused_until - now
+            if len(domain.queue) >= self.max_queued_per_domain:
+                self._stats['refused'] += 1
+                return self._drain_time(domain, now)
+            if not domain.queue:
+                self._ring.append(domain)
+            domain.queue.append((job, defer))
+            self._queued += 1
+            self._cond.notify()
+        self.start()
+        return None
+
+    @staticmethod
+    def _drain_time(domain, now):
+        """Estimated seconds until ``domain`` has worked through its queue"""
+        estimate = len(domain.queue) * domain.send_seconds / domain.concurrency
+        if domain.rate:
+            estimate = max(estimate, len(domain.queue) / domain.rate)
+        return max(0.1, estimate, domain.ready_at() - now)
+
+    def _next_ready(self, now):
+        """Return ``(domain, job, None)`` for the next runnable job in round-robin
+        order, or ``(None, None, wait)`` with the seconds until one is ready"""
+        wait = None
+        for index, domain in enumerate(self._ring):
+            if domain.in_flight >= domain.concurrency:
+                continue
+            ready_at = domain.ready_at()
+            if ready_at > now:
+                wait = ready_at - now if wait is None else min(wait, ready_at - now)
+                continue
+            job, _ = domain.queue.popleft()
+            self._queued -= 1
+            del self._ring[index]
+            if domain.queue:
+                self._ring.append(domain)       # back of the line
+            domain.in_flight += 1
+            if domain.rate:
+                domain.next_send_at = max(now, domain.next_send_at) + 1 / domain.rate
+            return domain, job, None
+        return None, None, wait
+
+    def _finished(self, domain, error, seconds, now):
+        """Update ``domain`` after a delivery; returns the jobs to hand back (see _hand_back)"""
+        handed_back = []
+        domain.in_flight -= 1
+        domain.send_seconds += 0.2 * (seconds - domain.send_seconds)
+        code = None if error is None else self.reply_code(error)
+        if error is None:
+            self._stats['sent'] += 1
+            domain.strikes = 0
+            if domain.rate is not None and domain.throttled_at is not None:
+                domain.rate *= 1.05
+                ceiling = self.limits.get(domain.name, {}).get('rate')
+                if ceiling is not None and domain.rate >= ceiling:
+                    domain.rate = ceiling
+        elif code is not None and 400 <= code < 500:
+            self._stats['throttled'] += 1
+            domain.strikes += 1
+            domain.throttled_at = now
+            domain.paused_until = now + min(self.backoff_base * 2 ** (domain.strikes - 1), self.backoff_max)
+            # Halve the rate observed so far (an unpaced domain starts from its concurrency per second)
+            domain.rate = max(self.min_rate, (domain.rate or domain.concurrency) / 2)
+            metrics.smtp_domain_throttled.inc(code)
+            handed_back = self._hand_back(domain)
+        else:
+            self._stats['failed'] += 1
+        # An idle domain is forgotten only once nothing about it needs remembering:
+        # dropping a paced one would let the next message skip its send interval
+        if (not domain.queue and not domain.in_flight and domain.throttled_at is None
+                and domain.next_send_at <= now and domain.name not in self.limits):
+            self._domains.pop(domain.name, None)
+        return handed_back
+
+    def _hand_back(self, domain):
+        """Take the queued jobs that have a defer callback off ``domain``.
+
+        Returns them as ``(job, defer)`` pairs; the caller calls ``defer`` once
+        it has released the lock, since deferring may write to a database.
+        """
+        kept = deque()
+        handed_back = []
+        for job, defer in domain.queue:
+            (kept if defer is None else handed_back).append((job, defer))
+        self._queued -= len(handed_back)
+        domain.queue = kept
+        if not kept and domain in self._ring:
+            self._ring.remove(domain)
+        return handed_back
+
+    def _defer(self, name, handed_back, delay):
+        """Call the defer callbacks (without the lock); jobs whose callback fails are queued again"""
+        failed = []
+        for job, defer in handed_back:
+            try:
+                defer(delay)
+            except Exception as e:
+                log.error('defer_failed', domain=name, error=str(e))
+                failed.append((job, defer))
+        if failed:
+            with self._cond:
+                domain = self._domain(name, time.monotonic())
+                if not domain.queue:
+                    self._ring.append(domain)
+                domain.queue.extend(failed)
+                self._queued += len(failed)
+                self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    if self._stopping:
+                        return
+                    domain, job, wait = self._next_ready(time.monotonic())
+                    if domain is not None:
+                        break
+                    self._cond.wait(wait)
+            started = time.monotonic()
+            try:
+                error = job()
+            except Exception as e:
+                log.error('delivery_raised', domain=domain.name, exc_info=True)
+                error = e
+            with self._cond:
+                now = time.monotonic()
+                handed_back = self._finished(domain, error, now - started, now)
+                delay = domain.paused_until - now
+                self._cond.notify_all()
+            if handed_back:
+                self._defer(domain.name, handed_back, delay)
+
+    def start(self):
+        """Start the worker threads (idempotent)"""
+        if self._threads:
+            return
+        with self._cond:
+            if self._threads:
+                return
+            self._stopping = False
+            for i in range(self.workers):
+                t = threading.Thread(target=self._run, name=f'domain-sender-{i}', daemon=True)
+                t.start()
+                self._threads.append(t)
+
+    def stop(self, timeout=10):
+        """Let running jobs finish and return the queued jobs that never started"""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        deadline = time.monotonic() + timeout
+        for t in self._threads:
+            t.join(max(0, deadline - time.monotonic()))
+        with self._cond:
+            self._threads = []
+            leftover = [job for domain in self._ring for job, _ in domain.queue]
+            for domain in self._ring:
+                domain.queue.clear()
+            self._ring.clear()
+            self._queued = 0
+        return leftover
+
+    def stats(self):
+        now = time.monotonic()
+        with self._cond:
+            stats = dict(self._stats)
+            stats['queued'] = self._queued
+            stats['in_flight'] = sum(domain.in_flight for domain in self._domains.values())
+            stats['domains'] = len(self._ring)
+            stats['paused'] = {domain.name: round(domain.paused_until - now, 1)
+                               for domain in self._domains.values() if domain.paused_until > now}
+        return stats
@@ -0,0 +1,123 @@
+import html
+import os
+import re
+import threading
+import time
+
+from jinja2 import Environment, FileSystemLoader, meta
+from markupsafe import Markup, escape
+
+_SLOT = '\x00{}\x00'
+_SLOT_RE = re.compile('\x00(\\w+)\x00')
+
+
+def html_to_text(source):
+    """Crude HTML -> plain text conversion used for the text/plain alternative"""
+    text = re.sub(r'(?is)<(head|style|script)\b.*?</\1>', '', source)
+    text = re.sub(r'(?i)<br\s*/?>', '\n', text)
+    text = re.sub(r'(?i)</(p|div|h[1-6]|tr|table)>', '\n', text)
+    text = re.sub(r'<[^>]+>', '', text)
+    text = html.unescape(text).replace('\xa0', ' ')
+    lines = [line.strip() for line in text.splitlines()]
+    text = '\n'.join(lines)
+    return re.sub(r'\n{3,}', '\n\n', text).strip() + '\n'
+
+
+class CompiledEmail:
+    """A template flattened into literal chunks and variable slots.
+
+    The template is rendered once with placeholder markers, so everything
+    that does not depend on the message (CSS, header, footer, inheritance)
+    is resolved up front. Rendering a message is then a single join of the
+    literal chunks with the escaped per-message values.
+    """
+
+    def __init__(self, rendered):
+        self.html_parts = _SLOT_RE.split(rendered)
+        self.text_parts = _SLOT_RE.split(html_to_text(rendered))
+        self.variables = frozenset(self.html_parts[1::2])
+
+    @staticmethod
+    def _fill(parts, values, quote):
+        out = list(parts)
+        for i in range(1, len(out), 2):
+            value = str(values[out[i]])
+            out[i] = quote(value) if quote else value
+        return ''.join(out)
+
+    def render(self, **values):
+        """Return ``(html, text)`` for one message"""
+        missing = self.variables.difference(values)
+        if missing:
+            raise KeyError(f"Missing template variables: {', '.join(sorted(missing))}")
+        return (self._fill(self.html_parts, values, escape),
+                self._fill(self.text_parts, values, None))
+
+
+class EmailTemplates:
+    """Loads email templates from ``directory`` and caches their compiled form.
+
+    Templates may only use message variables as plain ``{{ name }}``
+    substitutions. Edited files are picked up automatically; the directory
+    is checked for changes at most every ``check_interval`` seconds.
+    """
+
+    def __init__(self, directory, check_interval=2):
+        self.directory = directory
+        self.check_interval = check_interval
+        self.env = Environment(loader=FileSystemLoader(directory), autoescape=True, auto_reload=False)
+        self._lock = threading.Lock()
+        self._compiled = {}
+        self._mtime = self._latest_mtime()
+        self._next_check = time.monotonic() + check_interval
+
+    def _latest_mtime(self):
+        latest = 0
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                latest = max(latest, os.stat(os.path.join(root, name)).st_mtime_ns)
+        return latest
+
+    def _check_for_changes(self):
+        now = time.monotonic()
+        if now < self._next_check:
+            return
+        self._next_check = now + self.check_interval
+        mtime = self._latest_mtime()
+        if mtime != self._mtime:
+            with self._lock:
+                self._mtime = mtime
+                self._compiled.clear()
+                self.env.cache.clear()
+
+    def compile(self, name):
+        """Return the cached CompiledEmail for ``name``, compiling it on first use"""
+        self._check_for_changes()
+        compiled = self._compiled.get(name)
+        if compiled is None:
+            template = self.env.get_template(name)
+            names = _template_variables(self.env, name)
+            rendered = template.render({var: Markup(_SLOT.format(var)) for var in names})
+            compiled = CompiledEmail(rendered)
+            with self._lock:
+                self._compiled[name] = compiled
+        return compiled
+
+    def render(self, name, **values):
+        return self.compile(name).render(**values)
+
+
+def _template_variables(env, name):
+    """Undeclared variables of ``name`` and every template it extends or includes"""
+    seen, pending, variables = set(), [name], set()
+    while pending:
+        current = pending.pop()
+        if current in seen:
+            continue
+        seen.add(current)
+        source = env.loader.get_source(env, current)[0]
+        ast = env.parse(source)
+        variables |= meta.find_undeclared_variables(ast)
+        pending.extend(ref for ref in meta.find_referenced_templates(ast) if ref)
+    variables.discard('self')
+    return variables
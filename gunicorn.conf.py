@@ -0,0 +1,32 @@
+"""Production server settings: gunicorn -c gunicorn.conf.py app:app
+
+Each worker is a separate process with its own DB/SMTP pools, outbox
+threads and hash pool, so there are only a few workers and each serves
+requests on a thread pool. Password hashing already runs in the hash pool's
+processes, which are sized here so that all workers together use one
+process per core.
+"""
+import multiprocessing
+import os
+
+cores = multiprocessing.cpu_count()
+
+bind = os.environ.get('BIND', '127.0.0.1:5000')
+workers = int(os.environ.get('WEB_CONCURRENCY', min(4, cores)))
+worker_class = 'gthread'
+threads = int(os.environ.get('WEB_THREADS', 16))
+keepalive = 5                # seconds an idle keep-alive connection stays open
+timeout = 60
+graceful_timeout = 60        # SIGTERM: stop accepting, finish in-flight requests, then worker_exit; SIGKILL after this
+SHUTDOWN_TIMEOUT = 20        # worker_exit's share of graceful_timeout for flushing mail (not a gunicorn setting)
+raw_env = [f"HASH_WORKERS={max(1, cores // workers)}",
+           f"WEB_CONCURRENCY={workers}"]     # app.py splits per-host relay ceilings between workers
+# Bound to loopback, requests come through a reverse proxy: trust its X-Forwarded-For
+if bind.startswith(('127.0.0.1:', 'localhost:')) and 'TRUSTED_PROXIES' not in os.environ:
+    raw_env.append('TRUSTED_PROXIES=1')
+
+
+def worker_exit(server, worker):
+    """Flush outbound mail and close the worker's pools once its requests have drained"""
+    import app
+    app.shutdown(timeout=SHUTDOWN_TIMEOUT)
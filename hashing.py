@@ -0,0 +1,152 @@
+import os
+import threading
+import time
+from concurrent.futures import TimeoutError as FutureTimeout
+from itertools import repeat
+
+from werkzeug.security import generate_password_hash
+
+
+class HashPoolSaturated(Exception):
+    """Raised when too many hashes are already queued"""
+
+
+class HashPoolUnavailable(Exception):
+    """Raised when a hash timed out or the worker processes died"""
+
+
+def _hash_password(password, method, salt_length):
+    # Runs in a worker process; returns the hash and the CPU time it took
+    start = time.perf_counter()
+    password_hash = generate_password_hash(password, method=method, salt_length=salt_length)
+    return password_hash, time.perf_counter() - start
+
+
+class HashPool:
+    """Computes password hashes on a pool of worker processes.
+
+    scrypt is deliberately slow and memory hungry, so it runs outside the
+    request threads and scales across cores. At most ``workers + max_pending``
+    hashes may be in flight; beyond that ``hash()`` raises HashPoolSaturated
+    immediately instead of queueing without bound. A hash that times out
+    keeps its slot until the worker has actually finished it, so the bound
+    holds even when callers give up.
+    """
+
+    def __init__(self, workers=None, max_pending=None, method='scrypt:32768:8:1',
+                 salt_length=16, timeout=30):
+        self.workers = workers or os.cpu_count() or 1
+        self.max_pending = self.workers * 4 if max_pending is None else max_pending
+        self.method = method
+        self.salt_length = salt_length
+        self.timeout = timeout
+
+        self._executor = None
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self.workers + self.max_pending)
+        self._in_flight = 0
+        self._stats = {
+            'hashed': 0,
+            'rejected': 0,
+            'failed': 0,
+            'hash_seconds_total': 0.0,
+            'hash_seconds_max': 0.0,
+            'wait_seconds_total': 0.0,
+        }
+
+    def _get_executor(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    # Imported here: multiprocessing is slow to load and only needed once hashing starts
+                    import multiprocessing
+                    from concurrent.futures import ProcessPoolExecutor
+                    # spawn: never fork a parent that is already running threads
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=self.workers,
+                        mp_context=multiprocessing.get_context('spawn'))
+        return self._executor
+
+    def hash(self, password):
+        """Hash ``password`` on the pool, blocking until the result is ready"""
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._stats['rejected'] += 1
+            raise HashPoolSaturated('Password hashing queue is full')
+        from concurrent.futures.process import BrokenProcessPool    # loaded with the executor anyway
+        start = time.perf_counter()
+        with self._lock:
+            self._in_flight += 1
+        executor = None
+        try:
+            executor = self._get_executor()
+            future = executor.submit(_hash_password, password, self.method, self.salt_length)
+        except BaseException as e:
+            self._release_slot()
+            if isinstance(e, BrokenProcessPool):
+                self._failed(executor)
+                raise HashPoolUnavailable('Password hashing workers died') from e
+            self._failed()
+            raise
+        future.add_done_callback(self._release_slot)
+        try:
+            password_hash, hash_seconds = future.result(timeout=self.timeout)
+        except FutureTimeout as e:
+            future.cancel()     # frees the slot now if the hash has not started yet
+            self._failed()
+            raise HashPoolUnavailable(f'Password hash took longer than {self.timeout}s') from e
+        except BrokenProcessPool as e:
+            self._failed(executor)
+            raise HashPoolUnavailable('Password hashing workers died') from e
+        except Exception:
+            self._failed()
+            raise
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self._stats['hashed'] += 1
+            self._stats['hash_seconds_total'] += hash_seconds
+            self._stats['hash_seconds_max'] = max(self._stats['hash_seconds_max'], hash_seconds)
+            self._stats['wait_seconds_total'] += max(0.0, elapsed - hash_seconds)
+        return password_hash
+
+    def _release_slot(self, future=None):
+        with self._lock:
+            self._in_flight -= 1
+        self._slots.release()
+
+    def _failed(self, broken=None):
+        """Count a failed hash; a ``broken`` executor is dropped so the next hash starts a fresh one"""
+        with self._lock:
+            self._stats['failed'] += 1
+            if broken is not None and self._executor is broken:
+                self._executor = None
+        if broken is not None:
+            broken.shutdown(wait=False, cancel_futures=True)
+
+    def hash_many(self, passwords, chunksize=16):
+        """Hash an iterable of passwords across all workers, preserving order.
+
+        Meant for batch jobs: bypasses the request admission limit.
+        """
+        results = list(self._get_executor().map(
+            _hash_password, passwords, repeat(self.method), repeat(self.salt_length), chunksize=chunksize))
+        with self._lock:
+            self._stats['hashed'] += len(results)
+            for _, hash_seconds in results:
+                self._stats['hash_seconds_total'] += hash_seconds
+                self._stats['hash_seconds_max'] = max(self._stats['hash_seconds_max'], hash_seconds)
+        return [password_hash for password_hash, _ in results]
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['in_flight'] = self._in_flight
+            stats['workers'] = self.workers
+            stats['max_pending'] = self.max_pending
+        return stats
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait, cancel_futures=not wait)
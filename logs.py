@@ -0,0 +1,202 @@
+"""Structured, non-blocking logging for the request and delivery paths.
+
+Events are JSON objects, one per line, with the event name, level, time
+and any fields passed in. Inside a request or delivery ``context()`` they
+also carry its request id, route, a keyed hash of the email address (never
+the address itself) and the time spent in each ``metrics.timed()`` stage
+(recorded only while metrics are enabled).
+
+Callers only put the record on a bounded queue; a listener thread formats
+and writes it. When the queue is full the record is dropped and counted
+rather than blocking the request. High-volume INFO events can be sampled
+per event name with ``sample_rates``; warnings and errors always pass.
+"""
+import atexit
+import contextvars
+import hashlib
+import json
+import os
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+import time
+from contextlib import contextmanager
+
+import metrics
+
+sample_rates = {}           # event name -> share of INFO events kept
+_hash_key = b''
+_listener = None
+_context = contextvars.ContextVar('secureauth_log_context', default=None)
+
+_RESERVED = ('event', 'level', 'ts', 'logger')
+
+
+def email_hash(email):
+    """Short keyed hash that correlates an address across events without logging it"""
+    return hashlib.blake2b(email.strip().lower().encode('utf-8'), digest_size=8, key=_hash_key).hexdigest()
+
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'ts': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(record.created)) + f'.{int(record.msecs):03d}Z',
+            'level': record.levelname.lower(),
+            'logger': record.name,
+            'event': record.getMessage(),
+        }
+        entry.update(getattr(record, 'context', None) or {})
+        entry.update(getattr(record, 'fields', None) or {})
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, separators=(',', ':'), default=str)
+
+
+class _DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that drops (and counts) records instead of blocking when the queue is full"""
+
+    def prepare(self, record):
+        # The listener is a thread of this process, so the record needs no
+        # pickling: formatting (and any traceback rendering) happens there.
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            metrics.log_records_dropped.inc()
+
+
+def configure(level='INFO', stream=None, queue_size=10000, rates=None, hash_key=b''):
+    """Route the ``secureauth`` loggers through a queue to a JSON writer thread (idempotent).
+
+    Without a ``hash_key`` a random one is generated, so email hashes can
+    never be reversed with a dictionary, but they only match up within
+    this process.
+    """
+    global _listener, _hash_key
+    sample_rates.clear()
+    sample_rates.update(rates or {})
+    _hash_key = hash_key or _hash_key or os.urandom(32)
+    root = logging.getLogger('secureauth')
+    root.setLevel(level)
+    if record_stage not in metrics.stage_observers:
+        metrics.stage_observers.append(record_stage)
+    if _listener is not None:
+        return
+    records = queue.Queue(queue_size)
+    writer = logging.StreamHandler(stream or sys.stderr)
+    writer.setFormatter(JSONFormatter())
+    root.addHandler(_DroppingQueueHandler(records))
+    root.propagate = False
+    _listener = logging.handlers.QueueListener(records, writer, respect_handler_level=True)
+    _listener.start()
+    atexit.register(flush)
+    if not hash_key:
+        get_logger('logs').warning('email_hash_key_generated',
+                                   detail='no hash key configured; email_hash values only correlate within this process')
+
+
+def flush():
+    """Write out queued records and stop the writer thread"""
+    global _listener
+    listener, _listener = _listener, None
+    if listener is not None:
+        listener.stop()
+        listener.handlers[0].flush()
+        logging.getLogger('secureauth').handlers.clear()
+
+
+def push(request_id=None, route=None, email=None, **fields):
+    """Start a context for hooks that cannot wrap the code it covers; returns the token for pop()"""
+    current = {'stages': {}}
+    if request_id is not None:
+        current['request_id'] = request_id
+    if route is not None:
+        current['route'] = route
+    if email:
+        current['email_hash'] = email_hash(email)
+    current.update(fields)
+    return _context.set(current)
+
+
+def pop(token):
+    _context.reset(token)
+
+
+@contextmanager
+def context(request_id=None, route=None, email=None, **fields):
+    """Attach request/delivery fields, and the stage timings recorded inside, to every event logged within"""
+    token = push(request_id, route, email, **fields)
+    try:
+        yield _context.get()
+    finally:
+        pop(token)
+
+
+def bind(email=None, **fields):
+    """Add fields to the current context (no-op outside one)"""
+    current = _context.get()
+    if current is None:
+        return
+    if email:
+        current['email_hash'] = email_hash(email)
+    current.update(fields)
+
+
+def record_stage(stage, seconds):
+    """Called by metrics timers: add ``seconds`` to ``stage`` in the current context"""
+    current = _context.get()
+    if current is not None:
+        stages = current['stages']
+        stages[stage] = stages.get(stage, 0.0) + seconds
+
+
+def _snapshot(current):
+    snapshot = {k: v for k, v in current.items() if k != 'stages' and k not in _RESERVED}
+    if current['stages']:
+        snapshot['stage_ms'] = {stage: round(seconds * 1000, 3) for stage, seconds in current['stages'].items()}
+    return snapshot
+
+
+class EventLogger:
+    """``log.info('email_sent', smtp_code=250)``: an event name plus JSON fields.
+
+    The event name is the message; the current context and the keyword
+    fields are attached to the record and only formatted by the writer.
+    """
+
+    def __init__(self, name):
+        self._logger = logging.getLogger(name)
+
+    def _log(self, level, event, exc_info, fields):
+        if not self._logger.isEnabledFor(level):
+            return
+        if level == logging.INFO:
+            rate = sample_rates.get(event, 1.0)
+            if rate < 1.0:
+                if random.random() >= rate:
+                    return
+                fields['sample_rate'] = rate
+        current = _context.get()
+        extra = {'fields': fields, 'context': _snapshot(current) if current is not None else None}
+        self._logger.log(level, event, exc_info=exc_info, extra=extra)
+
+    def debug(self, event, **fields):
+        self._log(logging.DEBUG, event, False, fields)
+
+    def info(self, event, **fields):
+        self._log(logging.INFO, event, False, fields)
+
+    def warning(self, event, exc_info=False, **fields):
+        self._log(logging.WARNING, event, exc_info, fields)
+
+    def error(self, event, exc_info=False, **fields):
+        self._log(logging.ERROR, event, exc_info, fields)
+
+
+def get_logger(name):
+    """EventLogger under the ``secureauth`` hierarchy, e.g. get_logger('outbox')"""
+    return EventLogger(f'secureauth.{name}')
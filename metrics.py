@@ -0,0 +1,209 @@
+"""Minimal Prometheus-style metrics for the auth/email pipeline.
+
+Counters and histograms are updated in-process and rendered in the
+Prometheus text format by ``render()``. Gauges are callbacks evaluated at
+scrape time. When ``enabled`` is False, ``timed()`` hands back a shared
+no-op context manager and ``inc()`` returns immediately, so instrumented
+code pays one attribute check.
+"""
+import threading
+import time
+from contextlib import nullcontext
+
+enabled = True
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_NOOP = nullcontext()
+_registry = []
+stage_observers = []    # callables given (stage, seconds) after each timed() block, e.g. logs.record_stage
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    escaped = (f'{k}="{_escape(v)}"' for k, v in pairs)
+    return '{' + ','.join(escaped) + '}'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, *labels, amount=1):
+        if not enabled:
+            return
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def collect(self):
+        yield f'# HELP {self.name} {self.documentation}'
+        yield f'# TYPE {self.name} counter'
+        with self._lock:
+            items = list(self._values.items())
+        for labels, value in items:
+            yield f'{self.name}{_format_labels(self.labelnames, labels)} {value}'
+
+
+class _Timer:
+    __slots__ = ('histogram', 'labels', 'start')
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.histogram.observe(time.perf_counter() - self.start, *self.labels)
+        return False
+
+
+class _StageTimer(_Timer):
+    __slots__ = ()
+
+    def __exit__(self, exc_type, exc, tb):
+        seconds = time.perf_counter() - self.start
+        self.histogram.observe(seconds, *self.labels)
+        for observer in stage_observers:
+            observer(self.labels[0], seconds)
+        return False
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}      # labels -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value, *labels):
+        if not enabled:
+            return
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            series[-2] += value
+            series[-1] += 1
+
+    def time(self, *labels):
+        if not enabled:
+            return _NOOP
+        return _Timer(self, labels)
+
+    def collect(self):
+        yield f'# HELP {self.name} {self.documentation}'
+        yield f'# TYPE {self.name} histogram'
+        with self._lock:
+            items = [(labels, list(series)) for labels, series in self._series.items()]
+        for labels, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                yield f'{self.name}_bucket{_format_labels(self.labelnames, labels, ("le", bound))} {cumulative}'
+            yield f'{self.name}_bucket{_format_labels(self.labelnames, labels, ("le", "+Inf"))} {series[-1]}'
+            yield f'{self.name}_sum{_format_labels(self.labelnames, labels)} {series[-2]}'
+            yield f'{self.name}_count{_format_labels(self.labelnames, labels)} {series[-1]}'
+
+
+class Gauge:
+    """Gauge whose value is read from ``callback`` at scrape time.
+
+    The callback returns a number, or a dict mapping label-value tuples to numbers.
+    """
+
+    def __init__(self, name, documentation, callback, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.callback = callback
+        self.labelnames = tuple(labelnames)
+        _registry.append(self)
+
+    def collect(self):
+        yield f'# HELP {self.name} {self.documentation}'
+        yield f'# TYPE {self.name} gauge'
+        try:
+            value = self.callback()
+        except Exception:
+            return
+        if isinstance(value, dict):
+            for labels, v in value.items():
+                yield f'{self.name}{_format_labels(self.labelnames, labels)} {v}'
+        else:
+            yield f'{self.name} {value}'
+
+
+def render():
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.collect())
+    return '\n'.join(lines) + '\n'
+
+
+# ---------------- Pipeline metrics ----------------
+stage_seconds = Histogram(
+    'secureauth_stage_seconds',
+    'Time spent in each stage of the auth/email pipeline.',
+    ['stage'])
+
+smtp_sends = Counter(
+    'secureauth_smtp_sends_total',
+    'Messages handed to the SMTP relay, by result and SMTP reply code.',
+    ['result', 'code'])
+
+smtp_relay_sends = Counter(
+    'secureauth_smtp_relay_sends_total',
+    'Messages offered to each SMTP relay, by outcome (success, rejected, relay_failure, throttled).',
+    ['relay', 'result'])
+
+smtp_domain_throttled = Counter(
+    'secureauth_smtp_domain_throttled_total',
+    'Throttling replies (421/4xx) that paused a recipient domain, by SMTP reply code.',
+    ['code'])
+
+coalesced_requests = Counter(
+    'secureauth_coalesced_requests_total',
+    'Requests answered with the outcome of an identical in-flight or recent request, by route and how they matched.',
+    ['route', 'match'])
+
+rate_limited = Counter(
+    'secureauth_rate_limited_total',
+    'Requests rejected by the rate limiter, by rule.',
+    ['rule'])
+
+log_records_dropped = Counter(
+    'secureauth_log_records_dropped_total',
+    'Log records discarded because the log queue was full.')
+
+user_bloom_negatives = Counter(
+    'secureauth_user_bloom_negatives_total',
+    'User lookups answered as absent by the Bloom filter without a query.')
+
+
+def timed(stage):
+    """Context manager recording the duration of ``stage``"""
+    if not enabled:
+        return _NOOP
+    return _StageTimer(stage_seconds, (stage,))
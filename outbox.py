@@ -0,0 +1,335 @@
+import random
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from functools import partial
+
+import logs
+from relays import default_reply_code, is_relay_failure_code
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS email_outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    to_email TEXT NOT NULL,
+    subject TEXT NOT NULL,
+    body TEXT NOT NULL,
+    text_body TEXT,
+    is_html INTEGER NOT NULL DEFAULT 0,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL,
+    locked_until REAL,
+    last_error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_email_outbox_due ON email_outbox (status, next_attempt_at);
+CREATE INDEX IF NOT EXISTS idx_email_outbox_lease ON email_outbox (status, locked_until);
+
+CREATE TABLE IF NOT EXISTS email_delivery_log (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    message_id INTEGER NOT NULL,
+    to_email TEXT NOT NULL,
+    attempt INTEGER NOT NULL,
+    attempted_at REAL NOT NULL,
+    latency_ms REAL NOT NULL,
+    smtp_code INTEGER,
+    outcome TEXT NOT NULL,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_email_delivery_log_message ON email_delivery_log (message_id);
+CREATE INDEX IF NOT EXISTS idx_email_delivery_log_time ON email_delivery_log (attempted_at);
+"""
+
+# Message states: pending -> sending -> sent
+#                                    \-> pending (4xx / no reply, retried) ... -> dead
+#                                    \-> bounced (5xx, never retried)
+PENDING, SENDING, SENT, DEAD, BOUNCED = 'pending', 'sending', 'sent', 'dead', 'bounced'
+
+log = logs.get_logger('outbox')
+
+
+class Outbox:
+    """Durable email queue drained by background sender threads.
+
+    Messages are written to a local SQLite file so they survive a restart.
+    ``sender(to_email, subject, body, is_html, text_body)`` must raise on failure.
+    Every attempt is recorded in ``email_delivery_log`` with its latency and
+    the SMTP reply code that ``reply_code(error)`` extracts. A failure
+    ``retryable(error)`` rejects, by default a 5xx refusing the recipient,
+    sender or data, is permanent and the message is marked ``bounced``;
+    anything else, including connection errors and 5xx relay authentication
+    failures, is retried with jittered exponential backoff and moved to
+    ``dead`` after ``max_attempts``. Each worker leases up to ``claim_batch`` due messages
+    per transaction.
+
+    With a ``scheduler`` (a DomainScheduler) the workers only lease
+    messages and hand them over; the scheduler sends them per recipient
+    domain. Messages for a domain it refuses (paused or backlogged) go back
+    to the queue until the domain is ready again.
+    """
+
+    def __init__(self, path, sender, workers=2, max_attempts=5, backoff_base=30,
+                 backoff_max=3600, lease=300, poll_interval=5, reply_code=default_reply_code,
+                 jitter=0.5, claim_batch=10, log_retention=7 * 86400, scheduler=None, retryable=None):
+        self.path = path
+        self.sender = sender
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.lease = lease
+        self.poll_interval = poll_interval
+        self.reply_code = reply_code
+        self.retryable = retryable or (lambda error: is_relay_failure_code(self.reply_code(error)))
+        self.jitter = jitter
+        self.claim_batch = claim_batch
+        self.log_retention = log_retention
+        self.scheduler = scheduler
+        self._next_prune = 0.0
+
+        self._local = threading.local()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._threads = []
+        self._start_lock = threading.Lock()
+        self._schema_lock = threading.Lock()
+        self._schema_ready = False
+
+    # ---------------- Storage ----------------
+    def _db(self):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            db.row_factory = sqlite3.Row
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            self._local.db = db
+            if not self._schema_ready:
+                # Created on first use rather than in __init__ so importing the app stays cheap
+                with self._schema_lock:
+                    if not self._schema_ready:
+                        self._create_schema(db)
+                        self._schema_ready = True
+        return db
+
+    @staticmethod
+    def _create_schema(db):
+        db.executescript(SCHEMA)
+        columns = {row['name'] for row in db.execute('PRAGMA table_info(email_outbox)')}
+        if 'text_body' not in columns:
+            db.execute('ALTER TABLE email_outbox ADD COLUMN text_body TEXT')
+
+    @contextmanager
+    def _transaction(self):
+        db = self._db()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            yield db
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        else:
+            db.execute('COMMIT')
+
+    def enqueue(self, to_email, subject, body, is_html=False, text_body=None):
+        """Persist a message for delivery and wake a sender thread"""
+        now = time.time()
+        with self._transaction() as db:
+            cur = db.execute(
+                "INSERT INTO email_outbox (to_email, subject, body, text_body, is_html, next_attempt_at, created_at, updated_at) "
+                "VALUES (?,?,?,?,?,?,?,?)",
+                (to_email, subject, body, text_body, int(is_html), now, now, now))
+            message_id = cur.lastrowid
+        self.start()
+        self._wakeup.set()
+        return message_id
+
+    def _claim(self, limit):
+        """Lease up to ``limit`` due messages, including ones abandoned by a crashed worker.
+
+        Both lookups are range scans on (status, time) indexes, so the cost
+        depends on the number of due rows, not the size of the table.
+        """
+        now = time.time()
+        with self._transaction() as db:
+            rows = db.execute(
+                "SELECT * FROM email_outbox WHERE status=? AND next_attempt_at<=? ORDER BY next_attempt_at LIMIT ?",
+                (PENDING, now, limit)).fetchall()
+            if len(rows) < limit:
+                rows += db.execute(
+                    "SELECT * FROM email_outbox WHERE status=? AND locked_until<? LIMIT ?",
+                    (SENDING, now, limit - len(rows))).fetchall()
+            if rows:
+                ids = [row['id'] for row in rows]
+                db.execute(
+                    f"UPDATE email_outbox SET status=?, locked_until=?, attempts=attempts+1, updated_at=? "
+                    f"WHERE id IN ({','.join('?' * len(ids))})",
+                    [SENDING, now + self.lease, now] + ids)
+        return rows
+
+    def _record(self, row, started, latency, error=None):
+        """Log one delivery attempt and move the message to its next state; returns that state"""
+        attempt = row['attempts'] + 1
+        now = time.time()
+        code = None
+        if error is None:
+            status, next_attempt = SENT, now
+        else:
+            code = self.reply_code(error)
+            if not self.retryable(error):
+                status, next_attempt = BOUNCED, now
+            elif attempt >= self.max_attempts:
+                status, next_attempt = DEAD, now
+            else:
+                status, next_attempt = PENDING, now + self._backoff(attempt)
+        with self._transaction() as db:
+            db.execute(
+                "INSERT INTO email_delivery_log (message_id, to_email, attempt, attempted_at, latency_ms, smtp_code, outcome, error) "
+                "VALUES (?,?,?,?,?,?,?,?)",
+                (row['id'], row['to_email'], attempt, started, round(latency * 1000, 3),
+                 250 if error is None else code, 'retry' if status == PENDING else status,
+                 None if error is None else str(error)[:1000]))
+            if status == SENT:
+                # The body carries generated credentials, so drop it once delivered
+                db.execute(
+                    "UPDATE email_outbox SET status=?, body='', text_body=NULL, locked_until=NULL, last_error=NULL, updated_at=? WHERE id=?",
+                    (SENT, now, row['id']))
+            else:
+                db.execute(
+                    "UPDATE email_outbox SET status=?, next_attempt_at=?, locked_until=NULL, last_error=?, updated_at=? "
+                    "WHERE id=?",
+                    (status, next_attempt, str(error)[:1000], now, row['id']))
+        return status
+
+    def _release(self, rows):
+        """Return leased but unattempted messages to the queue"""
+        ids = [row['id'] for row in rows]
+        with self._transaction() as db:
+            db.execute(
+                f"UPDATE email_outbox SET status=?, locked_until=NULL, attempts=attempts-1 "
+                f"WHERE id IN ({','.join('?' * len(ids))})",
+                [PENDING] + ids)
+
+    def _defer(self, row, delay):
+        """Return a leased, unattempted message to the queue for ``delay`` seconds"""
+        now = time.time()
+        with self._transaction() as db:
+            db.execute(
+                "UPDATE email_outbox SET status=?, locked_until=NULL, attempts=attempts-1, next_attempt_at=?, updated_at=? "
+                "WHERE id=?",
+                (PENDING, now + delay, now, row['id']))
+
+    def _backoff(self, attempt):
+        """Exponential delay before retry ``attempt + 1``, less up to ``jitter`` of it at random"""
+        delay = min(self.backoff_base * (2 ** (attempt - 1)), self.backoff_max)
+        return delay * (1 - self.jitter * random.random())
+
+    # ---------------- Workers ----------------
+    def _attempt(self, row):
+        """Send one leased message and record the outcome; returns the error or None"""
+        started = time.time()
+        clock = time.perf_counter()
+        with logs.context(email=row['to_email'], message_id=row['id'], attempt=row['attempts'] + 1):
+            try:
+                self.sender(row['to_email'], row['subject'], row['body'], bool(row['is_html']), row['text_body'])
+            except Exception as e:
+                latency = time.perf_counter() - clock
+                status = self._record(row, started, latency, e)
+                log.warning('email_failed', status=status, smtp_code=self.reply_code(e), error=str(e),
+                            duration_ms=round(latency * 1000, 3))
+                return e
+            latency = time.perf_counter() - clock
+            self._record(row, started, latency)
+            log.info('email_sent', smtp_code=250, duration_ms=round(latency * 1000, 3))
+        return None
+
+    def _scheduled_attempt(self, row):
+        try:
+            return self._attempt(row)
+        finally:
+            self._wakeup.set()      # room in the scheduler backlog: claim more
+
+    def process_due(self):
+        """Claim and send (or hand to the scheduler) a batch of due messages.
+
+        Returns how many were attempted or accepted by the scheduler.
+        """
+        if self.scheduler is None:
+            rows = self._claim(self.claim_batch)
+            for index, row in enumerate(rows):
+                if self._stopping.is_set():
+                    self._release(rows[index:])
+                    return index
+                self._attempt(row)
+            return len(rows)
+        accepted = 0
+        for row in self._claim(min(self.claim_batch, self.scheduler.room())):
+            delay = self.scheduler.submit(row['to_email'], partial(self._scheduled_attempt, row),
+                                          defer=partial(self._defer, row))
+            if delay is None:
+                accepted += 1
+            else:
+                self._defer(row, delay)
+        return accepted
+
+    def prune(self, older_than):
+        """Delete delivery log entries and finished messages older than ``older_than`` seconds"""
+        cutoff = time.time() - older_than
+        with self._transaction() as db:
+            db.execute("DELETE FROM email_delivery_log WHERE attempted_at<?", (cutoff,))
+            db.execute("DELETE FROM email_outbox WHERE status IN (?,?,?) AND updated_at<?",
+                       (SENT, DEAD, BOUNCED, cutoff))
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                if self.process_due():
+                    continue
+                if self.log_retention and time.monotonic() >= self._next_prune:
+                    self._next_prune = time.monotonic() + 3600
+                    self.prune(self.log_retention)
+            except sqlite3.Error as e:
+                log.error('outbox_error', error=str(e))
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
+
+    def start(self):
+        """Start the sender threads (idempotent)"""
+        if self._threads:
+            return
+        with self._start_lock:
+            if self._threads:
+                return
+            self._stopping.clear()
+            for i in range(self.workers):
+                t = threading.Thread(target=self._run, name=f'outbox-sender-{i}', daemon=True)
+                t.start()
+                self._threads.append(t)
+
+    def stop(self, timeout=10):
+        """Ask sender threads to finish their current message and exit"""
+        self._stopping.set()
+        self._wakeup.set()
+        deadline = time.monotonic() + timeout
+        for t in self._threads:
+            t.join(max(0, deadline - time.monotonic()))
+        self._threads = []
+        if self.scheduler is not None:
+            unsent = self.scheduler.stop(max(0, deadline - time.monotonic()))
+            if unsent:
+                self._release([job.args[0] for job in unsent])
+
+    def stats(self):
+        rows = self._db().execute("SELECT status, COUNT(*) FROM email_outbox GROUP BY status").fetchall()
+        counts = {PENDING: 0, SENDING: 0, SENT: 0, DEAD: 0, BOUNCED: 0}
+        counts.update({status: n for status, n in rows})
+        return counts
+
+    def deliveries(self, message_id):
+        """Delivery attempts for one message, oldest first"""
+        rows = self._db().execute(
+            "SELECT attempt, attempted_at, latency_ms, smtp_code, outcome, error FROM email_delivery_log "
+            "WHERE message_id=? ORDER BY attempt", (message_id,)).fetchall()
+        return [dict(row) for row in rows]
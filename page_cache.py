@@ -0,0 +1,97 @@
+import gzip
+import hashlib
+import mimetypes
+import os
+import threading
+
+from flask import Response, abort, request
+
+try:
+    import brotli
+except ImportError:  # optional: gzip is always available
+    brotli = None
+
+ASSET_MAX_AGE = 365 * 24 * 3600
+
+
+class PrecompressedBody:
+    """A response body kept in identity, gzip and (if available) brotli form"""
+
+    def __init__(self, body, mimetype):
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        self.mimetype = mimetype
+        self.etag = hashlib.sha256(body).hexdigest()[:16]
+        self.encodings = {'identity': body, 'gzip': gzip.compress(body, 9, mtime=0)}
+        if brotli is not None:
+            self.encodings['br'] = brotli.compress(body, quality=11)
+
+    def _pick_encoding(self):
+        accepted = request.accept_encodings
+        for encoding in ('br', 'gzip'):
+            if encoding in self.encodings and accepted[encoding]:
+                return encoding
+        return 'identity'
+
+    def response(self, cache_control):
+        """Build a response for the current request, answering 304 when the ETag matches"""
+        if request.if_none_match.contains(self.etag):
+            resp = Response(status=304)
+        else:
+            encoding = self._pick_encoding()
+            resp = Response(self.encodings[encoding], mimetype=self.mimetype)
+            if encoding != 'identity':
+                resp.headers['Content-Encoding'] = encoding
+        resp.set_etag(self.etag)
+        resp.headers['Cache-Control'] = cache_control
+        resp.headers['Vary'] = 'Accept-Encoding'
+        return resp
+
+
+class AssetManifest:
+    """Fingerprinted static assets served with far-future cache headers.
+
+    Each file under ``static_dir`` is published as ``name.<hash>.ext``, so a
+    changed file gets a new URL and clients can cache every URL forever.
+    """
+
+    def __init__(self, static_dir):
+        self.static_dir = static_dir
+        self._manifest = None    # built (hashed and compressed) on first use
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._manifest is None:
+            with self._lock:
+                if self._manifest is None:
+                    self._manifest = self._build()
+        return self._manifest
+
+    def _build(self):
+        urls = {}       # 'css/app.css' -> 'css/app.1a2b3c4d5e.css'
+        bodies = {}     # fingerprinted name -> PrecompressedBody
+        for root, _, files in os.walk(self.static_dir):
+            for name in files:
+                path = os.path.join(root, name)
+                logical = os.path.relpath(path, self.static_dir).replace(os.sep, '/')
+                with open(path, 'rb') as f:
+                    data = f.read()
+                stem, ext = os.path.splitext(logical)
+                fingerprinted = f"{stem}.{hashlib.sha256(data).hexdigest()[:10]}{ext}"
+                mimetype = mimetypes.guess_type(logical)[0] or 'application/octet-stream'
+                urls[logical] = fingerprinted
+                bodies[fingerprinted] = PrecompressedBody(data, mimetype)
+        return urls, bodies
+
+    @property
+    def urls(self):
+        return self._load()[0]
+
+    def fingerprinted(self, logical):
+        return self.urls[logical]
+
+    def response(self, fingerprinted):
+        body = self._load()[1].get(fingerprinted)
+        if body is None:
+            abort(404)
+        return body.response(f'public, max-age={ASSET_MAX_AGE}, immutable')
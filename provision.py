@@ -0,0 +1,152 @@
+"""Bulk user provisioning.
+
+Streams a file of email addresses (one per line, or a CSV whose first
+column is the email), creates an account for each new address and mails
+the credentials, the same way /register does but in batches:
+
+    python provision.py users.csv --batch-size 500 --smtp-sessions 4
+
+Progress is checkpointed after every batch to ``<input>.progress``; rerunning
+the same command resumes after the last completed batch.
+"""
+import argparse
+import csv
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import app
+
+
+def read_emails(path, start_line=0):
+    """Yield ``(line_number, email)`` pairs, skipping the first ``start_line`` lines"""
+    with open(path, newline='', encoding='utf-8') as f:
+        for line_number, row in enumerate(csv.reader(f), 1):
+            if line_number <= start_line or not row:
+                continue
+            yield line_number, row[0].strip().lower()
+
+
+def batches(rows, size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def load_checkpoint(path):
+    try:
+        with open(path) as f:
+            return int(f.read().strip() or 0)
+    except FileNotFoundError:
+        return 0
+
+
+def save_checkpoint(path, line_number):
+    tmp = f"{path}.tmp"
+    with open(tmp, 'w') as f:
+        f.write(str(line_number))
+    os.replace(tmp, path)
+
+
+def mail_credentials(users):
+    """Mail credentials to ``users`` over one SMTP session; returns the number delivered"""
+    subject = 'Welcome to SecureAuth - Your Account Credentials'
+    rendered = {}
+    for user_id, email, _, password in users:
+        rendered[email] = app.email_templates.render('welcome.html', user_id=user_id, password=password)
+    results = app.send_batch((email, subject, html, text) for email, (html, text) in rendered.items())
+    delivered = 0
+    for email, (html, text) in rendered.items():
+        if results.get(email) is True:
+            delivered += 1
+        else:
+            # Leave it for the outbox senders to retry
+            app.queue_email(email, subject, html, is_html=True, text_body=text)
+    return delivered
+
+
+def provision(path, batch_size=500, smtp_sessions=2, send_mail=True, checkpoint=None):
+    checkpoint = checkpoint or f"{path}.progress"
+    start_line = load_checkpoint(checkpoint)
+    if start_line:
+        print(f"Resuming after line {start_line}")
+
+    totals = {'read': 0, 'invalid': 0, 'existing': 0, 'created': 0, 'emailed': 0, 'email_queued': 0}
+    started = time.perf_counter()
+    sender = ThreadPoolExecutor(max_workers=smtp_sessions) if send_mail else None
+    try:
+        for batch in batches(read_emails(path, start_line), batch_size):
+            last_line = batch[-1][0]
+            totals['read'] += len(batch)
+
+            emails = []
+            seen = set()
+            for _, email, reason in app.email_validator.check_many(email for _, email in batch):
+                if reason:
+                    totals['invalid'] += 1
+                elif email in seen:
+                    totals['existing'] += 1
+                else:
+                    seen.add(email)
+                    emails.append(email)
+            if emails:
+                existing = app.user_store.existing_emails(emails)
+                totals['existing'] += len(existing)
+                emails = [email for email in emails if email not in existing]
+
+            if emails:
+                credentials = [app.generate_credentials() for _ in emails]
+                hashes = app.hash_pool.hash_many([password for _, password in credentials])
+                users = [(user_id, email, password_hash, password)
+                         for (user_id, password), email, password_hash in zip(credentials, emails, hashes)]
+                stored = app.user_store.insert_users(users)
+                totals['existing'] += len(users) - len(stored)
+                totals['created'] += len(stored)
+
+                if sender and stored:
+                    chunks = [stored[i::smtp_sessions] for i in range(smtp_sessions)]
+                    for chunk, delivered in zip(chunks, sender.map(mail_credentials, chunks)):
+                        totals['emailed'] += delivered
+                        totals['email_queued'] += len(chunk) - delivered
+
+            save_checkpoint(checkpoint, last_line)
+            elapsed = time.perf_counter() - started
+            print(f"line {last_line}: {totals['created']} created, {totals['read'] / elapsed:.0f} rows/s")
+    except app.StorageError as err:
+        print(f"Database error: {err}")
+        sys.exit(1)
+    finally:
+        if sender:
+            sender.shutdown()
+        app.smtp_sender.close()
+        app.hash_pool.shutdown()
+        app.user_store.close()
+
+    elapsed = time.perf_counter() - started
+    print(f"Done in {elapsed:.1f}s ({totals['read'] / elapsed if elapsed else 0:.0f} rows/s)")
+    for key, value in totals.items():
+        print(f"  {key:<13}{value}")
+    return totals
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Create SecureAuth accounts in bulk from a file of emails.')
+    parser.add_argument('input', help='file with one email per line (or CSV with email first)')
+    parser.add_argument('--batch-size', type=int, default=500, help='rows per INSERT batch (default 500)')
+    parser.add_argument('--smtp-sessions', type=int, default=2, help='concurrent SMTP sessions (default 2)')
+    parser.add_argument('--no-email', action='store_true', help='create accounts without mailing credentials')
+    parser.add_argument('--checkpoint', help='progress file (default <input>.progress)')
+    args = parser.parse_args(argv)
+
+    provision(args.input, batch_size=args.batch_size, smtp_sessions=args.smtp_sessions,
+              send_mail=not args.no_email, checkpoint=args.checkpoint)
+
+
+if __name__ == '__main__':
+    main()
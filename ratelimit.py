@@ -0,0 +1,129 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class RateLimitExceeded(Exception):
+    """A rate limit was hit; retry after ``retry_after`` seconds"""
+
+    def __init__(self, rule, retry_after):
+        super().__init__(f'{rule}: retry after {retry_after:.0f}s')
+        self.rule = rule
+        self.retry_after = retry_after
+
+
+class MemoryBucketStore:
+    """In-process token buckets.
+
+    Each key holds ``[tokens, updated_at]``. A bucket that has been idle long
+    enough to refill completely carries no information, so it is dropped on
+    the next sweep; ``max_keys`` bounds memory under a flood of distinct keys
+    by evicting the least recently used buckets. Pass ``max_keys=None`` for
+    a small fixed key set that must never be evicted, since an evicted bucket
+    comes back full.
+    """
+
+    def __init__(self, max_keys=100000, sweep_interval=60):
+        self.max_keys = max_keys
+        self.sweep_interval = sweep_interval
+        self._buckets = OrderedDict()      # key -> [tokens, updated_at, full_after]
+        self._lock = threading.Lock()
+        self._next_sweep = time.monotonic() + sweep_interval
+
+    def consume(self, key, capacity, rate, cost=1):
+        """Take ``cost`` tokens; returns ``(allowed, retry_after_seconds)``"""
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                tokens = capacity
+            else:
+                tokens = min(capacity, bucket[0] + (now - bucket[1]) * rate)
+                self._buckets.move_to_end(key)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            full_after = now + (capacity - tokens) / rate
+            if bucket is None:
+                self._buckets[key] = [tokens, now, full_after]
+                if self.max_keys is not None and len(self._buckets) > self.max_keys:
+                    self._buckets.popitem(last=False)
+            else:
+                bucket[0], bucket[1], bucket[2] = tokens, now, full_after
+            if now >= self._next_sweep:
+                self._sweep(now)
+        return allowed, 0 if allowed else (cost - tokens) / rate
+
+    def _sweep(self, now):
+        self._next_sweep = now + self.sweep_interval
+        expired = [key for key, bucket in self._buckets.items() if bucket[2] <= now]
+        for key in expired:
+            del self._buckets[key]
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+# Atomically refill and take tokens; returns {allowed, retry_after_ms}
+_REDIS_TOKEN_BUCKET = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local now = tonumber(ARGV[4])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1]) or capacity
+local ts = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + (now - ts) * rate)
+local allowed = 0
+if tokens >= cost then
+  tokens = tokens - cost
+  allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil((capacity - tokens) / rate * 1000) + 1000)
+if allowed == 1 then return {1, 0} end
+return {0, math.ceil((cost - tokens) / rate * 1000)}
+"""
+
+
+class RedisBucketStore:
+    """Token buckets in Redis, shared by every worker process.
+
+    Buckets expire on their own once they would be full again.
+    """
+
+    def __init__(self, url, prefix='ratelimit:'):
+        try:
+            import redis
+        except ImportError:  # optional: only needed for the shared backend
+            raise RuntimeError('RedisBucketStore requires the redis package (pip install redis)')
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+        self._script = self.client.register_script(_REDIS_TOKEN_BUCKET)
+
+    def consume(self, key, capacity, rate, cost=1):
+        allowed, retry_ms = self._script(keys=[self.prefix + key], args=[capacity, rate, cost, time.time()])
+        return bool(allowed), retry_ms / 1000
+
+
+class RateLimiter:
+    """Named token-bucket rules checked against a bucket store.
+
+    ``rules`` maps a rule name to ``(capacity, per_seconds)``: at most
+    ``capacity`` hits in a burst, refilled at ``capacity / per_seconds`` per second.
+    """
+
+    def __init__(self, store, rules):
+        self.store = store
+        self.rules = {name: (capacity, capacity / per_seconds) for name, (capacity, per_seconds) in rules.items()}
+
+    def hit(self, rule, key):
+        """Consume one token for ``key`` under ``rule``; returns ``(allowed, retry_after)``"""
+        capacity, rate = self.rules[rule]
+        return self.store.consume(f'{rule}:{key}', capacity, rate)
+
+
+def normalize_email_key(email):
+    """Lower-case and drop any +tag so address variants share one bucket"""
+    local, _, domain = email.strip().lower().rpartition('@')
+    return f"{local.split('+', 1)[0]}@{domain}"
@@ -0,0 +1,264 @@
+import random
+import threading
+import time
+from collections import deque
+
+import logs
+import metrics
+
+log = logs.get_logger('relays')
+
+# 5xx replies that are about the relay account rather than the message
+RELAY_AUTH_CODES = {530, 534, 535, 538}
+
+
+class NoRelayAvailable(Exception):
+    """Every relay is circuit-broken or at its rate ceiling; the message should be retried later"""
+
+
+def default_reply_code(error):
+    """The SMTP reply code carried by ``error``, or None"""
+    code = getattr(error, 'smtp_code', None)
+    return code if isinstance(code, int) else None
+
+
+def is_relay_failure_code(code):
+    """True unless ``code`` is a 5xx about the message itself (recipient, sender or data refused)"""
+    return code is None or not 500 <= code < 600 or code in RELAY_AUTH_CODES
+
+
+class CircuitBreaker:
+    """Stops traffic to a relay after ``threshold`` consecutive failures.
+
+    After ``cooldown`` seconds one trial message is let through (half-open);
+    its success closes the circuit, its failure reopens it.
+    """
+
+    def __init__(self, threshold=5, cooldown=60):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self._failures = 0
+        self._opened_at = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._opened_at is None:
+                return 'closed'
+            return 'half_open' if time.monotonic() - self._opened_at >= self.cooldown else 'open'
+
+    def allow(self):
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if self._trial or time.monotonic() - self._opened_at < self.cooldown:
+                return False
+            self._trial = True
+            return True
+
+    def release(self):
+        """Hand back a half-open trial that allow() granted but that was never sent"""
+        with self._lock:
+            self._trial = False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial or self._failures >= self.threshold:
+                self._opened_at = time.monotonic()
+            self._trial = False
+
+
+class Relay:
+    """One SMTP endpoint: its sender, routing weight, rate ceiling and breaker"""
+
+    def __init__(self, name, sender, weight=1, rate_limit=None, breaker=None):
+        self.name = name
+        self.sender = sender
+        self.weight = weight
+        self.rate_limit = rate_limit        # (burst, per_seconds) or None
+        self.breaker = breaker or CircuitBreaker()
+
+
+class RelayRouter:
+    """Spreads outgoing mail over several relays by weight.
+
+    Each message goes to a relay chosen at random in proportion to its
+    weight among those whose circuit is closed and which are under their
+    ``rate_limit`` ceiling (token buckets in ``store``, shared between
+    workers when it is a RedisBucketStore). If the relay fails, the message
+    is offered to the remaining relays in turn; only when all of them fail
+    is the error raised, so the outbox keeps the message for a later retry.
+    Rejections of the message itself (5xx recipient/sender/data replies) are
+    raised at once.
+    """
+
+    def __init__(self, relays, store, reply_code=default_reply_code):
+        if not relays:
+            raise ValueError('RelayRouter needs at least one relay')
+        self.relays = list(relays)
+        self.store = store
+        self.reply_code = reply_code
+
+    def is_relay_failure(self, error):
+        """True if ``error`` means the relay, not the message, is the problem"""
+        return is_relay_failure_code(self.reply_code(error))
+
+    def _admit(self, relay):
+        if not relay.breaker.allow():
+            return False
+        if relay.rate_limit:
+            burst, per_seconds = relay.rate_limit
+            allowed, _ = self.store.consume(f'relay:{relay.name}', burst, burst / per_seconds)
+            if not allowed:
+                relay.breaker.release()     # else a throttled trial would keep the circuit half-open forever
+                metrics.smtp_relay_sends.inc(relay.name, 'throttled')
+                return False
+        return True
+
+    def _candidates(self, exclude=()):
+        """Relays in weighted random order (weighted sampling without replacement)"""
+        keyed = [(random.random() ** (1 / relay.weight), relay) for relay in self.relays
+                 if relay.weight > 0 and relay.name not in exclude]
+        return [relay for _, relay in sorted(keyed, key=lambda item: item[0], reverse=True)]
+
+    def _record(self, relay, error=None):
+        if error is None:
+            relay.breaker.record_success()
+            metrics.smtp_relay_sends.inc(relay.name, 'success')
+        elif self.is_relay_failure(error):
+            relay.breaker.record_failure()
+            metrics.smtp_relay_sends.inc(relay.name, 'relay_failure')
+        else:
+            relay.breaker.record_success()      # the relay answered properly
+            metrics.smtp_relay_sends.inc(relay.name, 'rejected')
+
+    def send_message(self, msg):
+        last_error = None
+        for relay in self._candidates():
+            if not self._admit(relay):
+                continue
+            try:
+                result = relay.sender.send_message(msg)
+            except Exception as e:
+                self._record(relay, e)
+                if not self.is_relay_failure(e):
+                    raise
+                log.warning('relay_failed', relay=relay.name, smtp_code=self.reply_code(e), error=str(e))
+                last_error = e
+                continue
+            self._record(relay)
+            return result
+        if last_error is not None:
+            raise last_error
+        raise NoRelayAvailable('No SMTP relay is available')
+
+    def send_batch(self, messages):
+        """Send ``messages`` and return ``{recipient: True | exception}``.
+
+        Consecutive messages go to one relay over a single session (through
+        the relay's own ``send_batch`` when it has one) until it reaches its
+        rate ceiling; messages that fail on a relay are offered to the others.
+        """
+        results = {}
+        messages = iter(messages)
+        tried = {}                  # id(msg) -> names of relays that failed it
+        pending = []                # messages to place before drawing new ones
+        while True:
+            if not pending:
+                msg = next(messages, None)
+                if msg is None:
+                    return results
+                pending.append(msg)
+            exclude = tried.get(id(pending[0]), ())
+            relay = next((relay for relay in self._candidates(exclude) if self._admit(relay)), None)
+            if relay is None:
+                for msg in pending:
+                    results[msg['To']] = NoRelayAvailable('No SMTP relay is available')
+                pending = []
+                continue
+            eligible = [msg for msg in pending if relay.name not in tried.get(id(msg), ())]
+            skipped = [msg for msg in pending if relay.name in tried.get(id(msg), ())]
+            sent, leftover = self._relay_run(relay, eligible, messages)
+            pending = skipped
+            for msg, result in sent:
+                self._record(relay, None if result is True else result)
+                if result is True or not self.is_relay_failure(result):
+                    results[msg['To']] = result
+                    continue
+                failed_on = tried.setdefault(id(msg), set())
+                failed_on.add(relay.name)
+                if len(failed_on) < len(self.relays):
+                    pending.append(msg)
+                else:
+                    results[msg['To']] = result
+            pending += leftover
+
+    def _relay_run(self, relay, pending, messages):
+        """Send ``pending``, then further ``messages``, over ``relay`` while it has capacity.
+
+        The caller has admitted the first message. Returns
+        ``([(msg, True | exception)], leftover)`` where ``leftover`` holds
+        messages that were not sent because the relay ran out of capacity
+        or became unreachable.
+        """
+        sent = []
+        queue = deque(pending)
+        leftover = []
+
+        def run():
+            first = True
+            while queue:
+                if not first and not self._admit(relay):
+                    return
+                first = False
+                msg = queue.popleft()
+                sent.append(msg)
+                yield msg
+            for msg in messages:
+                if not self._admit(relay):
+                    leftover.append(msg)
+                    return
+                sent.append(msg)
+                yield msg
+
+        send_batch = getattr(relay.sender, 'send_batch', None)
+        if send_batch is not None:
+            outcome = send_batch(run())
+        else:
+            outcome = {}
+            for msg in run():
+                try:
+                    relay.sender.send_message(msg)
+                    outcome[msg['To']] = True
+                except Exception as e:
+                    outcome[msg['To']] = e
+                    if self.is_relay_failure(e):
+                        break
+        return [(msg, outcome.get(msg['To'], NoRelayAvailable('Not sent'))) for msg in sent], list(queue) + leftover
+
+    def stats(self):
+        """Per-relay sender stats plus circuit state, and pool totals"""
+        per_relay = {}
+        totals = {'in_use': 0, 'idle': 0}
+        for relay in self.relays:
+            stats = dict(relay.sender.stats())
+            stats['circuit'] = relay.breaker.state
+            stats['weight'] = relay.weight
+            per_relay[relay.name] = stats
+            for key in totals:
+                totals[key] += stats.get(key, 0)
+        totals['relays'] = per_relay
+        return totals
+
+    def close(self):
+        for relay in self.relays:
+            relay.sender.close()
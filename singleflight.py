@@ -0,0 +1,80 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class _Call:
+    __slots__ = ('done', 'result', 'error', 'finished_at')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.finished_at = None
+
+
+class SingleFlight:
+    """Coalesces calls by key: one runs, concurrent and repeat callers share its result.
+
+    ``do(key, fn)`` runs ``fn()`` unless a call for ``key`` is in flight or
+    finished less than ``window`` seconds ago, in which case it waits for or
+    returns that call's result. A call that raises is not remembered:
+    callers already waiting get the same exception, later ones run afresh.
+    At most ``max_entries`` finished results are kept. Coalescing is per
+    process.
+    """
+
+    def __init__(self, window=10, max_entries=10000):
+        self.window = window
+        self.max_entries = max_entries
+        self._calls = OrderedDict()     # key -> _Call, oldest first
+        self._lock = threading.Lock()
+        self._stats = {'calls': 0, 'shared': 0}
+
+    def _evict(self, now):
+        while self._calls:
+            call = next(iter(self._calls.values()))
+            expired = call.finished_at is not None and now - call.finished_at >= self.window
+            if not expired and len(self._calls) <= self.max_entries:
+                return
+            if call.finished_at is None:
+                return      # never drop a call that is still running
+            self._calls.popitem(last=False)
+
+    def do(self, key, fn):
+        """Return ``(result, shared)``; ``shared`` is True if another caller's result was reused"""
+        now = time.monotonic()
+        with self._lock:
+            self._evict(now)
+            call = self._calls.get(key)
+            if call is not None and (call.finished_at is None or now - call.finished_at < self.window):
+                self._stats['shared'] += 1
+                leader = False
+            else:
+                call = self._calls[key] = _Call()
+                self._calls.move_to_end(key)
+                self._stats['calls'] += 1
+                leader = True
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            with self._lock:
+                if self._calls.get(key) is call:
+                    del self._calls[key]
+            raise
+        finally:
+            call.finished_at = time.monotonic()
+            call.done.set()
+        return call.result, False
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._calls)
+        return stats
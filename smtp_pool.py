@@ -0,0 +1,265 @@
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import metrics
+
+
+class SMTPPool:
+    """Thread-safe pool of authenticated SMTP sessions.
+
+    smtplib (and the email package it pulls in) is imported on first use,
+    so building a pool at app import time does not load it.
+
+    Sessions are opened lazily (connect, STARTTLS, login) and handed back to
+    the pool after each send, so consecutive messages skip the handshake.
+    At most ``size`` sessions exist at once; callers block until one is free.
+    A session that has carried ``max_messages_per_session`` messages is closed
+    on release, to stay under relays' per-connection limits.
+    """
+
+    def __init__(self, host, port, user=None, password=None, size=4,
+                 idle_timeout=60, health_check_after=5, use_tls=True, timeout=30,
+                 max_messages_per_session=None):
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.health_check_after = health_check_after
+        self.use_tls = use_tls
+        self.timeout = timeout
+        self.max_messages_per_session = max_messages_per_session
+
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(size)
+        self._idle = deque()          # (smtp, last_used) pairs, most recent on the right
+        self._in_use = 0
+        self._session_messages = {}   # id(smtp) -> messages sent on that session
+        self._closed = False
+        self._stats = {
+            'opened': 0,
+            'reused': 0,
+            'discarded': 0,
+            'expired': 0,
+            'health_check_failures': 0,
+            'reconnects': 0,
+            'retired': 0,
+            'messages_sent': 0,
+        }
+
+    # ---------------- Session lifecycle ----------------
+    def _connect(self):
+        import smtplib
+        with metrics.timed('smtp_connect'):
+            smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            if self.use_tls:
+                with metrics.timed('smtp_starttls'):
+                    smtp.starttls()
+            if self.user:
+                with metrics.timed('smtp_login'):
+                    smtp.login(self.user, self.password)
+        except Exception:
+            self._quietly_close(smtp)
+            raise
+        with self._lock:
+            self._stats['opened'] += 1
+        return smtp
+
+    @staticmethod
+    def _quietly_close(smtp):
+        try:
+            smtp.quit()
+        except Exception:
+            try:
+                smtp.close()
+            except Exception:
+                pass
+
+    def _close(self, smtp):
+        with self._lock:
+            self._session_messages.pop(id(smtp), None)
+        self._quietly_close(smtp)
+
+    def _count_message(self, smtp):
+        """Record a delivered message and return how many this session has carried"""
+        with self._lock:
+            count = self._session_messages.get(id(smtp), 0) + 1
+            self._session_messages[id(smtp)] = count
+            self._stats['messages_sent'] += 1
+        return count
+
+    def _is_alive(self, smtp):
+        try:
+            return smtp.noop()[0] == 250
+        except Exception:
+            return False
+
+    def acquire(self, timeout=None, fresh=False):
+        """Check a session out of the pool, opening one if none are idle.
+
+        ``fresh`` skips idle sessions and always opens a new one.
+        """
+        if self._closed:
+            raise RuntimeError('SMTP pool is closed')
+        if not self._slots.acquire(timeout=timeout):
+            raise TimeoutError('Timed out waiting for a free SMTP session')
+        try:
+            while not fresh:
+                with self._lock:
+                    if not self._idle:
+                        break
+                    smtp, last_used = self._idle.pop()
+                idle_for = time.monotonic() - last_used
+                if idle_for > self.idle_timeout:
+                    self._close(smtp)
+                    with self._lock:
+                        self._stats['expired'] += 1
+                    continue
+                if idle_for > self.health_check_after and not self._is_alive(smtp):
+                    self._close(smtp)
+                    with self._lock:
+                        self._stats['health_check_failures'] += 1
+                    continue
+                with self._lock:
+                    self._stats['reused'] += 1
+                    self._in_use += 1
+                return smtp
+            smtp = self._connect()
+            with self._lock:
+                self._in_use += 1
+            return smtp
+        except Exception:
+            self._slots.release()
+            raise
+
+    def release(self, smtp, discard=False):
+        """Return a session to the pool, or close it if ``discard`` is set"""
+        with self._lock:
+            self._in_use -= 1
+            retire = (self.max_messages_per_session is not None and
+                      self._session_messages.get(id(smtp), 0) >= self.max_messages_per_session)
+            keep = not discard and not retire and not self._closed
+            if keep:
+                self._idle.append((smtp, time.monotonic()))
+            else:
+                self._stats['retired' if retire and not discard else 'discarded'] += 1
+        if not keep:
+            self._close(smtp)
+        self._slots.release()
+
+    @contextmanager
+    def connection(self, fresh=False):
+        """Context manager yielding a pooled session.
+
+        Any SMTP or socket error discards the session instead of returning it.
+        """
+        import smtplib
+        smtp = self.acquire(fresh=fresh)
+        try:
+            yield smtp
+        except (smtplib.SMTPException, OSError):
+            self.release(smtp, discard=True)
+            raise
+        except BaseException:
+            self.release(smtp)
+            raise
+        else:
+            self.release(smtp)
+
+    # ---------------- Sending ----------------
+    def send_message(self, msg):
+        """Send ``msg`` over a pooled session, reconnecting once if the server hung up"""
+        import smtplib
+        try:
+            with self.connection() as smtp:
+                with metrics.timed('smtp_send'):
+                    smtp.send_message(msg)
+                self._count_message(smtp)
+        except smtplib.SMTPServerDisconnected:
+            with self._lock:
+                self._stats['reconnects'] += 1
+            with self.connection(fresh=True) as smtp:
+                with metrics.timed('smtp_send'):
+                    smtp.send_message(msg)
+                self._count_message(smtp)
+
+    def send_batch(self, messages):
+        """Stream ``messages`` over a single session and return ``{recipient: True | exception}``.
+
+        ``messages`` may be any iterable, including a generator; messages are
+        consumed one at a time. A rejected message does not end the session
+        (smtplib issues RSET after a failed transaction), a dropped connection
+        is reopened and the message retried once, and the session is rotated
+        after ``max_messages_per_session`` messages. If no session can be
+        opened at all the batch stops there, leaving later messages unconsumed
+        and absent from the result.
+        """
+        import smtplib
+        results = {}
+        smtp = None
+        try:
+            for msg in messages:
+                recipient = msg['To']
+                for attempt in (1, 2):
+                    try:
+                        if smtp is None:
+                            smtp = self.acquire(fresh=attempt == 2)
+                    except (smtplib.SMTPException, OSError) as e:
+                        # The relay is unreachable; leave the rest of the batch unconsumed
+                        results[recipient] = e
+                        return results
+                    try:
+                        with metrics.timed('smtp_send'):
+                            smtp.send_message(msg)
+                    except smtplib.SMTPServerDisconnected as e:
+                        self.release(smtp, discard=True)
+                        smtp = None
+                        if attempt == 1:
+                            with self._lock:
+                                self._stats['reconnects'] += 1
+                            continue
+                        results[recipient] = e
+                    except smtplib.SMTPResponseException as e:
+                        # 421: the server is closing the channel
+                        if e.smtp_code == 421:
+                            self.release(smtp, discard=True)
+                            smtp = None
+                        results[recipient] = e
+                    except smtplib.SMTPRecipientsRefused as e:
+                        results[recipient] = e
+                    except (smtplib.SMTPException, OSError) as e:
+                        self.release(smtp, discard=True)
+                        smtp = None
+                        results[recipient] = e
+                    else:
+                        results[recipient] = True
+                        count = self._count_message(smtp)
+                        if self.max_messages_per_session and count >= self.max_messages_per_session:
+                            self.release(smtp)
+                            smtp = None
+                    break
+        finally:
+            if smtp is not None:
+                self.release(smtp)
+        return results
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['idle'] = len(self._idle)
+            stats['in_use'] = self._in_use
+            stats['size'] = self.size
+        return stats
+
+    def close(self):
+        """Close every idle session; sessions in use are closed on release"""
+        with self._lock:
+            self._closed = True
+            idle = [smtp for smtp, _ in self._idle]
+            self._idle.clear()
+        for smtp in idle:
+            self._close(smtp)
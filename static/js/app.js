@@ -0,0 +1,57 @@
+function switchTab(tab) {
+  const registerTab = document.getElementById('register-tab');
+  const forgotTab = document.getElementById('forgot-tab');
+  const registerForm = document.getElementById('register-form');
+  const forgotForm = document.getElementById('forgot-form');
+
+  if (tab === 'register') {
+    registerTab.classList.add('active');
+    forgotTab.classList.remove('active');
+    registerForm.style.display = 'block';
+    forgotForm.style.display = 'none';
+  } else {
+    registerTab.classList.remove('active');
+    forgotTab.classList.add('active');
+    registerForm.style.display = 'none';
+    forgotForm.style.display = 'block';
+  }
+}
+
+// Email validation
+document.getElementById('regEmail').addEventListener('input', function() {
+  validateEmail(this, 'email-validation');
+});
+
+document.getElementById('forgotEmail').addEventListener('input', function() {
+  validateEmail(this, 'forgot-email-validation');
+});
+
+function validateEmail(input, validationId) {
+  const validation = document.getElementById(validationId);
+  const email = input.value;
+  const emailRegex = /^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$/;
+
+  if (email === '') {
+    validation.innerHTML = '<i class="fas fa-info-circle"></i><span>Please enter a valid email address</span>';
+    validation.className = 'email-validation';
+  } else if (emailRegex.test(email)) {
+    validation.innerHTML = '<i class="fas fa-check-circle"></i><span>Valid email address</span>';
+    validation.className = 'email-validation valid-email';
+  } else {
+    validation.innerHTML = '<i class="fas fa-exclamation-circle"></i><span>Invalid email format</span>';
+    validation.className = 'email-validation invalid-email';
+  }
+}
+
+// Form submission with loading state
+document.getElementById('reg-form').addEventListener('submit', function() {
+  document.getElementById('reg-loading').style.display = 'inline-block';
+});
+
+// One key per page load: a double submit replays the first reset instead of starting another
+document.getElementById('forgotIdempotencyKey').value =
+  window.crypto && crypto.randomUUID ? crypto.randomUUID() : Date.now().toString(36) + Math.random().toString(36).slice(2);
+
+document.getElementById('forgot-form-element').addEventListener('submit', function() {
+  document.getElementById('forgot-loading').style.display = 'inline-block';
+});
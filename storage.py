@@ -0,0 +1,466 @@
+"""User storage backends.
+
+The app talks to a ``UserStore``; which database sits behind it is a
+configuration choice:
+
+* ``MySQLUserStore``: a ConnectionPool of MySQL connections, using
+  server-side prepared statements for the per-request queries.
+* ``SQLiteUserStore``: a local SQLite file, for tests and small installs.
+* ``ShardedUserStore``: spreads users over several stores by a hash of
+  the email, for when one ``users`` table is no longer enough.
+
+Every backend raises ``EmailAlreadyRegistered`` / ``DuplicateUserId`` for
+key clashes and ``StorageError`` for anything else, so callers never see
+driver exceptions.
+"""
+import hashlib
+import heapq
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+import metrics
+from credentials import generate_user_id
+
+INSERT_ID_ATTEMPTS = 5      # fresh ids tried for a bulk row whose id is taken
+
+
+class StorageError(Exception):
+    """The database could not be reached or rejected a statement"""
+
+
+class EmailAlreadyRegistered(Exception):
+    pass
+
+
+class DuplicateUserId(Exception):
+    """The generated user id is taken; retry with another one"""
+
+
+class UserStore:
+    """Interface implemented by every backend"""
+
+    def save_user(self, user_id, email, password_hash):
+        """Insert a user; raises EmailAlreadyRegistered or DuplicateUserId on a key clash"""
+        raise NotImplementedError
+
+    def update_password(self, email, password_hash):
+        """Returns True if a user was updated, False if the email is unknown"""
+        raise NotImplementedError
+
+    def find_user_id(self, email):
+        """Returns the user id for ``email`` or None"""
+        raise NotImplementedError
+
+    def existing_emails(self, emails):
+        """Returns the subset of ``emails`` that already have an account"""
+        raise NotImplementedError
+
+    def insert_users(self, users, new_id=generate_user_id):
+        """Insert ``(user_id, email, password_hash, ...)`` rows in bulk; returns the rows stored.
+
+        Rows whose email is already registered are skipped. A row whose id
+        is taken is stored under an id from ``new_id()`` instead, and is
+        returned with that id.
+        """
+        raise NotImplementedError
+
+    def _insert_each(self, users, new_id):
+        """Row-by-row fallback for insert_users once the batch has hit a key clash"""
+        stored = []
+        for user in users:
+            user = tuple(user)
+            for _ in range(INSERT_ID_ATTEMPTS):
+                try:
+                    self.save_user(*user[:3])
+                except EmailAlreadyRegistered:
+                    break
+                except DuplicateUserId:
+                    user = (new_id(),) + user[1:]
+                    continue
+                stored.append(user)
+                break
+            else:
+                raise StorageError(f'No free user id for {user[1]} after {INSERT_ID_ATTEMPTS} attempts')
+        return stored
+
+    def count(self):
+        raise NotImplementedError
+
+    def iter_emails(self):
+        raise NotImplementedError
+
+    def iter_users(self, after=None, chunk_size=1000):
+        """Yield ``(id, email, created_at)`` in ``(created_at, id)`` order.
+
+        ``created_at`` is a ``'YYYY-MM-DD HH:MM:SS'`` string. With ``after``,
+        a ``(created_at, id)`` pair, the stream starts just past that row,
+        so an interrupted export can resume from the last row it wrote.
+        Rows are read ``chunk_size`` at a time.
+        """
+        raise NotImplementedError
+
+    def stats(self):
+        return {}
+
+    def close(self):
+        pass
+
+
+def _timestamp(value):
+    return value.strftime('%Y-%m-%d %H:%M:%S') if isinstance(value, datetime) else value
+
+
+# ---------------- MySQL ----------------
+_INSERT = "INSERT INTO users (id,email,password_hash) VALUES (%s,%s,%s)"
+_UPDATE = "UPDATE users SET password_hash=%s WHERE email=%s"
+_SELECT_ID = "SELECT id FROM users WHERE email=%s"
+
+
+class MySQLUserStore(UserStore):
+    """Users in MySQL/MariaDB, through a ConnectionPool.
+
+    The single-row statements run as server-side prepared statements. Each
+    pooled connection keeps its prepared cursors, so a statement is parsed
+    once per connection instead of once per request.
+    """
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    def _acquire(self):
+        import mysql.connector
+        try:
+            with metrics.timed('db_checkout'):
+                return self.pool.acquire()
+        except (mysql.connector.Error, TimeoutError) as err:
+            raise StorageError(f'Database connection error: {err}') from err
+
+    @contextmanager
+    def _connection(self):
+        import mysql.connector
+        conn = self._acquire()
+        discard = False
+        try:
+            yield conn
+        except mysql.connector.Error as err:
+            discard = not conn.is_connected()
+            raise StorageError(str(err)) from err
+        finally:
+            self.pool.release(conn, discard=discard)
+
+    @staticmethod
+    def _prepared(conn, statement):
+        cursors = getattr(conn, '_prepared_cursors', None)
+        if cursors is None:
+            cursors = conn._prepared_cursors = {}
+        cursor = cursors.get(statement)
+        if cursor is None:
+            cursor = cursors[statement] = conn.cursor(prepared=True)
+        return cursor
+
+    def save_user(self, user_id, email, password_hash):
+        import mysql.connector
+        from mysql.connector import errorcode
+        with self._connection() as conn:
+            try:
+                with metrics.timed('db_save_user'):
+                    self._prepared(conn, _INSERT).execute(_INSERT, (user_id, email, password_hash))
+                    conn.commit()
+            except mysql.connector.IntegrityError as err:
+                conn.rollback()
+                if err.errno != errorcode.ER_DUP_ENTRY:
+                    raise
+                if "PRIMARY'" in err.msg:      # MySQL 8 reports 'users.PRIMARY'
+                    raise DuplicateUserId(user_id) from err
+                raise EmailAlreadyRegistered(email) from err
+
+    def update_password(self, email, password_hash):
+        with self._connection() as conn:
+            with metrics.timed('db_update_password'):
+                cur = self._prepared(conn, _UPDATE)
+                cur.execute(_UPDATE, (password_hash, email))
+                updated = cur.rowcount > 0
+                conn.commit()
+        return updated
+
+    def find_user_id(self, email):
+        with self._connection() as conn:
+            with metrics.timed('db_user_exists'):
+                cur = self._prepared(conn, _SELECT_ID)
+                cur.execute(_SELECT_ID, (email,))
+                rows = cur.fetchall()
+        return rows[0][0] if rows else None
+
+    def existing_emails(self, emails):
+        emails = list(emails)
+        if not emails:
+            return set()
+        placeholders = ','.join(['%s'] * len(emails))
+        with self._connection() as conn, conn.cursor() as cur:
+            cur.execute(f"SELECT email FROM users WHERE email IN ({placeholders})", emails)
+            return {row[0] for row in cur.fetchall()}
+
+    def insert_users(self, users, new_id=generate_user_id):
+        """The whole batch goes in with one multi-row INSERT; if it collides
+        with existing rows, fall back to one by one."""
+        import mysql.connector
+        with self._connection() as conn:
+            try:
+                with conn.cursor() as cur:
+                    cur.executemany(_INSERT, [user[:3] for user in users])
+                conn.commit()
+                return list(users)
+            except mysql.connector.IntegrityError:
+                conn.rollback()
+        return self._insert_each(users, new_id)
+
+    def count(self):
+        with self._connection() as conn, conn.cursor() as cur:
+            cur.execute("SELECT COUNT(*) FROM users")
+            return cur.fetchone()[0]
+
+    def iter_emails(self):
+        with self._connection() as conn, conn.cursor() as cur:
+            cur.execute("SELECT email FROM users")
+            for (email,) in cur:
+                yield email
+
+    def iter_users(self, after=None, chunk_size=1000):
+        """Streams through an unbuffered cursor, so the result set is never held in memory"""
+        import mysql.connector
+        sql = "SELECT id, email, created_at FROM users"
+        params = ()
+        if after:
+            sql += " WHERE created_at > %s OR (created_at = %s AND id > %s)"
+            params = (after[0], after[0], after[1])
+        sql += " ORDER BY created_at, id"
+        conn = self._acquire()
+        finished = False
+        try:
+            cur = conn.cursor()
+            # A slow reader must not trip the server's write timeout mid-stream
+            cur.execute("SET SESSION net_write_timeout = 3600")
+            cur.execute(sql, params)
+            while True:
+                rows = cur.fetchmany(chunk_size)
+                if not rows:
+                    break
+                for user_id, email, created_at in rows:
+                    yield user_id, email, _timestamp(created_at)
+            cur.close()
+            finished = True
+        except mysql.connector.Error as err:
+            raise StorageError(str(err)) from err
+        finally:
+            # Abandoned mid-stream, the connection still has unread rows: close it instead of pooling it
+            self.pool.release(conn, discard=not finished)
+
+    def stats(self):
+        return self.pool.stats()
+
+    def close(self):
+        self.pool.close()
+
+
+# ---------------- SQLite ----------------
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id TEXT PRIMARY KEY,
+    email TEXT NOT NULL UNIQUE,
+    password_hash TEXT NOT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS idx_users_created ON users (created_at, id);
+"""
+
+
+class SQLiteUserStore(UserStore):
+    """Users in a SQLite file (or ``':memory:'``), one connection per thread.
+
+    An in-memory database is private to each connection, so ``':memory:'``
+    is only useful from a single thread.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+        self._db()      # create the schema up front
+
+    def _db(self):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            db.executescript(SQLITE_SCHEMA)
+            self._local.db = db
+            with self._lock:
+                self._connections.append(db)
+        return db
+
+    @contextmanager
+    def _errors(self):
+        try:
+            yield
+        except sqlite3.Error as err:
+            raise StorageError(str(err)) from err
+
+    def save_user(self, user_id, email, password_hash):
+        with self._errors():
+            try:
+                with metrics.timed('db_save_user'):
+                    self._db().execute("INSERT INTO users (id,email,password_hash) VALUES (?,?,?)",
+                                       (user_id, email, password_hash))
+            except sqlite3.IntegrityError as err:
+                if 'users.id' in str(err):
+                    raise DuplicateUserId(user_id) from err
+                if 'users.email' in str(err):
+                    raise EmailAlreadyRegistered(email) from err
+                raise StorageError(str(err)) from err
+
+    def update_password(self, email, password_hash):
+        with self._errors(), metrics.timed('db_update_password'):
+            cur = self._db().execute("UPDATE users SET password_hash=? WHERE email=?", (password_hash, email))
+            return cur.rowcount > 0
+
+    def find_user_id(self, email):
+        with self._errors(), metrics.timed('db_user_exists'):
+            row = self._db().execute("SELECT id FROM users WHERE email=?", (email,)).fetchone()
+        return row[0] if row else None
+
+    def existing_emails(self, emails):
+        emails = list(emails)
+        if not emails:
+            return set()
+        placeholders = ','.join('?' * len(emails))
+        with self._errors():
+            rows = self._db().execute(f"SELECT email FROM users WHERE email IN ({placeholders})", emails)
+            return {row[0] for row in rows}
+
+    def insert_users(self, users, new_id=generate_user_id):
+        db = self._db()
+        with self._errors():
+            try:
+                db.execute('BEGIN')
+                db.executemany("INSERT INTO users (id,email,password_hash) VALUES (?,?,?)", [user[:3] for user in users])
+                db.execute('COMMIT')
+                return list(users)
+            except sqlite3.IntegrityError:
+                db.execute('ROLLBACK')
+            except BaseException:
+                # Never hand the thread's connection back with the batch still open
+                if db.in_transaction:
+                    db.execute('ROLLBACK')
+                raise
+        return self._insert_each(users, new_id)
+
+    def count(self):
+        with self._errors():
+            return self._db().execute("SELECT COUNT(*) FROM users").fetchone()[0]
+
+    def iter_emails(self):
+        with self._errors():
+            for (email,) in self._db().execute("SELECT email FROM users"):
+                yield email
+
+    def iter_users(self, after=None, chunk_size=1000):
+        sql = "SELECT id, email, created_at FROM users"
+        params = ()
+        if after:
+            sql += " WHERE created_at > ? OR (created_at = ? AND id > ?)"
+            params = (after[0], after[0], after[1])
+        sql += " ORDER BY created_at, id"
+        with self._errors():
+            cur = self._db().execute(sql, params)
+            try:
+                while True:
+                    rows = cur.fetchmany(chunk_size)
+                    if not rows:
+                        break
+                    yield from rows
+            finally:
+                cur.close()
+
+    def close(self):
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for db in connections:
+            db.close()
+        self._local = threading.local()
+
+
+# ---------------- Sharding ----------------
+class ShardedUserStore(UserStore):
+    """Routes each user to one of ``shards`` by a hash of the email.
+
+    Placement is ``blake2b(email) mod len(shards)``, so the shard list must
+    not be reordered, and changing its length means moving users between
+    shards. User ids are only unique within a shard; the random 32-bit ids
+    make cross-shard clashes rare, and nothing looks users up by id.
+    """
+
+    def __init__(self, shards):
+        if not shards:
+            raise ValueError('ShardedUserStore needs at least one shard')
+        self.shards = list(shards)
+
+    def shard_for(self, email):
+        digest = hashlib.blake2b(email.encode('utf-8'), digest_size=8).digest()
+        return self.shards[int.from_bytes(digest, 'big') % len(self.shards)]
+
+    def _group(self, items, email_of):
+        groups = {}
+        for item in items:
+            groups.setdefault(id(self.shard_for(email_of(item))), []).append(item)
+        by_id = {id(shard): shard for shard in self.shards}
+        return [(by_id[key], group) for key, group in groups.items()]
+
+    def save_user(self, user_id, email, password_hash):
+        return self.shard_for(email).save_user(user_id, email, password_hash)
+
+    def update_password(self, email, password_hash):
+        return self.shard_for(email).update_password(email, password_hash)
+
+    def find_user_id(self, email):
+        return self.shard_for(email).find_user_id(email)
+
+    def existing_emails(self, emails):
+        found = set()
+        for shard, group in self._group(emails, lambda email: email):
+            found |= shard.existing_emails(group)
+        return found
+
+    def insert_users(self, users, new_id=generate_user_id):
+        stored = []
+        for shard, group in self._group(users, lambda user: user[1]):
+            stored += shard.insert_users(group, new_id)
+        return stored
+
+    def count(self):
+        return sum(shard.count() for shard in self.shards)
+
+    def iter_emails(self):
+        for shard in self.shards:
+            yield from shard.iter_emails()
+
+    def iter_users(self, after=None, chunk_size=1000):
+        """Merges the shards' ordered streams; each holds a connection until the export ends"""
+        streams = [shard.iter_users(after, chunk_size) for shard in self.shards]
+        return heapq.merge(*streams, key=lambda row: (row[2], row[0]))
+
+    def stats(self):
+        totals = {}
+        for shard in self.shards:
+            for key, value in shard.stats().items():
+                if isinstance(value, (int, float)):
+                    totals[key] = totals.get(key, 0) + value
+        totals['shards'] = len(self.shards)
+        return totals
+
+    def close(self):
+        for shard in self.shards:
+            shard.close()
@@ -0,0 +1,93 @@
+import asyncio
+import os
+import socket
+import sys
+import threading
+import time
+from email.message import EmailMessage
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+pytest.importorskip('aiosmtplib')
+aiosmtpd_controller = pytest.importorskip('aiosmtpd.controller')
+
+from async_sender import AsyncSMTPSender
+
+
+class SlowHandler:
+    def __init__(self, delay):
+        self.delay = delay
+
+    async def handle_DATA(self, server, session, envelope):
+        await asyncio.sleep(self.delay)
+        return '250 OK'
+
+
+class SlowStartSender(AsyncSMTPSender):
+    """Widens the window between starting the loop thread and creating the loop"""
+
+    def _run_loop(self, ready):
+        time.sleep(0.2)
+        super()._run_loop(ready)
+
+
+@pytest.fixture
+def smtp_server():
+    def serve(delay=0.0):
+        with socket.socket() as probe:
+            probe.bind(('127.0.0.1', 0))
+            port = probe.getsockname()[1]
+        controller = aiosmtpd_controller.Controller(SlowHandler(delay), hostname='127.0.0.1', port=port)
+        controller.start()
+        servers.append(controller)
+        return controller.hostname, controller.port
+    servers = []
+    yield serve
+    for controller in servers:
+        controller.stop()
+
+
+def message(n=0):
+    msg = EmailMessage()
+    msg['From'] = 'noreply@example.com'
+    msg['To'] = f'user{n}@example.com'
+    msg['Subject'] = 'test'
+    msg.set_content('hello')
+    return msg
+
+
+def test_concurrent_first_submits(smtp_server):
+    host, port = smtp_server()
+    sender = SlowStartSender(host, port, use_tls=False, sessions=2)
+    futures, errors = [], []
+
+    def submit(n):
+        try:
+            futures.append(sender.submit(message(n)))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=submit, args=(n,)) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    try:
+        assert errors == []
+        for future in futures:
+            future.result(10)
+    finally:
+        sender.stop()
+
+
+def test_stop_timeout_cancels_instead_of_raising(smtp_server):
+    host, port = smtp_server(delay=2.0)
+    sender = AsyncSMTPSender(host, port, use_tls=False, sessions=1)
+    futures = [sender.submit(message(n)) for n in range(3)]
+    sender.stop(timeout=0.5)
+    assert sender._thread is None
+    for future in futures:
+        assert future.done()
+    assert futures[-1].cancelled()
@@ -0,0 +1,92 @@
+import hashlib
+import math
+import threading
+import time
+from collections import OrderedDict
+
+ABSENT = object()   # cached "no user with this email"
+
+
+class UserLookupCache:
+    """Bounded LRU cache of email -> user id, including known-absent emails.
+
+    Positive entries live for ``ttl`` seconds; negative ones only for
+    ``negative_ttl`` because another worker may register the address.
+    Writers keep it current through ``put()``/``invalidate()``.
+    """
+
+    def __init__(self, max_entries=50000, ttl=3600, negative_ttl=30):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._entries = OrderedDict()      # email -> (value, expires_at)
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'negative_hits': 0, 'misses': 0}
+
+    def get(self, email):
+        """Return the cached user id, ABSENT, or None when unknown"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(email)
+            if entry is None or entry[1] <= now:
+                if entry is not None:
+                    del self._entries[email]
+                self._stats['misses'] += 1
+                return None
+            self._entries.move_to_end(email)
+            self._stats['negative_hits' if entry[0] is ABSENT else 'hits'] += 1
+            return entry[0]
+
+    def put(self, email, user_id):
+        """Record ``user_id`` for ``email`` (or ABSENT)"""
+        ttl = self.negative_ttl if user_id is ABSENT else self.ttl
+        with self._lock:
+            self._entries[email] = (user_id, time.monotonic() + ttl)
+            self._entries.move_to_end(email)
+            if len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, email):
+        with self._lock:
+            self._entries.pop(email, None)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._entries)
+        lookups = stats['hits'] + stats['negative_hits'] + stats['misses']
+        stats['hit_rate'] = round((stats['hits'] + stats['negative_hits']) / lookups, 4) if lookups else 0.0
+        return stats
+
+
+class BloomFilter:
+    """Bloom filter over strings, sized for ``capacity`` items at ``error_rate``.
+
+    ``email in bloom`` is False only if the email was never added, so a
+    negative answer can skip the database entirely.
+    """
+
+    def __init__(self, capacity, error_rate=0.001):
+        capacity = max(1, capacity)
+        self.num_bits = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self._bits = bytearray((self.num_bits + 7) // 8)
+        self._lock = threading.Lock()
+        self.count = 0
+
+    def _positions(self, item):
+        digest = hashlib.blake2b(item.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def add(self, item):
+        positions = self._positions(item)
+        with self._lock:
+            for pos in positions:
+                self._bits[pos >> 3] |= 1 << (pos & 7)
+            self.count += 1
+
+    def __contains__(self, item):
+        bits = self._bits
+        return all(bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(item))
@@ -0,0 +1,210 @@
+"""Email address validation.
+
+Standard library only (dnspython is needed for MX checks), so CLI tools can
+import it without loading Flask or the database and SMTP backends.
+"""
+import re
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+
+# RFC 5322 dot-atom local part; RFC 1035 labels with an alphabetic or punycode TLD.
+# Quoted local parts and address literals are valid but not accepted here.
+_ATEXT = r"[A-Za-z0-9!#$%&'*+/=?^_`{|}~-]"
+_LABEL = r"[A-Za-z0-9](?:[A-Za-z0-9-]{0,61}[A-Za-z0-9])?"
+_DOMAIN = rf"(?:{_LABEL}\.)+(?:[A-Za-z]{{2,63}}|xn--[A-Za-z0-9-]{{1,59}})"
+_LOCAL_RE = re.compile(rf"{_ATEXT}+(?:\.{_ATEXT}+)*")
+_DOMAIN_RE = re.compile(_DOMAIN)
+
+MAX_LOCAL_LENGTH = 64
+MAX_DOMAIN_LENGTH = 253
+MAX_ADDRESS_LENGTH = 254
+
+# Throwaway-inbox providers; subdomains are blocked too. Extend with load_domain_list().
+DISPOSABLE_DOMAINS = frozenset({
+    '10minutemail.com', '20minutemail.com', 'discard.email', 'dispostable.com', 'emailondeck.com',
+    'fakeinbox.com', 'getairmail.com', 'getnada.com', 'guerrillamail.com', 'guerrillamail.net',
+    'guerrillamailblock.com', 'mailcatch.com', 'maildrop.cc', 'mailinator.com', 'mailnesia.com',
+    'mintemail.com', 'mohmal.com', 'mytemp.email', 'sharklasers.com', 'spamgourmet.com',
+    'temp-mail.org', 'tempail.com', 'tempmail.com', 'tempmailo.com', 'throwawaymail.com',
+    'trashmail.com', 'trashmail.de', 'yopmail.com', 'yopmail.fr',
+})
+
+
+@lru_cache(maxsize=65536)
+def ascii_domain(domain):
+    """Lower-case ASCII form of ``domain`` (IDNs become punycode), or None if it is not a valid host name.
+
+    Cached: bulk lists repeat a few domains many times, and IDNA encoding is slow.
+    """
+    domain = domain.lower()
+    if not domain.isascii():
+        try:
+            domain = domain.encode('idna').decode('ascii')
+        except UnicodeError:
+            return None
+    if len(domain) > MAX_DOMAIN_LENGTH or _DOMAIN_RE.fullmatch(domain) is None:
+        return None
+    return domain
+
+
+def normalize_email(email):
+    """Return the address with a lower-case ASCII (punycode) domain, or None if it is invalid"""
+    local, sep, domain = email.strip().rpartition('@')
+    if not sep or len(local) > MAX_LOCAL_LENGTH or _LOCAL_RE.fullmatch(local) is None:
+        return None
+    domain = ascii_domain(domain)
+    if domain is None or len(local) + len(domain) + 1 > MAX_ADDRESS_LENGTH:
+        return None
+    return f'{local}@{domain}'
+
+
+def load_domain_list(path):
+    """Read one domain per line (``#`` comments allowed) into a frozenset"""
+    with open(path, encoding='utf-8') as f:
+        return frozenset(line.split('#', 1)[0].strip().lower() for line in f) - {''}
+
+
+def dns_mx_resolver(timeout=2.0):
+    """Resolver for MXCache backed by dnspython.
+
+    Returns True if the domain accepts mail (an MX record, or an A record
+    standing in for one), False if it cannot (NXDOMAIN, no records, or a
+    null MX), and None when DNS did not give an answer in time.
+    """
+    try:
+        import dns.exception
+        import dns.resolver
+    except ImportError:  # optional: only needed for MX checks
+        raise RuntimeError('MX checks require dnspython (pip install dnspython)')
+    resolver = dns.resolver.Resolver()
+    resolver.lifetime = timeout
+
+    def resolve(domain):
+        try:
+            answer = resolver.resolve(domain, 'MX')
+            return any(str(record.exchange) != '.' for record in answer)
+        except dns.resolver.NXDOMAIN:
+            return False
+        except dns.resolver.NoAnswer:
+            pass
+        except dns.exception.DNSException:
+            return None
+        try:
+            resolver.resolve(domain, 'A')
+            return True
+        except (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer):
+            return False
+        except dns.exception.DNSException:
+            return None
+
+    return resolve
+
+
+class MXCache:
+    """Bounded LRU cache of domain -> can receive mail, in front of ``resolver(domain)``.
+
+    Answers are kept for ``ttl`` seconds, "no mail" answers for
+    ``negative_ttl``. A domain the resolver could not decide (None) is
+    treated as deliverable and not cached, so a DNS outage never blocks
+    sign-ups.
+    """
+
+    def __init__(self, resolver, ttl=3600, negative_ttl=300, max_entries=100000):
+        self.resolver = resolver
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()      # domain -> (accepts_mail, expires_at)
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'lookup_failures': 0}
+
+    def accepts_mail(self, domain):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(domain)
+            if entry is not None and entry[1] > now:
+                self._entries.move_to_end(domain)
+                self._stats['hits'] += 1
+                return entry[0]
+            self._stats['misses'] += 1
+        result = self.resolver(domain)
+        if result is None:
+            with self._lock:
+                self._stats['lookup_failures'] += 1
+            return True
+        ttl = self.ttl if result else self.negative_ttl
+        with self._lock:
+            self._entries[domain] = (result, time.monotonic() + ttl)
+            self._entries.move_to_end(domain)
+            if len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return result
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._entries)
+        return stats
+
+
+class EmailValidator:
+    """Syntax, disposable-domain and (optionally) MX checks for addresses.
+
+    ``check(email)`` returns ``(normalized, None)`` for an acceptable address
+    or ``(normalized_or_None, reason)`` with reason ``'syntax'``,
+    ``'disposable'`` or ``'no_mx'``. Domains are checked together with their
+    parent domains, so ``x.mailinator.com`` is caught by ``mailinator.com``.
+    """
+
+    def __init__(self, disposable_domains=DISPOSABLE_DOMAINS, mx_cache=None):
+        self.disposable_domains = frozenset(disposable_domains)
+        self.mx_cache = mx_cache
+        # raw domain -> (ASCII domain or None, is disposable), memoized per validator
+        self._domain_info = lru_cache(maxsize=65536)(self._inspect_domain)
+
+    def _inspect_domain(self, domain):
+        domain = ascii_domain(domain)
+        return domain, domain is not None and self.is_disposable(domain)
+
+    def is_disposable(self, domain):
+        blocked = self.disposable_domains
+        if domain in blocked:
+            return True
+        # Walk up through parent domains; listed domains have at least two labels
+        dot = domain.find('.')
+        while domain.find('.', dot + 1) > 0:
+            domain = domain[dot + 1:]
+            if domain in blocked:
+                return True
+            dot = domain.find('.')
+        return False
+
+    def check(self, email):
+        local, sep, domain = email.strip().rpartition('@')
+        if not sep or len(local) > MAX_LOCAL_LENGTH or _LOCAL_RE.fullmatch(local) is None:
+            return None, 'syntax'
+        domain, disposable = self._domain_info(domain)
+        if domain is None or len(local) + len(domain) + 1 > MAX_ADDRESS_LENGTH:
+            return None, 'syntax'
+        address = f'{local}@{domain}'
+        if disposable:
+            return address, 'disposable'
+        if self.mx_cache is not None and not self.mx_cache.accepts_mail(domain):
+            return address, 'no_mx'
+        return address, None
+
+    def check_many(self, emails):
+        """Yield ``(email, normalized, reason)`` for each address; MX lookups are cached per domain"""
+        check = self.check
+        for email in emails:
+            yield (email, *check(email))
+
+
+_default_validator = EmailValidator()
+
+
+def validate_email(email):
+    """True if ``email`` is well formed and not from a disposable-mail domain (no DNS lookups)"""
+    return _default_validator.check(email)[1] is None